@@ -1,17 +1,57 @@
 import asyncio
 import os
+import signal
+import sys
+import time
+import warnings
+import zlib
 from . import render
 from . import entity
+from . import inbox
+from . import protocol
+from . import screen
+from . import inputs
 import curses
 import websockets
 import json
 
+# Server to play on. Players are put in a public room that has space left, or
+# in the room named on the command line: python -m game <room>
+SERVER_URL = "ws://e-itheta.com"
+
+# Fastest state update rate in Hz to ask the server for. The server may send
+# less often if the connection can't keep up
+MAX_UPDATE_RATE = 60
+
+# Most frames drawn per second. Frames are only drawn when something changed
+MAX_FPS = screen.MAX_FPS
+
+# Acknowledge received frames this often, in seconds, so the server can
+# measure our latency
+ACK_INTERVAL = 0.25
+
+# What each cell of the map sees, precomputed with
+# python -m game.fov precompute maps/mst_campus.fov. Computed as the player
+# walks around when the file is missing
+VISIBILITY_FILE = "maps/mst_campus.fov"
+
+# Loaded before curses takes over the terminal, so the warning below stays
+# readable
+with open("maps/mst_campus.txt", "r") as fp:
+    mapdata = render.Map(fp)
+if os.path.exists(VISIBILITY_FILE):
+    try:
+        mapdata.visibility.load(VISIBILITY_FILE)
+    except (ValueError, OSError, zlib.error) as error:
+        # Most likely computed before the walls changed
+        warnings.warn(f"ignoring {VISIBILITY_FILE}: {error}. Visibility is computed as you walk instead")
+
+
 @curses.wrapper
 def main(stdscr: curses.window):
     stdscr.nodelay(1)
-    
-    with open("maps/mst_campus.txt", "r") as fp:
-            mapdata = render.Map(fp)
+    display = screen.Screen(stdscr)
+    frames = screen.FrameScheduler(MAX_FPS)
 
 
     player = entity.Entity("@", "Player")
@@ -23,7 +63,8 @@ def main(stdscr: curses.window):
     async def _main():
 
         # Connect to Kevin's websocket server that he hosts
-        async with websockets.connect("ws://e-itheta.com/picklehacks-2021") as ws:
+        room = sys.argv[1] if len(sys.argv) > 1 else ""
+        async with websockets.connect(f"{SERVER_URL}/{room}") as ws:
 
             #Get entity data from server
             message = json.loads(await ws.recv())
@@ -31,84 +72,119 @@ def main(stdscr: curses.window):
             char = player.reprchar = message["reprchar"]
             player.id = message["id"]
 
+            # Moves are shown right away and sent to the server as input
+            # commands, see inputs.py. Walls and entities block the way
+            predictor = inputs.Predictor(message["pos"], mapdata.passable)
+
+            # Use the compact binary protocol if the server speaks it
+            handshake = { "rate": MAX_UPDATE_RATE }
+            if protocol.BINARY in message.get("protocols", ()):
+                handshake["protocol"] = protocol.BINARY
+            await ws.send(json.dumps(handshake))
+
+            # Local copy of the server entity table, kept up to date by
+            # applying keyframes and deltas. The map is only updated from it
+            # once per drawn frame, see inbox.py
+            state = inbox.Inbox(player.id)
+
             async def update_frame(ws):
+                last_ack = 0
                 async for message in ws:
-                    data = json.loads(message)
-                    mapdata.update_data(data)
-                    
-                    
-                    
-                    if str(player.id) in data:
-                        playerdata = data[str(player.id)]
-                        if playerdata["petrified"]:
-                            player.reprchar = "X"
-                        else:
-                            player.reprchar = char
-                    
+                    tick = state.receive(message)
+
+                    # Acks also tell the server how many frames we had to
+                    # skip drawing
+                    now = time.monotonic()
+                    if tick is not None and now - last_ack >= ACK_INTERVAL:
+                        last_ack = now
+                        await ws.send(json.dumps({ "ack": tick, "stale": state.stale }))
+
+                    frames.request()
 
 
             loop.create_task(update_frame(ws))
 
-            for game_map in camera:
-                
+            # Draw a frame whenever a key is pressed or the terminal resized.
+            # curses reads the keys from stdin
+            frames.watch(sys.stdin.fileno())
+            resized = [False]
+            def on_resize():
+                resized[0] = True
+                frames.request()
+            if hasattr(signal, "SIGWINCH"):
+                loop.add_signal_handler(signal.SIGWINCH, on_resize)
+
+            view = None
+            views = iter(camera)
+            frames.request()
+            while True:
+                await frames.wait()
+
+                if resized[0]:
+                    resized[0] = False
+                    columns, lines = os.get_terminal_size()
+                    curses.resizeterm(lines, columns)
+
+                # Show the newest state the server sent. The player is drawn
+                # where it is predicted to be, not where the server last saw
+                # it
+                if state.take():
+                    mapdata.update_entities(state.map_entities())
+                    petrified = state.petrified()
+                    if petrified is not None:
+                        if petrified:
+                            player.reprchar = "X"
+                        else:
+                            player.reprchar = char
+                answer = state.take_input_answer()
+                if answer is not None:
+                    # The server processed our input commands up to answer[0]
+                    predictor.reconcile(*answer)
+                    player.position[:] = predictor.position
+
                 # Update map if terminal size changes
                 render.Map.lines, render.Map.columns = stdscr.getmaxyx()
-                keysym = stdscr.getch()
-                if keysym != curses.ERR: # in non blocking mode, curses.ERR
+
+                # Tell the server how much of the map we can see so it only
+                # sends the entities around us
+                if view != (render.Map.lines, render.Map.columns):
+                    view = (render.Map.lines, render.Map.columns)
+                    await ws.send(json.dumps({ "view": view }))
+
+                while True:
+                    keysym = stdscr.getch()
+                    if keysym == curses.ERR: # in non blocking mode, no more keys
+                        break
                     keysym = chr(keysym) # cast to a string
-                else:
-                    keysym = ""
-                
-                last_pos = list(player.position)
-
-                tmp_pos = list(player.position)
-
-                # Update player position in 4 possible directions wasd
-                if keysym == "w":
-                    candidate = player.position[0] - 1
-                    if mapdata.data[candidate][player.position[1]] in render.TRAVERSABLE_CHARS: # determine whether candidate position is legal, if not do nothing
-                        tmp_pos[0] -= 1
-                elif keysym == "s":
-                    candidate = player.position[0] + 1
-                    if mapdata.data[candidate][player.position[1]] in render.TRAVERSABLE_CHARS:
-                        tmp_pos[0] += 1
-                elif keysym == "a":
-                    candidate = player.position[1] - 1
-                    if mapdata.data[player.position[0]][candidate] in render.TRAVERSABLE_CHARS:
-                        tmp_pos[1] -= 1
-                elif keysym == "d":
-                    candidate = player.position[1] + 1
-                    if mapdata.data[player.position[0]][candidate] in render.TRAVERSABLE_CHARS:
-                        tmp_pos[1] += 1
-                
-                if last_pos != tmp_pos and player.reprchar != "X":
-                    player.position[:] = tmp_pos
-                    await ws.send(json.dumps(tmp_pos))
-                    
 
-                
+                    # Move in 4 possible directions wasd, if the cell is
+                    # traversable
+                    if player.reprchar != "X":
+                        command = predictor.press(keysym)
+                        if command is not None:
+                            player.position[:] = predictor.position
+                            await ws.send(json.dumps({ "input": command }))
+
+                # Pan the camera after the player
+                camera.fit()
+                camera.follow()
+                game_map = next(views)
+
                 player_pos = camera.relative_entity_position()
                 
 
-                render.apply_occlusion_layer(game_map, player_pos)
+                render.apply_occlusion_layer(
+                    game_map, player_pos, cache=mapdata.visibility, origin=tuple(camera.position)
+                )
                 player.render(camera)
-                stdscr.erase()
-                for row in game_map:
-                    try:
-                        stdscr.addstr("".join(row))
-                    except:
-                        pass
-                
-    
-                stdscr.refresh()
-    
-                await asyncio.sleep(1/60)
+
+                # Only what changed since the last frame is sent to the
+                # terminal, see screen.py
+                display.draw(camera.frame.lines())
     
     render.Map.columns,  render.Map.lines, = os.get_terminal_size()
     
     loop = asyncio.get_event_loop()
-    loop.create_task(camera.update_box())
-    loop.create_task(camera.update_position())
     loop.create_task(_main())
     loop.run_forever()
 
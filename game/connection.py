@@ -0,0 +1,230 @@
+"""
+Server side state of a single client connection.
+
+The broadcast system never awaits a socket. It pushes each encoded frame into
+the connection's bounded outbox and a writer task per connection drains it, so
+a slow or stalled client only ever delays itself.
+
+Each connection also has its own update rate. The server watches how deep the
+outbox gets and how long the client takes to acknowledge frames, and steps the
+rate down the RATES ladder when the client falls behind and back up once it
+keeps up again.
+"""
+
+from typing import *
+import asyncio
+import collections
+import json
+import time
+import websockets
+
+from . import inputs
+from . import interest
+from . import protocol
+from .tick import TICK_RATE
+
+
+# Frames a connection may have queued before it is considered to be falling
+# behind
+OUTBOX_SIZE = 4
+
+# Update rates in Hz a connection can be stepped through, fastest first. Each
+# must divide TICK_RATE
+RATES = (60, 30, 20, 10)
+
+# Frame latency (from being queued to being acknowledged by the client) above
+# which the rate is stepped down, and below which it may be stepped up again
+HIGH_LATENCY = 0.25
+LOW_LATENCY = 0.1
+
+# Seconds a connection has to keep up before its rate is stepped up, and the
+# minimum time between two steps down
+STEP_UP_AFTER = 2.0
+STEP_DOWN_AFTER = 0.5
+
+# Weight of the newest sample in the latency moving average
+LATENCY_SMOOTHING = 0.2
+
+
+class Connection:
+
+    def __init__(self, ws, player_id: int):
+        self.ws = ws
+        self.player_id = player_id
+
+        # Entities this connection is told about, see interest.py
+        self.interest = interest.Interest(player_id)
+
+        # Negotiated wire protocol, see protocol.py
+        self.protocol = protocol.JSON
+
+        # Send the full state on the next broadcast instead of a delta
+        self.needs_keyframe = True
+
+        # Movement commands from the client, see inputs.py
+        self.inputs = inputs.InputQueue()
+
+        self.outbox = collections.deque()
+
+        # Future the writer sleeps on while there is nothing to send. Made by
+        # the writer on the running loop, since connections may be created
+        # before it runs
+        self._wakeup = None  # type: Optional[asyncio.Future]
+
+        # Newest answer to the client's input commands that wasn't sent yet.
+        # Only the latest one matters, so it replaces an unsent one instead of
+        # queueing behind frames that may be dropped
+        self._input_answer = None  # type: Optional[str]
+
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.bytes_sent = 0
+
+        # Index into RATES of the current and of the fastest allowed rate
+        self.rate_index = 0
+        self.max_rate_index = 0
+
+        # Frames the client received but never drew because a newer one
+        # arrived first, as last reported in its acks. See inbox.py
+        self.stale_frames = 0
+
+        # Smoothed frame latency in seconds, None until the first ack
+        self.latency = None
+
+        # (tick, time queued) of frames not acknowledged yet
+        self._unacked = collections.deque(maxlen=4 * TICK_RATE)
+        self._dropped_seen = 0
+        self._last_rate_change = self._healthy_since = time.monotonic()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} : {self.player_id}>({self.protocol}, {self.rate} Hz)"
+
+    @property
+    def rate(self) -> int:
+        return RATES[self.rate_index]
+
+    @property
+    def divisor(self) -> int:
+        return TICK_RATE // self.rate
+
+    def due(self, tick: int) -> bool:
+        """
+        Whether a frame should be sent to this connection on <tick>
+        """
+        return tick % self.divisor == 0
+
+    def request_rate(self, rate: int):
+        """
+        Cap the update rate to the fastest rate in RATES not above <rate>, as
+        asked for by the client
+        """
+        for index, candidate in enumerate(RATES):
+            if candidate <= rate:
+                break
+        self.max_rate_index = index
+        if self.rate_index < index:
+            self._set_rate(index, time.monotonic())
+
+    def acknowledge(self, tick: int, now: float = None):
+        """
+        The client received the frame for <tick> and every frame before it
+        """
+        now = time.monotonic() if now is None else now
+        queued = None
+        while self._unacked and self._unacked[0][0] <= tick:
+            queued = self._unacked.popleft()[1]
+        if queued is None:
+            return
+        sample = now - queued
+        if self.latency is None:
+            self.latency = sample
+        else:
+            self.latency += LATENCY_SMOOTHING * (sample - self.latency)
+
+    def adapt(self, now: float = None):
+        """
+        Step the update rate down if the client is falling behind, or up if it
+        has been keeping up for STEP_UP_AFTER seconds. Changing the rate
+        requests a keyframe since the frames the client will get no longer
+        line up with the deltas it was sent
+        """
+        now = time.monotonic() if now is None else now
+        dropped = self.frames_dropped != self._dropped_seen
+        self._dropped_seen = self.frames_dropped
+
+        congested = (
+            dropped or len(self.outbox) > 1 or
+            (self.latency is not None and self.latency > HIGH_LATENCY)
+        )
+        if congested:
+            self._healthy_since = now
+            if self.rate_index + 1 < len(RATES) and now - self._last_rate_change >= STEP_DOWN_AFTER:
+                self._set_rate(self.rate_index + 1, now)
+            return
+
+        if self.latency is not None and self.latency > LOW_LATENCY:
+            self._healthy_since = now
+        elif self.rate_index > self.max_rate_index and now - self._healthy_since >= STEP_UP_AFTER:
+            self._set_rate(self.rate_index - 1, now)
+            self._healthy_since = now
+
+    def _set_rate(self, index: int, now: float):
+        self.rate_index = index
+        self._last_rate_change = now
+        self.needs_keyframe = True
+
+    def push(self, message: Union[str, bytes], tick: int, keyframe=False) -> bool:
+        """
+        Queue <message> for sending without waiting. A keyframe replaces
+        everything still queued. If the outbox is full the client is not
+        keeping up: the queued frames are stale, and since deltas cannot be
+        skipped they are all dropped and the client is resynchronized with a
+        keyframe on the next broadcast. Return whether <message> was queued
+        """
+        if keyframe:
+            self.frames_dropped += len(self.outbox)
+            self.outbox.clear()
+            self.needs_keyframe = False
+        elif len(self.outbox) >= OUTBOX_SIZE:
+            self.frames_dropped += len(self.outbox) + 1
+            self.outbox.clear()
+            self.needs_keyframe = True
+            return False
+
+        self.outbox.append(message)
+        self._unacked.append((tick, time.monotonic()))
+        self._wake()
+        return True
+
+    def confirm_input(self, seq: int, pos: Sequence[int]):
+        """
+        Tell the client that its input commands up to <seq> were processed and
+        left its player at <pos>. Sent ahead of any queued frames
+        """
+        self._input_answer = json.dumps({ "input": seq, "pos": list(pos) })
+        self._wake()
+
+    def _wake(self):
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    async def writer(self):
+        """
+        Send queued frames until the connection closes
+        """
+        try:
+            while True:
+                if not self.outbox and self._input_answer is None:
+                    self._wakeup = asyncio.get_event_loop().create_future()
+                    await self._wakeup
+                if self._input_answer is not None:
+                    message, self._input_answer = self._input_answer, None
+                    await self.ws.send(message)
+                    self.bytes_sent += len(message)
+                while self.outbox:
+                    message = self.outbox.popleft()
+                    await self.ws.send(message)
+                    self.frames_sent += 1
+                    self.bytes_sent += len(message)
+        except websockets.ConnectionClosed:
+            pass
@@ -0,0 +1,101 @@
+"""
+Delta compression of the entity state broadcast by the server.
+
+The server takes a Snapshot of its entity table every tick. Instead of sending
+the whole table to every client, it sends a keyframe (the full state) when a
+client connects and every KEYFRAME_INTERVAL ticks, and a delta containing only
+the entities that were added, changed or removed otherwise.
+"""
+
+from typing import *
+
+
+# Message types
+KEYFRAME = "keyframe"
+DELTA = "delta"
+
+# Send a full keyframe to every client this often (in ticks) so that a client
+# that somehow diverged resynchronizes
+KEYFRAME_INTERVAL = 60
+
+
+def freeze(value):
+    """
+    Return an immutable copy of a json compatible <value> that compares equal
+    to the frozen copy of any equal value. Entity states are mutated in place
+    by the server so they must be frozen to be compared across ticks
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class Snapshot:
+    """
+    Frozen copy of the entity table { id: { state } } at a given tick. <key>
+    makes the immutable copy of a state
+    """
+
+    def __init__(self, tick: int, entities: Mapping[int, Any], key: Callable[[Any], Hashable] = freeze):
+        self.tick = tick
+        self.states = { id: key(state) for id, state in entities.items() }
+
+    def diff(self, previous: "Snapshot") -> Tuple[List[int], List[int]]:
+        """
+        Return the ids that were added or changed and the ids that were removed
+        since the <previous> snapshot
+        """
+        old = previous.states
+        changed = [ id for id, state in self.states.items() if old.get(id) != state ]
+        removed = [ id for id in old if id not in self.states ]
+        return changed, removed
+
+
+def keyframe(tick: int, entities: Dict[int, dict]) -> dict:
+    return {
+        "type": KEYFRAME,
+        "tick": tick,
+        "entities": entities,
+    }
+
+
+def delta(tick: int, entities: Dict[int, dict], changed: Iterable[int], removed: Iterable[int],
+          enter: Iterable[int] = (), leave: Iterable[int] = ()) -> dict:
+    """
+    Build a delta message. <enter> and <leave> are the ids that came into or
+    went out of the receiving client's area of interest
+    """
+    message = {
+        "type": DELTA,
+        "tick": tick,
+        "changed": { id: entities[id] for id in changed },
+        "removed": list(removed),
+    }
+    if enter or leave:
+        message["enter"] = { id: entities[id] for id in enter }
+        message["leave"] = list(leave)
+    return message
+
+
+def apply_message(entities: Dict[str, dict], message: dict):
+    """
+    Apply a decoded broadcast <message> to the client side copy of the entity
+    table. Keys are strings since that is what json gives back. Messages from
+    servers that do not send deltas are the full entity table and are treated
+    as keyframes
+    """
+    kind = message.get("type")
+    if kind == DELTA:
+        entities.update(message["changed"])
+        entities.update(message.get("enter", ()))
+        for id in message["removed"]:
+            entities.pop(str(id), None)
+        for id in message.get("leave", ()):
+            entities.pop(str(id), None)
+    else:
+        if kind == KEYFRAME:
+            message = message["entities"]
+        entities.clear()
+        entities.update(message)
@@ -0,0 +1,459 @@
+"""
+Field of view. Given a chunk of the map and a viewer, work out which cells the
+viewer can see.
+
+shadowcast() is symmetric shadowcasting: each of the four quadrants around
+the viewer is scanned row by row outwards, and the slopes of the walls met so
+far narrow the part of the next row that is still lit. Slopes are kept as
+integer fractions, so rounding never leaves gaps, and the radius is a circle
+rather than the ends of a fixed number of rays. Every cell is looked at once,
+except the cells on the diagonals, which the two quadrants that share them
+both look at.
+
+Only the static walls of the map block the view, so a cell always sees the
+same cells. VisibilityCache keeps what each cell sees as a packed bitmask of
+the square around it, computed on first use and evicted least recently used,
+or precomputed for the whole map and loaded from a file:
+
+    MAGIC
+    header (rows, columns, radius, sha1 of the map's walls)
+    zlib( bitmap of the cells that have a mask, mask, mask, ... )
+
+ray_sweep() is the ray casting the client used before, kept to compare
+against:
+
+    python -m game.fov bench --radius=30 --frames=200
+    python -m game.fov precompute maps/mst_campus.fov
+
+Usage:
+  fov bench [--radius=<r>] [--size=<rows>x<cols>] [--frames=<n>] [--seed=<n>]
+  fov precompute <file> [--radius=<r>]
+
+Options:
+  --radius=<r>          View radius in cells [default: 30]
+  --size=<rows>x<cols>  Size of the chunk around the viewer [default: 61x121]
+  --frames=<n>          Viewer positions to time each engine on [default: 200]
+  --seed=<n>            Seed for the viewer positions [default: 0]
+"""
+
+from typing import *
+import collections
+import hashlib
+import math
+import os
+import random
+import struct
+import time
+import zlib
+
+import docopt
+
+
+MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../maps/mst_campus.txt")
+
+# Map quadrant coordinates, (depth, column) away from the viewer, to chunk
+# (row, col) offsets: north, east, south and west
+QUADRANTS = ((-1, 0, 0, 1), (0, 1, 1, 0), (1, 0, 0, 1), (0, -1, 1, 0))
+
+
+# Which cells of a chunk the viewer sees, one bytearray per row
+Visibility = List[bytearray]
+
+# Memory the masks of a VisibilityCache may take, not counting a loaded
+# precomputed file
+CACHE_BYTES = 4 * 1024 * 1024
+
+MAGIC = b"PKFOV\x01"
+FILE_HEADER = struct.Struct("<HHH20s")
+
+# The 8 cells of each byte of a packed mask, lowest bit first
+_UNPACK = [ bytes((byte >> bit) & 1 for bit in range(8)) for byte in range(256) ]
+_BITS = bytes.maketrans(bytes((0, 1)), b"01")
+
+
+def shadowcast(chunk: Sequence[Sequence[str]], pos: Tuple[int, int], radius: int,
+               opaque: Container[str]) -> Visibility:
+    """
+    Cells of <chunk> visible from <pos> within <radius>. Cells holding one of
+    the <opaque> characters block the view and are visible themselves
+    """
+    nrows, ncols = len(chunk), len(chunk[0])
+    visible = [ bytearray(ncols) for _ in range(nrows) ]
+    row, col = pos
+    if not (0 <= row < nrows and 0 <= col < ncols):
+        return visible
+    visible[row][col] = 1
+    # Cells up to <radius> + 0.5 away, so the edge of the circle is smooth
+    limit = radius * radius + radius
+
+    for drow_depth, dcol_depth, drow_col, dcol_col in QUADRANTS:
+        # Rows still to scan as (depth, start slope, end slope). A slope n/d
+        # is kept as the pair (n, d) with d > 0
+        rows = [(1, -1, 1, 1, 1)]
+        while rows:
+            depth, start_n, start_d, end_n, end_d = rows.pop()
+            if depth > radius:
+                continue
+            # Columns from round_ties_up(depth * start) to
+            # round_ties_down(depth * end)
+            first = (2 * depth * start_n + start_d) // (2 * start_d)
+            last = -((end_d - 2 * depth * end_n) // (2 * end_d))
+
+            previous = None  # whether the previous cell was a wall
+            for c in range(first, last + 1):
+                r_ = row + drow_depth * depth + drow_col * c
+                c_ = col + dcol_depth * depth + dcol_col * c
+                inside = 0 <= r_ < nrows and 0 <= c_ < ncols
+                wall = not inside or chunk[r_][c_] in opaque
+
+                if inside and depth * depth + c * c <= limit and (wall or (
+                    # Floors are only lit when their center is inside the
+                    # lit part of the row, which keeps the result symmetric
+                    c * start_d >= depth * start_n and c * end_d <= depth * end_n
+                )):
+                    visible[r_][c_] = 1
+
+                if previous and not wall:
+                    start_n, start_d = 2 * c - 1, 2 * depth
+                elif previous is False and wall:
+                    rows.append((depth + 1, start_n, start_d, 2 * c - 1, 2 * depth))
+                previous = wall
+
+            if previous is False:
+                rows.append((depth + 1, start_n, start_d, end_n, end_d))
+
+    return visible
+
+
+def ray_sweep(chunk: Sequence[Sequence[str]], pos: Tuple[int, int], radius: int,
+              opaque: Container[str]) -> Visibility:
+    """
+    Cells of <chunk> hit by 8 * <radius> rays of <radius> steps cast from
+    <pos>. Rays stop at the first <opaque> cell
+    """
+    nrows, ncols = len(chunk), len(chunk[0])
+    arc = math.pi / (4 * radius)
+
+    row, col = pos
+    render_set = set()
+    for s in range(8 * radius):
+        theta = s * arc
+        i_row, i_col = row, col
+        for i in range(radius):
+            i_row += math.sin(theta)
+            i_col += math.cos(theta)
+
+            (r, c) = textpos = math.floor(i_row), math.floor(i_col)
+            if not (0 <= r < nrows and 0 <= c < ncols):
+                break
+
+            render_set.add(textpos)
+            if chunk[r][c] in opaque:
+                break
+
+    visible = [ bytearray(ncols) for _ in range(nrows) ]
+    for r, c in render_set:
+        visible[r][c] = 1
+    return visible
+
+
+def occlude(chunk: List[List[str]], visible: Visibility, char: str):
+    """
+    Replace every cell of <chunk> that is not <visible> with <char>, in place
+    """
+    for line, seen in zip(chunk, visible):
+        first, last = seen.find(1), seen.rfind(1)
+        if first < 0:
+            line[:] = char * len(line)
+            continue
+        line[:first] = char * first
+        line[last + 1:] = char * (len(line) - last - 1)
+        for j in range(first + 1, last):
+            if not seen[j]:
+                line[j] = char
+
+
+def pack(visible: Visibility, width: int) -> bytes:
+    """
+    The rows of <visible>, <width> cells each, packed 8 cells to a byte
+    """
+    stride = (width + 7) // 8
+    return b"".join(
+        int(bytes(row[:width]).translate(_BITS)[::-1] or b"0", 2).to_bytes(stride, "little")
+        for row in visible
+    )
+
+
+def unpack_row(mask: bytes, row: int, width: int) -> bytes:
+    """
+    Row <row> of a packed <mask> with rows of <width> cells, one byte per cell
+    """
+    stride = (width + 7) // 8
+    return b"".join([ _UNPACK[byte] for byte in mask[row * stride:(row + 1) * stride] ])[:width]
+
+
+def opacity_digest(rows: Sequence[str], opaque: Container[str]) -> bytes:
+    """
+    Hash of where the walls of the map <rows> are. Anything else on the map
+    can change without changing what a cell sees
+    """
+    sha1 = hashlib.sha1(f"{len(rows)}x{len(rows[0])}".encode())
+    for line in rows:
+        sha1.update(bytes(char in opaque for char in line))
+    return sha1.digest()
+
+
+class VisibilityCache:
+    """
+    What each cell of the map <rows> sees within a radius, as a packed mask of
+    the (2 * radius + 1) square centered on the cell. Masks are computed with
+    shadowcast() on first use and kept up to <max_bytes>, least recently used
+    first out. A precomputed table loaded with load() is looked at first
+    """
+
+    def __init__(self, rows: Sequence[str], opaque: Container[str], max_bytes: int = CACHE_BYTES):
+        self.rows = rows
+        self.opaque = opaque
+        self.max_bytes = max_bytes
+        self.digest = opacity_digest(rows, opaque)
+
+        self.masks = collections.OrderedDict()  # type: Dict[Tuple[int, int, int], bytes]
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        # Precomputed masks of a single radius, one record per cell in
+        # <table> at the slot given by <slots>, -1 for cells without one
+        self.table_radius = None  # type: Optional[int]
+        self.table = b""
+        self.slots = []  # type: Sequence[int]
+
+        # Arguments and result of the last window() call, returned as is when
+        # neither the viewer nor the window moved
+        self._last = None
+        self._last_visible = None  # type: Optional[Visibility]
+
+    def __len__(self):
+        return len(self.masks)
+
+    def compute(self, row: int, col: int, radius: int) -> bytes:
+        size = 2 * radius + 1
+        top, left = max(0, row - radius), max(0, col - radius)
+        chunk = [ line[left:col + radius + 1] for line in self.rows[top:row + radius + 1] ]
+        visible = shadowcast(chunk, (row - top, col - left), radius, self.opaque)
+
+        # Pad the part of the square that is off the map
+        square = [ bytearray(size) for _ in range(size) ]
+        for r, line in enumerate(visible):
+            offset = left - (col - radius)
+            square[top - (row - radius) + r][offset:offset + len(line)] = line
+        return pack(square, size)
+
+    def lookup(self, row: int, col: int, radius: int) -> bytes:
+        """
+        The packed mask of what the cell at <row>, <col> sees within <radius>
+        """
+        if radius == self.table_radius:
+            slot = self.slots[row * len(self.rows[0]) + col]
+            if slot >= 0:
+                self.hits += 1
+                size = 2 * radius + 1
+                record = size * ((size + 7) // 8)
+                return self.table[slot * record:(slot + 1) * record]
+
+        key = (row, col, radius)
+        mask = self.masks.get(key)
+        if mask is not None:
+            self.hits += 1
+            self.masks.move_to_end(key)
+            return mask
+
+        self.misses += 1
+        mask = self.masks[key] = self.compute(row, col, radius)
+        self.nbytes += len(mask)
+        while self.nbytes > self.max_bytes and len(self.masks) > 1:
+            _, evicted = self.masks.popitem(last=False)
+            self.nbytes -= len(evicted)
+        return mask
+
+    def window(self, top: int, left: int, nrows: int, ncols: int, pos: Tuple[int, int],
+               radius: int) -> Visibility:
+        """
+        What the viewer at map cell <pos> sees of the <nrows> x <ncols> window
+        at <top>, <left> of the map
+        """
+        args = (top, left, nrows, ncols, pos, radius)
+        if args == self._last:
+            return self._last_visible
+
+        row, col = pos
+        size = 2 * radius + 1
+        mask = self.lookup(row, col, radius)
+
+        # Columns of the window the square covers, and where they start in
+        # the square
+        start = max(0, col - radius - left)
+        end = min(ncols, col + radius + 1 - left)
+        skip = start - (col - radius - left)
+
+        visible = []
+        for r in range(top, top + nrows):
+            dr = r - row + radius
+            if not 0 <= dr < size or start >= end:
+                visible.append(bytearray(ncols))
+                continue
+            line = bytearray(ncols)
+            line[start:end] = unpack_row(mask, dr, size)[skip:skip + end - start]
+            visible.append(line)
+
+        self._last, self._last_visible = args, visible
+        return visible
+
+    def update(self, rows: Sequence[str]):
+        """
+        Use the map <rows> from now on. Masks of the cells that can see a wall
+        that moved are dropped, and so is a precomputed table
+        """
+        previous = self.rows
+        self.rows = rows
+        digest = opacity_digest(rows, self.opaque)
+        if digest == self.digest:
+            return
+        self.digest = digest
+        self.table_radius, self.table, self.slots = None, b"", []
+        self._last = self._last_visible = None
+
+        if len(rows) != len(previous) or len(rows[0]) != len(previous[0]):
+            self.masks.clear()
+            self.nbytes = 0
+            return
+
+        changed = [
+            (r, c)
+            for r, (old, new) in enumerate(zip(previous, rows)) if old != new
+            for c, (a, b) in enumerate(zip(old, new)) if (a in self.opaque) != (b in self.opaque)
+        ]
+        for key in list(self.masks):
+            row, col, radius = key
+            if any(abs(r - row) <= radius and abs(c - col) <= radius for r, c in changed):
+                self.nbytes -= len(self.masks.pop(key))
+
+    def precompute(self, radius: int) -> Tuple[bytes, bytes]:
+        """
+        Masks of every cell that isn't a wall, as the presence bitmap and the
+        concatenated masks of the file format
+        """
+        nrows, ncols = len(self.rows), len(self.rows[0])
+        present = [ bytearray(char not in self.opaque for char in line) for line in self.rows ]
+        masks = b"".join(
+            self.compute(row, col, radius)
+            for row in range(nrows) for col in range(ncols) if present[row][col]
+        )
+        return pack([ bytearray(b"".join(present)) ], nrows * ncols), masks
+
+    def save(self, path: str, radius: int):
+        present, masks = self.precompute(radius)
+        nrows, ncols = len(self.rows), len(self.rows[0])
+        with open(path, "wb") as fp:
+            fp.write(MAGIC)
+            fp.write(FILE_HEADER.pack(nrows, ncols, radius, self.digest))
+            fp.write(zlib.compress(present + masks))
+
+    def load(self, path: str):
+        """
+        Look up the masks precomputed by save() in <path> from now on. Raise
+        ValueError if they were computed for a different map
+        """
+        with open(path, "rb") as fp:
+            if fp.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a visibility file")
+            header = fp.read(FILE_HEADER.size)
+            if len(header) != FILE_HEADER.size:
+                raise ValueError(f"{path} is truncated")
+            nrows, ncols, radius, digest = FILE_HEADER.unpack(header)
+            if digest != self.digest or (nrows, ncols) != (len(self.rows), len(self.rows[0])):
+                raise ValueError(f"{path} was computed for another map")
+            data = zlib.decompress(fp.read())
+
+        cells = nrows * ncols
+        present = unpack_row(data, 0, cells)
+        slots = [-1] * cells
+        slot = 0
+        for cell, bit in enumerate(present):
+            if bit:
+                slots[cell] = slot
+                slot += 1
+        self.table_radius = radius
+        self.table = data[(cells + 7) // 8:]
+        self.slots = slots
+        self._last = self._last_visible = None
+
+
+def bench(rows: Sequence[str], radius: int, size: Tuple[int, int], frames: int,
+          opaque: Container[str], seed: int = 0) -> Dict[str, dict]:
+    """
+    Time each engine on the same <frames> chunks of <size> cut out of the map
+    <rows>, each centered on a random cell the viewer can stand on. The cache
+    is timed on a second pass over the same cells, when every lookup hits
+    """
+    rng = random.Random(seed)
+    nrows, ncols = size
+    chunks = []
+    while len(chunks) < frames:
+        row, col = rng.randrange(len(rows)), rng.randrange(len(rows[0]))
+        if rows[row][col] in opaque:
+            continue
+        top = min(max(0, row - nrows // 2), len(rows) - nrows)
+        left = min(max(0, col - ncols // 2), len(rows[0]) - ncols)
+        chunk = [ list(line[left:left + ncols]) for line in rows[top:top + nrows] ]
+        chunks.append((chunk, (row - top, col - left), (top, left)))
+
+    cache = VisibilityCache(rows, opaque)
+    def cached(chunk, pos, radius, opaque, origin):
+        return cache.window(*origin, len(chunk), len(chunk[0]), (origin[0] + pos[0], origin[1] + pos[1]), radius)
+    for chunk, pos, origin in chunks:
+        cached(chunk, pos, radius, opaque, origin)
+
+    results = {}
+    engines = (
+        ("rays", lambda chunk, pos, radius, opaque, origin: ray_sweep(chunk, pos, radius, opaque)),
+        ("shadowcast", lambda chunk, pos, radius, opaque, origin: shadowcast(chunk, pos, radius, opaque)),
+        ("cached", cached),
+    )
+    for name, engine in engines:
+        visible = 0
+        started = time.perf_counter()
+        for chunk, pos, origin in chunks:
+            visible += sum(map(sum, engine(chunk, pos, radius, opaque, origin)))
+        elapsed = time.perf_counter() - started
+        results[name] = { "ms_per_frame": elapsed / frames * 1000, "visible_per_frame": visible / frames }
+    return results
+
+
+def start():
+    from . import render
+
+    args = docopt.docopt(__doc__)
+    radius = int(args["--radius"])
+    with open(MAP_FILE) as fp:
+        rows = render.Map(fp).data
+
+    if args["precompute"]:
+        started = time.perf_counter()
+        VisibilityCache(rows, render.OCCLUSION_CHARS).save(args["<file>"], radius)
+        print(f"{args['<file>']}: {os.path.getsize(args['<file>'])} bytes in {time.perf_counter() - started:.1f} s")
+        return
+
+    nrows, ncols = ( int(n) for n in args["--size"].split("x") )
+    results = bench(
+        rows, radius, (nrows, ncols), int(args["--frames"]),
+        render.OCCLUSION_CHARS, seed=int(args["--seed"]),
+    )
+    print(f"{'engine':<12}{'ms/frame':>10}{'visible':>10}")
+    for name, result in results.items():
+        print(f"{name:<12}{result['ms_per_frame']:>10.3f}{result['visible_per_frame']:>10.0f}")
+    print(f"speedup {results['rays']['ms_per_frame'] / results['shadowcast']['ms_per_frame']:.1f}x")
+
+
+if __name__ == "__main__":
+    start()
@@ -0,0 +1,40 @@
+"""
+Movement rules of a single ghost. Shared by the server's ghost systems and by
+the region shards so both simulate ghosts the same way.
+"""
+
+from typing import *
+import random
+
+
+def chase_step(pos, target, repel=False) -> Tuple[int, int]:
+    """
+    Return the (dy, dx) step that moves a ghost at <pos> one cell towards
+    <target>, or away from it if <repel> is set
+    """
+    dy = (target[0] > pos[0]) - (target[0] < pos[0])
+    dx = (target[1] > pos[1]) - (target[1] < pos[1])
+    if repel:
+        return -dy, -dx
+    return dy, dx
+
+
+def jitter_step() -> Tuple[int, int]:
+    """
+    Random brownian step so ghosts don't stack on each other
+    """
+    return random.randint(-1, 1), random.randint(-1, 1)
+
+
+def bounded_move(pos, step, nrows: int, ncols: int) -> Tuple[int, int]:
+    """
+    Apply <step> to <pos>, dropping any component of the step that would put
+    the ghost on or outside the edge of an <nrows> x <ncols> map
+    """
+    y, x = pos
+    dy, dx = step
+    if not 0 < y + dy < nrows:
+        dy = 0
+    if not 0 < x + dx < ncols:
+        dx = 0
+    return y + dy, x + dx
@@ -0,0 +1,173 @@
+"""
+Vectorized ghost simulation. Ghost positions are kept in a structure of numpy
+arrays so that chasing, repelling, brownian jitter and petrification counts
+are computed for every ghost in one batched step instead of one python
+dict update per ghost.
+
+numpy is optional, it is installed with the "fast" extra (pip install
+.[fast]). When it is not installed <available> is False and the server falls
+back to the per-ghost systems.
+"""
+
+from typing import *
+from . import pathfinding
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+available = np is not None
+
+
+class GhostArrays:
+    """
+    Structure of arrays holding the id and position of every ghost. Row i of
+    <pos> is the (row, col) position of ghost ids[i]
+    """
+
+    def __init__(self, nrows: int, ncols: int, seed=None):
+        # Ghosts are kept strictly inside these bounds
+        self.bounds = np.array([nrows, ncols])
+        self.ids = np.empty(0, dtype=np.int64)
+        self.pos = np.empty((0, 2), dtype=np.int64)
+        self.index = {}  # { id: row }
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, id: int, pos):
+        self.index[id] = len(self.ids)
+        self.ids = np.append(self.ids, id)
+        self.pos = np.vstack([self.pos, np.asarray(pos, dtype=np.int64).reshape(1, 2)])
+
+    def remove(self, id: int):
+        # Swap the last ghost into the freed row
+        row, last = self.index.pop(id), len(self.ids) - 1
+        if row != last:
+            self.ids[row] = self.ids[last]
+            self.pos[row] = self.pos[last]
+            self.index[int(self.ids[row])] = row
+        self.ids = self.ids[:last]
+        self.pos = self.pos[:last]
+
+    def _move(self, step, field=None, active=None) -> "np.ndarray":
+        """
+        Apply <step> to every ghost, dropping the component of a step that
+        would leave the map, and return the rows that moved. If a flow <field>
+        is given, steps into cells that are not traversable are dropped. If
+        <active> is given only the ghosts where it is set move, see lod.py
+        """
+        if active is not None:
+            step = np.where(active[:, np.newaxis], step, 0)
+        new = self.pos + step
+        inside = (new > 0) & (new < self.bounds)
+        new = np.where(inside, new, self.pos)
+        if field is not None:
+            passable = np.frombuffer(field.passable, dtype=np.uint8)
+            blocked = passable[(new[:, 0] + 1) * field.width + new[:, 1] + 1] == 0
+            new[blocked] = self.pos[blocked]
+        moved = np.flatnonzero((new != self.pos).any(axis=1))
+        self.pos = new
+        return moved
+
+    def step_ai(self, players: "np.ndarray", repel_radius: float, active=None) -> "np.ndarray":
+        """
+        Move every <active> ghost one step towards its closest player in
+        <players>, an (n, 2) array of player positions, or away from it if
+        another player is within <repel_radius> of that player. Return the
+        rows that moved
+        """
+        if not len(players) or not len(self.ids):
+            return np.empty(0, dtype=np.int64)
+
+        offsets = players[np.newaxis, :, :] - self.pos[:, np.newaxis, :]
+        closest = (offsets * offsets).sum(axis=2).argmin(axis=1)
+
+        between = players[:, np.newaxis, :] - players[np.newaxis, :, :]
+        near = (between * between).sum(axis=2) < repel_radius * repel_radius
+        grouped = near.sum(axis=1) > 1  # Every player is near itself
+
+        step = np.sign(players[closest] - self.pos)
+        step[grouped[closest]] *= -1
+        return self._move(step, active=active)
+
+    def step_flow(self, field: "pathfinding.FlowField", grouped: "np.ndarray", active=None) -> "np.ndarray":
+        """
+        Move every <active> ghost one step along the flow <field> towards its
+        closest player, or away from it if grouped[i] is set for the field's
+        i-th player. Ghosts no player can reach stay put. Return the rows that
+        moved
+        """
+        if not len(self.ids):
+            return np.empty(0, dtype=np.int64)
+
+        dist = np.frombuffer(field.dist, dtype=np.int32)
+        owner = np.frombuffer(field.owner, dtype=np.int32)
+        passable = np.frombuffer(field.passable, dtype=np.uint8).astype(bool)
+        index = (self.pos[:, 0] + 1) * field.width + self.pos[:, 1] + 1
+        here = dist[index]
+
+        # Distance of each neighbour a ghost may step to
+        neighbours = np.empty((len(index), len(field.moves)), dtype=np.int32)
+        for k, (offset, _, a, b) in enumerate(field.moves):
+            ok = passable[index + a] & passable[index + b]
+            neighbours[:, k] = np.where(ok, dist[index + offset], pathfinding.UNREACHABLE)
+
+        reachable = here != pathfinding.UNREACHABLE
+        repel = np.zeros(len(index), dtype=bool)
+        repel[reachable] = grouped[owner[index[reachable]]]
+
+        rows = np.arange(len(index))
+        chase_scores = np.where(neighbours == pathfinding.UNREACHABLE, np.iinfo(np.int32).max, neighbours)
+        chase = chase_scores.argmin(axis=1)
+        flee = neighbours.argmax(axis=1)
+
+        choice = np.where(repel, flee, chase)
+        better = np.where(
+            repel, neighbours[rows, flee] > here, chase_scores[rows, chase] < here
+        ) & reachable
+
+        steps = np.array([ step for _, step, _, _ in field.moves ])[choice]
+        steps[~better] = 0
+        return self._move(steps, active=active)
+
+    def step_jitter(self, field=None, active=None) -> "np.ndarray":
+        """
+        Apply brownian motion to every <active> ghost. Return the rows that
+        moved
+        """
+        return self._move(self.rng.integers(-1, 2, size=self.pos.shape), field, active)
+
+    def distances(self, players: "np.ndarray", field: "pathfinding.FlowField" = None) -> "np.ndarray":
+        """
+        Return the distance of every ghost to its closest player: the walking
+        distance if a flow <field> is given, the straight line distance to
+        <players> otherwise. Ghosts no player can reach are infinitely far
+        """
+        if field is not None:
+            dist = np.frombuffer(field.dist, dtype=np.int32)
+            distances = dist[(self.pos[:, 0] + 1) * field.width + self.pos[:, 1] + 1].astype(float)
+            distances[distances == pathfinding.UNREACHABLE] = np.inf
+            return distances
+        if not len(players):
+            return np.full(len(self.ids), np.inf)
+        offsets = players[np.newaxis, :, :] - self.pos[:, np.newaxis, :]
+        return np.sqrt((offsets * offsets).sum(axis=2).min(axis=1))
+
+    def petrification_counts(self, players: "np.ndarray", radius: float) -> "np.ndarray":
+        """
+        Return the number of ghosts strictly within <radius> of each player
+        """
+        if not len(players):
+            return np.empty(0, dtype=np.int64)
+        offsets = self.pos[np.newaxis, :, :] - players[:, np.newaxis, :]
+        return ((offsets * offsets).sum(axis=2) < radius * radius).sum(axis=1)
+
+    def positions(self, rows) -> Iterator[Tuple[int, List[int]]]:
+        """
+        Generate (id, [row, col]) for the given <rows>, to copy moved ghosts
+        back into the entity table
+        """
+        return zip(self.ids[rows].tolist(), self.pos[rows].tolist())
@@ -0,0 +1,108 @@
+"""
+Latest-state coalescing of the frames the server sends to the client.
+
+Every frame received is applied to the client's copy of the entity state right
+away. That part is cheap, and it can't be skipped since deltas build on the
+frames before them. Showing the state is not cheap: updating the map's entity
+layer, looking up whether the player is petrified and drawing. The client only
+does that once per drawn frame, for the newest state, by calling take(). When
+the client draws slower than the server sends, the frames in between are
+folded into the next drawn frame instead of being worked through one by one,
+and are counted as stale.
+
+Answers to input commands are kept the same way: only the newest one is
+reconciled with, see inputs.py.
+"""
+
+from typing import *
+import json
+
+from . import delta
+from . import protocol
+
+
+class Inbox:
+    """
+    The newest state the server sent to the client of player <player_id>
+    """
+
+    def __init__(self, player_id: int):
+        self.player_id = player_id
+
+        # Entity state. Json frames update <entities>, binary ones <table>
+        self.binary = False
+        self.entities = {}  # type: Dict[str, dict]
+        self.table = protocol.EntityTable()
+
+        # Newest (seq, pos) answer to our input commands not taken yet
+        self.input_answer = None  # type: Optional[Tuple[int, List[int]]]
+
+        # Frames received, frames applied since the last take(), and frames
+        # that were never drawn because a newer one arrived first
+        self.received = 0
+        self.pending = 0
+        self.stale = 0
+
+    def receive(self, message: Union[str, bytes]) -> Optional[int]:
+        """
+        Apply <message> from the server. Return the tick of the frame, if it
+        carries one
+        """
+        if isinstance(message, bytes):
+            frame = protocol.decode(message)
+            self.table.apply(frame)
+            self.binary = True
+            tick = frame.tick
+        else:
+            data = json.loads(message)
+            if "input" in data:
+                self.input_answer = (data["input"], data["pos"])
+                return None
+            delta.apply_message(self.entities, data)
+            tick = data.get("tick")
+
+        self.received += 1
+        self.pending += 1
+        return tick
+
+    def take(self) -> bool:
+        """
+        Mark the current state as drawn. Return whether any frame arrived
+        since the last call
+        """
+        if not self.pending:
+            return False
+        self.stale += self.pending - 1
+        self.pending = 0
+        return True
+
+    def take_input_answer(self) -> Optional[Tuple[int, List[int]]]:
+        answer, self.input_answer = self.input_answer, None
+        return answer
+
+    def map_entities(self) -> Iterator[Tuple[int, int, int, str]]:
+        """
+        (id, row, col, char) of every entity but our own player, which is
+        drawn where it is predicted to be instead
+        """
+        if self.binary:
+            table = self.table
+            for entity in zip(table.ids, table.rows, table.cols, map(chr, table.glyphs)):
+                if entity[0] != self.player_id:
+                    yield entity
+            return
+
+        own = str(self.player_id)
+        for id, state in self.entities.items():
+            if id != own:
+                yield id, state["pos"][0], state["pos"][1], state["reprchar"]
+
+    def petrified(self) -> Optional[bool]:
+        """
+        Whether our player is petrified, None while the server hasn't sent it
+        """
+        if self.binary:
+            flags = self.table.flags_of(self.player_id)
+            return None if flags is None else bool(flags & protocol.PETRIFIED)
+        state = self.entities.get(str(self.player_id))
+        return None if state is None else state["petrified"]
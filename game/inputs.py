@@ -0,0 +1,167 @@
+"""
+Sequenced movement input.
+
+Clients never send positions. Each key press is sent as an input command
+[seq, key], numbered in the order the client made them. The server queues the
+commands of every player and applies them on each tick, checking every step
+against the map and the entities on it. It then tells the client the sequence
+number of the last command it processed and where that left the player.
+
+The client doesn't wait for that answer. A Predictor moves the player as soon
+as the key is pressed and keeps the commands the server hasn't processed yet.
+When the answer arrives the player is put back at the authoritative position
+and the unprocessed commands are replayed on top of it, so a move the server
+refused is undone and the ones still in flight stay in effect.
+
+Both sides move with the same step(), and walls, ghosts and other players
+block the way on both, so predictions only go wrong when the server knows
+something the client doesn't yet, e.g. that a ghost moved into the way or that
+the player was petrified.
+"""
+
+from typing import *
+import collections
+
+
+# Direction each movement key steps in, as (row, col)
+MOVES = {
+    "w": (-1, 0),
+    "s": (1, 0),
+    "a": (0, -1),
+    "d": (0, 1),
+}
+
+# Commands a player may have queued on the server. Commands past this are
+# dropped until the queue drains, so a flooding client can neither pile up
+# work for the server nor move faster than the server applies commands
+MAX_PENDING = 16
+
+
+def step(pos: Sequence[int], key: str, passable: Callable[[Tuple[int, int]], bool]) -> Tuple[int, int]:
+    """
+    Where <key> moves a player standing on <pos>: one cell in its direction if
+    that cell is <passable>, otherwise nowhere
+    """
+    drow, dcol = MOVES[key]
+    candidate = (pos[0] + drow, pos[1] + dcol)
+    if passable(candidate):
+        return candidate
+    return (pos[0], pos[1])
+
+
+def terrain(rows: Sequence[str], traversable: Container[str]) -> Callable[[Tuple[int, int]], bool]:
+    """
+    A passable check for step(): cells inside the map <rows> that hold one of
+    the <traversable> characters
+    """
+    def passable(pos) -> bool:
+        row, col = pos
+        return 0 <= row < len(rows) and 0 <= col < len(rows[row]) and rows[row][col] in traversable
+    return passable
+
+
+class InputQueue:
+    """
+    The movement commands of one player, on the server
+    """
+
+    def __init__(self, size: int = MAX_PENDING):
+        self.size = size
+        self.commands = collections.deque()  # type: Deque[Tuple[int, str]]
+
+        # Highest sequence number received, and the last one processed
+        self.received = 0
+        self.processed = 0
+
+        # Commands that were received but never applied
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.commands)
+
+    @property
+    def pending(self) -> bool:
+        """
+        Whether any received command has not been processed yet
+        """
+        return self.processed != self.received
+
+    def push(self, seq: int, key: str) -> bool:
+        """
+        Queue command <seq>. Commands numbered at or below one already
+        received are ignored. Commands for an unknown key, or that arrive
+        while the queue is full, are dropped but still count as received, so
+        the client learns they were refused once the queue drains. Return
+        whether the command was queued
+        """
+        if not isinstance(seq, int) or seq <= self.received:
+            return False
+        self.received = seq
+        if not isinstance(key, str) or key not in MOVES or len(self.commands) >= self.size:
+            self.dropped += 1
+            return False
+        self.commands.append((seq, key))
+        return True
+
+    def take(self, limit: int) -> List[str]:
+        """
+        Pop the keys of up to <limit> commands, in order, and mark them
+        processed
+        """
+        keys = []
+        while self.commands and len(keys) < limit:
+            self.processed, key = self.commands.popleft()
+            keys.append(key)
+        if not self.commands:
+            self.processed = self.received
+        return keys
+
+
+class Predictor:
+    """
+    Moves the player on the client ahead of the server, starting from <pos>
+    """
+
+    def __init__(self, pos: Sequence[int], passable: Callable[[Tuple[int, int]], bool]):
+        self.position = (pos[0], pos[1])
+        self.passable = passable
+        self.seq = 0
+
+        # (seq, key) of the commands sent but not processed by the server yet
+        self.pending = collections.deque()  # type: Deque[Tuple[int, str]]
+
+        # Answers from the server that didn't match the prediction
+        self.corrections = 0
+
+    def press(self, key: str) -> Optional[List]:
+        """
+        Move the player for <key> right away. Return the command to send to
+        the server, or None if the key doesn't move the player
+        """
+        if key not in MOVES:
+            return None
+        position = step(self.position, key, self.passable)
+        if position == self.position:
+            return None
+        self.seq += 1
+        self.pending.append((self.seq, key))
+        self.position = position
+        return [self.seq, key]
+
+    def reconcile(self, seq: int, pos: Sequence[int]) -> bool:
+        """
+        The server processed every command up to <seq>, which left the player
+        at <pos>. Replay the commands it hasn't processed yet from there.
+        Return whether the prediction was off
+        """
+        while self.pending and self.pending[0][0] <= seq:
+            self.pending.popleft()
+        position = (pos[0], pos[1])
+        for _, key in self.pending:
+            position = step(position, key, self.passable)
+
+        corrected = position != self.position
+        if corrected:
+            self.corrections += 1
+        self.position = position
+        return corrected
@@ -0,0 +1,54 @@
+"""
+Area of interest management. Each connection is only told about the entities
+that its player could possibly see: those inside the terminal window around
+the player, capped by the occlusion radius, plus a margin so entities are
+already known by the time they walk into view.
+"""
+
+from typing import *
+from .render import VIEW_RADIUS
+
+
+# Extra rows and columns around the visible window
+INTEREST_MARGIN = 10
+
+# Window size assumed until the client reports its terminal size
+DEFAULT_LINES = 2 * VIEW_RADIUS
+DEFAULT_COLUMNS = 2 * VIEW_RADIUS
+
+
+class Interest:
+    """
+    The set of entity ids a connection currently knows about
+    """
+
+    def __init__(self, player_id: int, lines=DEFAULT_LINES, columns=DEFAULT_COLUMNS):
+        self.player_id = player_id
+        self.ids = set()
+        self.resize(lines, columns)
+
+    def resize(self, lines: int, columns: int):
+        """
+        Update the window to a terminal of <lines> x <columns>. The camera may
+        put the player anywhere inside the window, so anything less than a full
+        window away may be on screen. Nothing past VIEW_RADIUS is ever drawn
+        """
+        self.half_rows = min(lines, VIEW_RADIUS) + INTEREST_MARGIN
+        self.half_cols = min(columns, VIEW_RADIUS) + INTEREST_MARGIN
+
+    def contains(self, center, pos) -> bool:
+        return (
+            abs(pos[0] - center[0]) <= self.half_rows and
+            abs(pos[1] - center[1]) <= self.half_cols
+        )
+
+    def update(self, positions: Dict[int, Sequence[int]]) -> Tuple[Set[int], Set[int]]:
+        """
+        Recompute the interest set from the <positions> of every entity and
+        return the ids that entered and left it
+        """
+        center = positions[self.player_id]
+        ids = { id for id, pos in positions.items() if self.contains(center, pos) }
+        enter, leave = ids - self.ids, self.ids - ids
+        self.ids = ids
+        return enter, leave
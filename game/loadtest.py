@@ -0,0 +1,480 @@
+"""
+Headless load test for the game server.
+
+Spawns bot clients that speak the same handshake, view, input and ack
+messages as the terminal client and walk the campus map, and reports how the
+server holds up as the number of bots grows. Each stage adds bots up to the
+next count in --clients and measures for --duration seconds:
+
+    bytes/s     broadcast bytes received by all bots per second
+    msgs/s      broadcast messages received by all bots per second
+    jitter      spread of frame arrival times around the server tick they
+                carry, in ms (standard deviation and 99th percentile)
+    latency     time from a bot sending a move to seeing it in a broadcast,
+                in ms (50th, 90th and 99th percentile)
+    cpu         server cpu use in percent of one core, when the server runs
+                on this machine
+
+Unless --url is given a local server is started for the run.
+
+Usage:
+  loadtest [--url=<url>] [--pid=<pid>] [--clients=<counts>] [--duration=<s>]
+           [--pattern=<name>] [--protocol=<name>] [--move-rate=<hz>]
+           [--output=<file>] [--seed=<n>]
+
+Options:
+  --url=<url>         Server to connect to instead of starting a local one
+  --pid=<pid>         Process id of the server at --url, to measure its cpu
+  --clients=<counts>  Comma separated bot counts, one stage each [default: 10,50,100,200]
+  --duration=<s>      Seconds to measure each stage for [default: 10]
+  --pattern=<name>    How bots move: random, patrol, swarm or idle [default: random]
+  --protocol=<name>   Wire protocol bots ask for: bin1 or json [default: bin1]
+  --move-rate=<hz>    Moves per second each bot makes [default: 5]
+  --output=<file>     Also append each stage's results to this file as json lines
+  --seed=<n>          Seed for bot movement [default: 0]
+"""
+
+from typing import *
+import asyncio
+import collections
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import docopt
+import websockets
+
+from . import delta
+from . import inputs
+from . import protocol
+from . import render
+from .tick import TICK_RATE
+
+
+# Every bot joins the same named room, which has no player limit
+LOCAL_URL = "ws://localhost:10000/loadtest"
+
+MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../maps/mst_campus.txt")
+
+# Terminal size bots report to the server, which sets how much of the map
+# they are sent
+BOT_VIEW = (24, 80)
+
+# Update rate bots ask for and how often they acknowledge frames, as the
+# terminal client does
+BOT_RATE = 60
+ACK_INTERVAL = 0.25
+
+# Seconds after which a move that was never seen in a broadcast is given up
+# on, e.g. because the bot moved on before the server sent it
+PENDING_TIMEOUT = 2.0
+
+# Seconds to let new bots settle in before a stage is measured
+SETTLE_TIME = 1.0
+
+# Seconds to wait for a local server to accept connections
+SERVER_STARTUP_TIMEOUT = 10.0
+
+# Orthogonal moves, as the terminal client makes them, and the key sent for
+# each
+MOVES = tuple(inputs.MOVES.values())
+KEYS = { move: key for key, move in inputs.MOVES.items() }
+
+PATTERNS = ("random", "patrol", "swarm", "idle")
+
+# How far swarming bots may wander from the spawn point
+SWARM_RADIUS = 5
+
+
+def percentile(values: Sequence[float], p: float) -> Optional[float]:
+    """
+    Return the <p>th percentile of <values> by nearest rank, or None if there
+    are none
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def process_cpu_time(pid: int) -> Optional[float]:
+    """
+    Return the cpu seconds process <pid> has used so far, or None where it
+    can't be read
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as fp:
+            # Skip past the command name, which may contain spaces
+            fields = fp.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class Walker:
+    """
+    Picks the next position of a bot on the map according to a movement
+    pattern:
+
+        random  step in a random direction
+        patrol  keep walking in one direction, turn when blocked
+        swarm   wander close to <target>, the spawn point, so every bot
+                sees every other one
+        idle    never move
+    """
+
+    def __init__(self, rows: Sequence[str], pattern: str, rng: random.Random, target=(2, 2)):
+        if pattern not in PATTERNS:
+            raise ValueError(f"unknown movement pattern {pattern!r}")
+        self.rows = rows
+        self.pattern = pattern
+        self.rng = rng
+        self.target = target
+        self.heading = rng.choice(MOVES)
+
+    def passable(self, pos) -> bool:
+        row, col = pos
+        if not (0 <= row < len(self.rows) and 0 <= col < len(self.rows[row])):
+            return False
+        return self.rows[row][col] in render.TRAVERSABLE_CHARS
+
+    def next(self, pos) -> Optional[List[int]]:
+        """
+        Return the position to move to from <pos>, or None to stay put
+        """
+        if self.pattern == "idle":
+            return None
+
+        if self.pattern == "random":
+            moves = [self.rng.choice(MOVES)]
+        elif self.pattern == "patrol":
+            moves = [self.heading] + self.rng.sample(MOVES, len(MOVES))
+        else:
+            moves = self.rng.sample(MOVES, len(MOVES))
+
+        for move in moves:
+            candidate = [pos[0] + move[0], pos[1] + move[1]]
+            if self.pattern == "swarm" and max(
+                abs(candidate[0] - self.target[0]), abs(candidate[1] - self.target[1])
+            ) > SWARM_RADIUS:
+                continue
+            if self.passable(candidate):
+                self.heading = move
+                return candidate
+        return None
+
+
+class Bot:
+    """
+    A headless client. Frames are fed to receive(), which keeps a copy of the
+    entity state like the terminal client and records traffic, frame timing
+    and move latency
+    """
+
+    def __init__(self, walker: Walker, wire: str = protocol.BINARY):
+        self.walker = walker
+        self.wire = wire
+        self.id = None
+        self.pos = None
+        self.petrified = False
+
+        # Reconciles <pos> with the server's answers to our input commands,
+        # see inputs.py
+        self.predictor = None  # type: Optional[inputs.Predictor]
+
+        # Entity state, in <table> once binary frames arrive and in
+        # <entities> otherwise
+        self.binary = False
+        self.entities = {}
+        self.table = protocol.EntityTable()
+
+        # Moves sent but not seen in a broadcast yet, as
+        # { seq: (pos, time sent) }
+        self.pending = collections.OrderedDict()
+        self.last_ack = 0.0
+
+        # First frame (tick, arrival time) of the stage, which arrival times
+        # of later frames are compared against
+        self.epoch = None
+        self.reset()
+
+    def reset(self):
+        """
+        Start a new measurement
+        """
+        self.bytes = 0
+        self.messages = 0
+        self.offsets = []
+        self.latencies = []
+        self.epoch = None
+
+    def handshake(self, init: dict) -> List[dict]:
+        """
+        Take in the server's init message and return the control messages to
+        answer it with
+        """
+        self.id = init["id"]
+        self.pos = list(init["pos"])
+        self.predictor = inputs.Predictor(self.pos, self.walker.passable)
+        handshake = { "rate": BOT_RATE }
+        if self.wire in init.get("protocols", ()):
+            handshake["protocol"] = self.wire
+        return [handshake, { "view": BOT_VIEW }]
+
+    def own_state(self) -> Tuple[Optional[List[int]], Optional[bool]]:
+        if self.binary:
+            slot = self.table.index.get(self.id)
+            if slot is None:
+                return None, None
+            return [self.table.rows[slot], self.table.cols[slot]], bool(self.table.flags[slot] & protocol.PETRIFIED)
+        state = self.entities.get(str(self.id))
+        if state is None:
+            return None, None
+        return state["pos"], state.get("petrified", False)
+
+    def receive(self, message, now: float) -> Optional[dict]:
+        """
+        Apply a broadcast <message> that arrived at <now>. Return an ack to
+        send back, if one is due
+        """
+        if isinstance(message, str):
+            data = json.loads(message)
+            if "input" in data:
+                # Answer to an input command rather than a broadcast
+                self.answer(data["input"], data["pos"])
+                return None
+
+        self.bytes += len(message)
+        self.messages += 1
+
+        if isinstance(message, bytes):
+            self.binary = True
+            frame = protocol.decode(message)
+            self.table.apply(frame)
+            tick = frame.tick
+        else:
+            delta.apply_message(self.entities, data)
+            tick = data.get("tick")
+
+        if tick is not None:
+            # How late this frame is compared to the first one of the stage
+            # if the server ticked perfectly evenly
+            if self.epoch is None:
+                self.epoch = (tick, now)
+            self.offsets.append(now - self.epoch[1] - (tick - self.epoch[0]) / TICK_RATE)
+
+        pos, petrified = self.own_state()
+        if pos is not None:
+            self.petrified = petrified
+            for seq, (sent, at) in self.pending.items():
+                if sent == list(pos):
+                    self.latencies.append(now - at)
+                    self.forget(lambda s, sent, at: s <= seq)
+                    break
+        self.forget(lambda s, sent, at: now - at > PENDING_TIMEOUT)
+
+        if tick is not None and now - self.last_ack >= ACK_INTERVAL:
+            self.last_ack = now
+            return { "ack": tick }
+        return None
+
+    def forget(self, expired: Callable[[int, List[int], float], bool]):
+        """
+        Stop waiting for the pending moves (seq, pos, time sent) that are
+        <expired>
+        """
+        for seq in [ seq for seq, (pos, at) in self.pending.items() if expired(seq, pos, at) ]:
+            del self.pending[seq]
+
+    def answer(self, seq: int, pos: List[int]):
+        """
+        The server processed our input commands up to <seq>, leaving the bot
+        at <pos>. Moves it refused, and moves a later one was processed after,
+        will never be seen in a broadcast
+        """
+        self.predictor.reconcile(seq, pos)
+        self.pos = list(self.predictor.position)
+        self.forget(lambda s, sent, at: s < seq or (s == seq and sent != list(pos)))
+
+    def move(self, now: float) -> Optional[dict]:
+        """
+        Return the input command to send, if the bot moves
+        """
+        if self.petrified or self.pos is None:
+            return None
+        pos = self.walker.next(self.pos)
+        if pos is None:
+            return None
+        command = self.predictor.press(KEYS[pos[0] - self.pos[0], pos[1] - self.pos[1]])
+        self.pos = list(self.predictor.position)
+        self.pending[command[0]] = (self.pos, now)
+        return { "input": command }
+
+    async def run(self, url: str, move_rate: float, stop: asyncio.Event):
+        async with websockets.connect(url, max_size=None) as ws:
+            for message in self.handshake(json.loads(await ws.recv())):
+                await ws.send(json.dumps(message))
+
+            async def read():
+                loop = asyncio.get_event_loop()
+                async for message in ws:
+                    ack = self.receive(message, loop.time())
+                    if ack is not None:
+                        await ws.send(json.dumps(ack))
+
+            reader = asyncio.ensure_future(read())
+            try:
+                loop = asyncio.get_event_loop()
+                while not stop.is_set() and not reader.done():
+                    command = self.move(loop.time())
+                    if command is not None:
+                        await ws.send(json.dumps(command))
+                    try:
+                        await asyncio.wait_for(stop.wait(), 1 / move_rate)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                reader.cancel()
+
+
+def summarize(bots: Sequence[Bot], elapsed: float, cpu: Optional[float]) -> dict:
+    """
+    Combine the measurements of <bots> over <elapsed> seconds into one row of
+    the report
+    """
+    offsets = []
+    for bot in bots:
+        if bot.offsets:
+            # Only the spread matters, not the constant network delay
+            base = min(bot.offsets)
+            offsets.extend(offset - base for offset in bot.offsets)
+    latencies = [ latency for bot in bots for latency in bot.latencies ]
+    ms = lambda value: None if value is None else round(value * 1000, 2)
+
+    return {
+        "clients": len(bots),
+        "bytes_per_s": round(sum(bot.bytes for bot in bots) / elapsed),
+        "msgs_per_s": round(sum(bot.messages for bot in bots) / elapsed),
+        "jitter_ms": ms(statistics.pstdev(offsets)) if offsets else None,
+        "jitter_p99_ms": ms(percentile(offsets, 99)),
+        "latency_p50_ms": ms(percentile(latencies, 50)),
+        "latency_p90_ms": ms(percentile(latencies, 90)),
+        "latency_p99_ms": ms(percentile(latencies, 99)),
+        "server_cpu_pct": None if cpu is None else round(cpu / elapsed * 100, 1),
+    }
+
+
+COLUMNS = (
+    ("clients", "clients"), ("bytes_per_s", "bytes/s"), ("msgs_per_s", "msgs/s"),
+    ("jitter_ms", "jitter"), ("jitter_p99_ms", "jit p99"),
+    ("latency_p50_ms", "lat p50"), ("latency_p90_ms", "lat p90"), ("latency_p99_ms", "lat p99"),
+    ("server_cpu_pct", "cpu %"),
+)
+
+
+def format_row(row: Optional[dict] = None) -> str:
+    """
+    Format a report row, or the header if <row> is None
+    """
+    if row is None:
+        return " ".join(f"{title:>10}" for _, title in COLUMNS)
+    return " ".join(f"{'-' if row[key] is None else row[key]:>10}" for key, _ in COLUMNS)
+
+
+async def wait_for_server(url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with websockets.connect(url):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def run(url: str, pid: Optional[int], counts: Sequence[int], duration: float,
+              pattern: str, wire: str, move_rate: float, seed: int, output: Optional[str]):
+    with open(MAP_FILE) as fp:
+        rows = render.Map(fp).data
+
+    rng = random.Random(seed)
+    stop = asyncio.Event()
+    bots = []
+    tasks = []
+
+    print(format_row())
+    try:
+        for count in counts:
+            while len(bots) < count:
+                bot = Bot(Walker(rows, pattern, random.Random(rng.random())), wire)
+                bots.append(bot)
+                tasks.append(asyncio.ensure_future(bot.run(url, move_rate, stop)))
+            await asyncio.sleep(SETTLE_TIME)
+
+            failed = [ task for task in tasks if task.done() ]
+            if failed:
+                # Surface the first connection error
+                failed[0].result()
+
+            for bot in bots:
+                bot.reset()
+            started = time.monotonic()
+            cpu_start = None if pid is None else process_cpu_time(pid)
+            await asyncio.sleep(duration)
+            elapsed = time.monotonic() - started
+            cpu_end = None if pid is None else process_cpu_time(pid)
+            cpu = None if cpu_start is None or cpu_end is None else cpu_end - cpu_start
+
+            row = summarize(bots, elapsed, cpu)
+            print(format_row(row), flush=True)
+            if output:
+                with open(output, "a") as fp:
+                    fp.write(json.dumps(dict(row, pattern=pattern, protocol=wire, time=time.time())) + "\n")
+    finally:
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def start():
+    args = docopt.docopt(__doc__)
+
+    url = args["--url"]
+    pid = int(args["--pid"]) if args["--pid"] else None
+    server = None
+    if url is None:
+        # Run a local server for the duration of the test
+        url = LOCAL_URL
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+        server = subprocess.Popen([sys.executable, "-m", "game.server"], cwd=root, stdout=subprocess.DEVNULL)
+        pid = server.pid
+
+    try:
+        if server is not None:
+            asyncio.run(wait_for_server(url, SERVER_STARTUP_TIMEOUT))
+        asyncio.run(run(
+            url, pid,
+            counts=[ int(count) for count in args["--clients"].split(",") ],
+            duration=float(args["--duration"]),
+            pattern=args["--pattern"],
+            wire=args["--protocol"],
+            move_rate=float(args["--move-rate"]),
+            seed=int(args["--seed"]),
+            output=args["--output"],
+        ))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    start()
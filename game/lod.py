@@ -0,0 +1,63 @@
+"""
+Level of detail for ghost updates. Ghosts are put into tiers by their
+distance to the closest player. Ghosts in the nearest tier move on every
+step of the ghost systems, ghosts further away only on every n-th step, and
+ghosts beyond the last tier are frozen until a player comes close enough.
+
+Ghosts of a slow tier are spread over the steps by id, so the work of a tier
+that moves every 4th step is split evenly over those 4 steps.
+"""
+
+from typing import *
+import bisect
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# (distance, divisor) tiers from the closest player outwards. A ghost within
+# <distance> cells moves on every <divisor>-th step
+TIERS = ((40, 1), (100, 4))
+
+
+class LevelOfDetail:
+
+    def __init__(self, tiers: Sequence[Tuple[float, int]] = TIERS):
+        if any(divisor < 1 for _, divisor in tiers):
+            raise ValueError("tier divisors must be at least 1")
+        tiers = sorted(tiers)
+        self.limits = [ limit for limit, _ in tiers ]
+        self.divisors = [ divisor for _, divisor in tiers ]
+
+    @property
+    def frozen(self) -> int:
+        """
+        Tier of ghosts that are too far away to move at all
+        """
+        return len(self.limits)
+
+    def tier(self, distance: float) -> int:
+        return bisect.bisect_left(self.limits, distance)
+
+    def due(self, id: int, distance: float, step: int) -> bool:
+        """
+        Whether the ghost <id> at <distance> from the closest player moves on
+        <step>
+        """
+        tier = self.tier(distance)
+        return tier != self.frozen and (step + id) % self.divisors[tier] == 0
+
+    def tiers(self, distances: "np.ndarray") -> "np.ndarray":
+        return np.searchsorted(self.limits, distances, side="left")
+
+    def due_mask(self, ids: "np.ndarray", distances: "np.ndarray", step: int) -> "np.ndarray":
+        """
+        Vectorized due(): whether each ghost moves on <step>
+        """
+        tiers = self.tiers(distances)
+        moving = tiers != self.frozen
+        divisors = np.ones(len(ids), dtype=np.int64)
+        divisors[moving] = np.asarray(self.divisors)[tiers[moving]]
+        return moving & ((step + ids) % divisors == 0)
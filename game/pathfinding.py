@@ -0,0 +1,181 @@
+"""
+Flow field pathfinding for ghosts. A single breadth first search from every
+player at once gives each traversable cell its walking distance to the closest
+player, and which player that is. A ghost then finds its next step by looking
+at the distance of its 8 neighbouring cells instead of searching on its own.
+
+The field only has to be recomputed when a player moves to another cell.
+"""
+
+from typing import *
+from array import array
+
+
+# Moves a ghost can make as (dy, dx). Diagonal moves may not cut the corner of
+# a wall
+MOVES = (
+    (-1, 0), (1, 0), (0, -1), (0, 1),
+    (-1, -1), (-1, 1), (1, -1), (1, 1),
+)
+
+UNREACHABLE = -1
+
+
+class FlowField:
+
+    def __init__(self, rows: Sequence[str], traversable: Container[str], nrows: int, ncols: int):
+        # Cells are stored row major in flat arrays with a one cell wall all
+        # around the map so neighbours never need a bounds check
+        self.nrows = nrows
+        self.ncols = ncols
+        self.width = width = ncols + 2
+        size = (nrows + 2) * width
+
+        self.passable = bytearray(size)
+        for r, row in enumerate(rows[:nrows]):
+            for c, char in enumerate(row[:ncols]):
+                if char in traversable:
+                    self.passable[(r + 1) * width + c + 1] = 1
+
+        # Offset of each move in the flat arrays, and the offsets of the two
+        # orthogonal cells a diagonal move passes between
+        self.moves = [
+            (dy * width + dx, (dy, dx), dy * width, dx)
+            for dy, dx in MOVES
+        ]
+
+        self.dist = array("i", [UNREACHABLE]) * size
+        self.owner = array("i", [UNREACHABLE]) * size  # index into source_ids
+
+        # Player ids of the sources, and the cells the field was built from
+        self.source_ids = []
+        self._cells = None
+
+        # Number of times the field was rebuilt
+        self.rebuilds = 0
+
+    def index(self, pos) -> int:
+        return (int(pos[0]) + 1) * self.width + int(pos[1]) + 1
+
+    def inside(self, pos) -> bool:
+        return 0 <= pos[0] < self.nrows and 0 <= pos[1] < self.ncols
+
+    def is_passable(self, pos) -> bool:
+        return self.inside(pos) and bool(self.passable[self.index(pos)])
+
+    def update(self, players: Dict[int, Sequence[int]]) -> bool:
+        """
+        Rebuild the field from the player positions in <players>, unless no
+        player changed cell since the last rebuild. Return whether the field
+        was rebuilt
+        """
+        cells = { id: self.index(pos) for id, pos in players.items() if self.inside(pos) }
+        if cells == self._cells:
+            return False
+        self._cells = cells
+        self.rebuilds += 1
+
+        dist = self.dist = array("i", [UNREACHABLE]) * len(self.passable)
+        owner = self.owner = array("i", [UNREACHABLE]) * len(self.passable)
+        self.source_ids = []
+
+        frontier = []
+        for id, i in cells.items():
+            if dist[i] == UNREACHABLE:
+                dist[i] = 0
+                owner[i] = len(self.source_ids)
+                self.source_ids.append(id)
+                frontier.append(i)
+
+        self._search(frontier)
+        return True
+
+    def _search(self, frontier: List[int]):
+        """
+        Breadth first search from the cells in <frontier>, one distance level
+        at a time
+        """
+        width = self.width
+        passable, dist, owner = self.passable, self.dist, self.owner
+        orthogonal = (-width, width, -1, 1)
+        diagonal = (
+            (-width - 1, -width, -1), (-width + 1, -width, 1),
+            (width - 1, width, -1), (width + 1, width, 1),
+        )
+
+        # Passable cells that have not been reached yet
+        unvisited = bytearray(passable)
+        for i in frontier:
+            unvisited[i] = 0
+
+        d = 0
+        while frontier:
+            d += 1
+            next_frontier = []
+            append = next_frontier.append
+            for i in frontier:
+                o = owner[i]
+                for offset in orthogonal:
+                    j = i + offset
+                    if unvisited[j]:
+                        unvisited[j] = 0
+                        dist[j] = d
+                        owner[j] = o
+                        append(j)
+                for offset, a, b in diagonal:
+                    j = i + offset
+                    if unvisited[j] and passable[i + a] and passable[i + b]:
+                        unvisited[j] = 0
+                        dist[j] = d
+                        owner[j] = o
+                        append(j)
+            frontier = next_frontier
+
+    def distance(self, pos) -> Optional[int]:
+        """
+        Return the walking distance from <pos> to the closest player, or None
+        if no player can be reached from <pos>
+        """
+        if not self.inside(pos):
+            return None
+        d = self.dist[self.index(pos)]
+        return None if d == UNREACHABLE else d
+
+    def source_of(self, pos) -> Optional[int]:
+        """
+        Return the index in source_ids of the player closest to <pos> by
+        walking distance, or None if no player can be reached from <pos>
+        """
+        if not self.inside(pos):
+            return None
+        o = self.owner[self.index(pos)]
+        return None if o == UNREACHABLE else o
+
+    def closest(self, pos) -> Optional[int]:
+        """
+        Return the id of the player closest to <pos> by walking distance, or
+        None if no player can be reached from <pos>
+        """
+        o = self.source_of(pos)
+        return None if o is None else self.source_ids[o]
+
+    def next_step(self, pos, repel=False) -> Tuple[int, int]:
+        """
+        Return the (dy, dx) step that brings a ghost at <pos> closer to its
+        closest player, or further away if <repel> is set. (0, 0) if there is
+        no such step
+        """
+        if not self.inside(pos):
+            return 0, 0
+        i = self.index(pos)
+        dist, passable = self.dist, self.passable
+        best, best_d = (0, 0), dist[i]
+        if best_d == UNREACHABLE:
+            return best
+        for offset, step, a, b in self.moves:
+            d = dist[i + offset]
+            if d == UNREACHABLE or not (passable[i + a] and passable[i + b]):
+                continue
+            if (d > best_d) if repel else (d < best_d):
+                best, best_d = step, d
+        return best
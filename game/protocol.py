@@ -0,0 +1,214 @@
+"""
+Compact binary wire protocol for state broadcasts.
+
+The protocol is negotiated at connect time: the server lists the protocols it
+speaks in the init message and the client answers with { "protocol": name }.
+Clients that never answer keep getting json.
+
+A binary frame is a fixed size header followed by the entity records stored
+column by column (all ids, then all rows, all cols, glyphs and flags), and
+finally the ids of removed entities. Every column is a fixed width array so a
+frame is decoded into position arrays with a handful of array.frombytes calls
+and no per-entity objects.
+"""
+
+from typing import *
+from array import array
+import struct
+import sys
+
+
+JSON = "json"
+BINARY = "bin1"
+
+# Protocols the server speaks, most preferred first
+PROTOCOLS = [BINARY, JSON]
+
+VERSION = 1
+
+# Frame kinds
+KEYFRAME = 0
+DELTA = 1
+
+# version, kind, tick, number of records, number of removed ids
+HEADER = struct.Struct("<BBIII")
+
+# Name and array typecode of each record column, in wire order
+COLUMNS = (
+    ("ids", "I"),
+    ("rows", "h"),
+    ("cols", "h"),
+    ("glyphs", "H"),  # unicode code point of reprchar
+    ("flags", "B"),
+)
+
+# Entity flags
+PETRIFIED = 1
+PLAYER = 2
+ITEM = 4
+
+# Columns are little endian on the wire
+_SWAP = sys.byteorder != "little"
+
+
+def negotiate(offered: Iterable[str]) -> str:
+    """
+    Return the most preferred protocol in <offered>, or JSON if none of them
+    is supported
+    """
+    offered = set(offered)
+    for name in PROTOCOLS:
+        if name in offered:
+            return name
+    return JSON
+
+
+def entity_flags(state: dict) -> int:
+    flags = 0
+    if state.get("petrified"):
+        flags |= PETRIFIED
+    if "items" in state:
+        flags |= PLAYER
+    if state.get("type") == "item":
+        flags |= ITEM
+    return flags
+
+
+def _column_bytes(typecode: str, values) -> bytes:
+    column = array(typecode, values)
+    if _SWAP:
+        column.byteswap()
+    return column.tobytes()
+
+
+def encode(kind: int, tick: int, states: Iterable[dict], removed: Iterable[int] = ()) -> bytes:
+    """
+    Pack entity <states> (server side entity dicts) and <removed> ids into a
+    binary frame
+    """
+    ids, rows, cols, glyphs, flags = [], [], [], [], []
+    for state in states:
+        ids.append(state["id"])
+        row, col = state["pos"]
+        rows.append(row)
+        cols.append(col)
+        glyphs.append(ord(state["reprchar"]))
+        flags.append(entity_flags(state))
+    return encode_columns(kind, tick, ids, rows, cols, glyphs, flags, removed)
+
+
+def encode_columns(kind: int, tick: int, ids, rows, cols, glyphs, flags, removed: Iterable[int] = ()) -> bytes:
+    """
+    Pack entity records given column by column, e.g. the columns of an
+    EntityTable, into a binary frame
+    """
+    removed = list(removed)
+    return b"".join([
+        HEADER.pack(VERSION, kind, tick, len(ids), len(removed)),
+        _column_bytes("I", ids),
+        _column_bytes("h", rows),
+        _column_bytes("h", cols),
+        _column_bytes("H", glyphs),
+        _column_bytes("B", flags),
+        _column_bytes("I", removed),
+    ])
+
+
+def encode_keyframe(tick: int, states: Iterable[dict]) -> bytes:
+    return encode(KEYFRAME, tick, states)
+
+
+def encode_delta(tick: int, states: Iterable[dict], removed: Iterable[int]) -> bytes:
+    return encode(DELTA, tick, states, removed)
+
+
+class Frame:
+    """
+    A decoded binary frame. Record fields are parallel arrays
+    """
+
+    def __init__(self, kind: int, tick: int):
+        self.kind = kind
+        self.tick = tick
+        self.ids = array("I")
+        self.rows = array("h")
+        self.cols = array("h")
+        self.glyphs = array("H")
+        self.flags = array("B")
+        self.removed = array("I")
+
+
+def decode(payload: bytes) -> Frame:
+    version, kind, tick, count, nremoved = HEADER.unpack_from(payload)
+    if version != VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+
+    frame = Frame(kind, tick)
+    view = memoryview(payload)
+    offset = HEADER.size
+    for name, n in [ (name, count) for name, _ in COLUMNS ] + [ ("removed", nremoved) ]:
+        column = getattr(frame, name)
+        size = column.itemsize * n
+        column.frombytes(view[offset:offset + size])
+        if _SWAP:
+            column.byteswap()
+        offset += size
+    return frame
+
+
+class EntityTable:
+    """
+    Client side copy of the entity state kept as parallel arrays, updated by
+    applying decoded frames
+    """
+
+    def __init__(self):
+        self._set(Frame(KEYFRAME, 0))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _set(self, frame: Frame):
+        self.ids = frame.ids
+        self.rows = frame.rows
+        self.cols = frame.cols
+        self.glyphs = frame.glyphs
+        self.flags = frame.flags
+        self.index = dict(zip(self.ids, range(len(self.ids))))  # { id: slot }
+
+    def apply(self, frame: Frame):
+        if frame.kind == KEYFRAME:
+            self._set(frame)
+            return
+
+        for id in frame.removed:
+            self._remove(id)
+
+        columns = (self.rows, self.cols, self.glyphs, self.flags)
+        values = (frame.rows, frame.cols, frame.glyphs, frame.flags)
+        for i, id in enumerate(frame.ids):
+            slot = self.index.get(id)
+            if slot is None:
+                self.index[id] = len(self.ids)
+                self.ids.append(id)
+                for column, value in zip(columns, values):
+                    column.append(value[i])
+            else:
+                for column, value in zip(columns, values):
+                    column[slot] = value[i]
+
+    def _remove(self, id: int):
+        # Swap the last entity into the freed slot
+        slot = self.index.pop(id, None)
+        if slot is None:
+            return
+        last = len(self.ids) - 1
+        for column in (self.ids, self.rows, self.cols, self.glyphs, self.flags):
+            column[slot] = column[last]
+            column.pop()
+        if slot != last:
+            self.index[self.ids[slot]] = slot
+
+    def flags_of(self, id: int) -> Optional[int]:
+        slot = self.index.get(id)
+        return None if slot is None else self.flags[slot]
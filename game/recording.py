@@ -0,0 +1,357 @@
+"""
+Session recording and replay.
+
+The server can record the state of the world on every tick to a file. The
+file holds binary protocol frames (see protocol.py) grouped into chunks of
+CHUNK_TICKS ticks. Each chunk starts with a keyframe of every entity, is
+followed by one delta per tick that changed anything, and is compressed on
+its own:
+
+    MAGIC
+    chunk header (first tick, last tick, number of frames, compressed size)
+    zlib( frame size, frame, frame size, frame, ... )
+    chunk header
+    ...
+
+The chunk headers index the file, so the state at any tick is found by
+skipping to the chunk that covers it and applying at most one chunk's frames.
+Encoding a frame is the only recording work done on the tick; compressing and
+writing chunks happens on a background thread.
+
+    python -m game.recording info <file>
+    python -m game.recording bench <file>
+    python -m game.recording play <file> --speed=4 --start=3600
+
+Usage:
+  recording info <file>
+  recording bench <file> [--start=<tick>] [--end=<tick>]
+  recording play <file> [--speed=<x>] [--start=<tick>] [--end=<tick>]
+
+Options:
+  --start=<tick>  First tick to replay
+  --end=<tick>    Last tick to replay
+  --speed=<x>     Replay speed, 0 for as fast as possible [default: 1]
+"""
+
+from typing import *
+import asyncio
+import bisect
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import docopt
+
+from . import protocol
+from . import render
+from .tick import TICK_RATE
+
+if TYPE_CHECKING:
+    from . import store
+
+
+MAGIC = b"PKREC\x01"
+
+# first tick, last tick, number of frames, compressed size
+CHUNK_HEADER = struct.Struct("<IIII")
+FRAME_SIZE = struct.Struct("<I")
+
+# Ticks per chunk. Seeking to a tick applies up to this many frames
+CHUNK_TICKS = 300
+
+COMPRESSION_LEVEL = 6
+
+MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../maps/mst_campus.txt")
+
+
+class Recorder:
+    """
+    Writes the per tick state of the world to <path>. Call record() once per
+    tick and close() when done
+    """
+
+    def __init__(self, path: str, chunk_ticks: int = CHUNK_TICKS, level: int = COMPRESSION_LEVEL):
+        self.chunk_ticks = chunk_ticks
+        self.level = level
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+
+        # Encoded frames of the chunk being recorded and the ticks it covers
+        self.frames = []  # type: List[bytes]
+        self.first_tick = self.last_tick = 0
+
+        # Full chunks are compressed and written by a background thread
+        self._chunks = queue.Queue()
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def record(self, tick: int, entities: "store.EntityStore", changed: Iterable[int], removed: Iterable[int]):
+        """
+        Record <tick>, on which the entities with <changed> ids changed and
+        the <removed> ids left the game
+        """
+        if self.frames and tick - self.first_tick >= self.chunk_ticks:
+            self.flush()
+
+        if not self.frames:
+            self.first_tick = tick
+            self.frames.append(protocol.encode_columns(protocol.KEYFRAME, tick, *entities.columns(entities)))
+        else:
+            changed = list(changed)
+            removed = list(removed)
+            if changed or removed:
+                self.frames.append(protocol.encode_columns(
+                    protocol.DELTA, tick, *entities.columns(changed), removed
+                ))
+        self.last_tick = tick
+
+    def flush(self):
+        """
+        Hand the chunk being recorded to the writer thread
+        """
+        if self.frames:
+            self._chunks.put((self.first_tick, self.last_tick, self.frames))
+            self.frames = []
+
+    def close(self):
+        self.flush()
+        self._chunks.put(None)
+        self._thread.join()
+        self.file.close()
+
+    def _write(self):
+        while True:
+            chunk = self._chunks.get()
+            if chunk is None:
+                return
+            first, last, frames = chunk
+            payload = zlib.compress(
+                b"".join(FRAME_SIZE.pack(len(frame)) + frame for frame in frames), self.level
+            )
+            self.file.write(CHUNK_HEADER.pack(first, last, len(frames), len(payload)))
+            self.file.write(payload)
+            self.file.flush()
+
+
+class Chunk(NamedTuple):
+    first_tick: int
+    last_tick: int
+    frames: int
+    offset: int  # of the compressed payload
+    size: int
+
+
+class Recording:
+    """
+    Read access to a recording. The chunk index is built from the chunk
+    headers when the file is opened. A chunk cut short by a crash while it was
+    being written is ignored
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            self.file.close()
+            raise ValueError(f"{path} is not a recording")
+
+        self.chunks = []  # type: List[Chunk]
+        end = os.fstat(self.file.fileno()).st_size
+        offset = len(MAGIC)
+        while offset + CHUNK_HEADER.size <= end:
+            self.file.seek(offset)
+            first, last, frames, size = CHUNK_HEADER.unpack(self.file.read(CHUNK_HEADER.size))
+            offset += CHUNK_HEADER.size
+            if offset + size > end:
+                break
+            self.chunks.append(Chunk(first, last, frames, offset, size))
+            offset += size
+        self._starts = [ chunk.first_tick for chunk in self.chunks ]
+
+        # Most recently decompressed chunk, as (index, frames)
+        self._cached = (None, [])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def first_tick(self) -> Optional[int]:
+        return self.chunks[0].first_tick if self.chunks else None
+
+    @property
+    def last_tick(self) -> Optional[int]:
+        return self.chunks[-1].last_tick if self.chunks else None
+
+    def chunk_frames(self, index: int) -> List[bytes]:
+        """
+        Return the encoded frames of the <index>th chunk, keyframe first
+        """
+        if self._cached[0] == index:
+            return self._cached[1]
+
+        chunk = self.chunks[index]
+        self.file.seek(chunk.offset)
+        payload = memoryview(zlib.decompress(self.file.read(chunk.size)))
+        frames = []
+        offset = 0
+        for _ in range(chunk.frames):
+            size, = FRAME_SIZE.unpack_from(payload, offset)
+            offset += FRAME_SIZE.size
+            frames.append(bytes(payload[offset:offset + size]))
+            offset += size
+
+        self._cached = (index, frames)
+        return frames
+
+    def chunk_at(self, tick: int) -> Optional[int]:
+        """
+        Return the index of the chunk covering <tick>, or None if the
+        recording doesn't cover it. Ticks the server skipped between two
+        chunks belong to the earlier one, as nothing changed on them
+        """
+        index = bisect.bisect_right(self._starts, tick) - 1
+        if index < 0 or tick > self.last_tick:
+            return None
+        return index
+
+    def state_at(self, tick: int) -> protocol.EntityTable:
+        """
+        Return the state of the world as of <tick>
+        """
+        index = self.chunk_at(tick)
+        if index is None:
+            raise KeyError(f"tick {tick} is not in the recording")
+
+        table = protocol.EntityTable()
+        for payload in self.chunk_frames(index):
+            frame = protocol.decode(payload)
+            if frame.tick > tick:
+                break
+            table.apply(frame)
+        return table
+
+    def frames(self, start: int = None, end: int = None) -> Iterator[bytes]:
+        """
+        Generate the encoded frames from tick <start> to tick <end>. A replay
+        starting in the middle of a chunk begins with a keyframe of the state
+        at <start>, so the frames can be fed to a client as they are
+        """
+        if not self.chunks:
+            return
+        start = self.first_tick if start is None else max(start, self.first_tick)
+        end = self.last_tick if end is None else end
+
+        index = self.chunk_at(start)
+        if index is None:
+            return
+        synthesized = start != self.chunks[index].first_tick
+        if synthesized:
+            table = self.state_at(start)
+            yield protocol.encode_columns(
+                protocol.KEYFRAME, start, table.ids, table.rows, table.cols, table.glyphs, table.flags
+            )
+
+        for index in range(index, len(self.chunks)):
+            if self.chunks[index].first_tick > end:
+                return
+            for payload in self.chunk_frames(index):
+                frame_tick = protocol.HEADER.unpack_from(payload)[2]
+                if frame_tick > end:
+                    return
+                if frame_tick > start or (frame_tick == start and not synthesized):
+                    yield payload
+
+
+async def play(frames: Iterable[bytes], speed: float = 1.0) -> AsyncIterator[bytes]:
+    """
+    Yield <frames> paced at <speed> times the rate they were recorded at, or
+    as fast as possible if <speed> is 0
+    """
+    clock = time.perf_counter
+    started = first = None
+    for payload in frames:
+        tick = protocol.HEADER.unpack_from(payload)[2]
+        if speed:
+            if started is None:
+                started, first = clock(), tick
+            delay = started + (tick - first) / TICK_RATE / speed - clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield payload
+
+
+def bench(recording: Recording, start: int = None, end: int = None) -> dict:
+    """
+    Decode the frames from <start> to <end> and draw them on the map as the
+    client does, as fast as possible
+    """
+    with open(MAP_FILE) as fp:
+        mapdata = render.Map(fp)
+    table = protocol.EntityTable()
+
+    frames = nbytes = 0
+    first = last = None
+    started = time.perf_counter()
+    for payload in recording.frames(start, end):
+        frame = protocol.decode(payload)
+        table.apply(frame)
+        mapdata.update_entities(zip(table.ids, table.rows, table.cols, map(chr, table.glyphs)))
+        frames += 1
+        nbytes += len(payload)
+        first = frame.tick if first is None else first
+        last = frame.tick
+    elapsed = time.perf_counter() - started
+
+    ticks = 0 if first is None else last - first + 1
+    return {
+        "frames": frames,
+        "bytes": nbytes,
+        "seconds": elapsed,
+        "frames_per_s": frames / elapsed if elapsed else 0.0,
+        "speedup": ticks / TICK_RATE / elapsed if elapsed else 0.0,
+    }
+
+
+def start():
+    args = docopt.docopt(__doc__)
+    tick_arg = lambda name: None if args[name] is None else int(args[name])
+
+    with Recording(args["<file>"]) as recording:
+        if args["info"]:
+            frames = sum(chunk.frames for chunk in recording.chunks)
+            size = os.path.getsize(args["<file>"])
+            print(f"ticks {recording.first_tick} to {recording.last_tick}")
+            print(f"{len(recording.chunks)} chunks, {frames} frames, {size} bytes")
+
+        elif args["bench"]:
+            result = bench(recording, tick_arg("--start"), tick_arg("--end"))
+            print(
+                f"{result['frames']} frames ({result['bytes']} bytes) in {result['seconds']:.3f}s, "
+                f"{result['frames_per_s']:.0f} frames/s, {result['speedup']:.1f}x real time"
+            )
+
+        elif args["play"]:
+            async def run():
+                table = protocol.EntityTable()
+                frames = recording.frames(tick_arg("--start"), tick_arg("--end"))
+                async for payload in play(frames, float(args["--speed"])):
+                    frame = protocol.decode(payload)
+                    table.apply(frame)
+                    kind = "keyframe" if frame.kind == protocol.KEYFRAME else "delta"
+                    print(f"tick {frame.tick:>8} {kind:>8} {len(frame.ids):>5} changed {len(table):>5} entities")
+            try:
+                asyncio.run(run())
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == "__main__":
+    start()
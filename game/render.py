@@ -1,6 +1,6 @@
 from typing import *
-import math
-import asyncio
+
+from . import fov
 
 if TYPE_CHECKING:
     from . import entity
@@ -16,40 +16,146 @@ OCCLUDED_CHAR = "."
 WALL_CHAR = "W"
 TRAVERSABLE_CHARS = {" ", "|", "-", "3"}.union({ chr(x) for x in range(65, 91) if chr(x) != "W" }) # Add upper case letters to traversable chars
 
-# Derived
-ARC_RADIANS = math.pi / (4 * VIEW_RADIUS)
-ARC_FULL_REV = 8 * VIEW_RADIUS
-
 
 class Map:
+    """
+    The static terrain of the map with a layer of entity glyphs on top. The
+    layer is updated in place as entities move, appear or leave, and the two
+    are only composited into the window that is drawn, see window()
+    """
 
     lines = 0
     columns = 0
 
     def __init__(self, file: "TextIOWrapper"):
-        self._orig = self._data = tuple(row.strip() for row in file.readlines())[:]
+        self._data = tuple(row.strip() for row in file.readlines())
         self._nrows = len(self._data)
         self._ncols = len(self._data[0])
 
+        # Entity layer. Where entities share a cell the last one placed is
+        # drawn
+        self._entities = {}  # type: Dict[Any, Tuple[int, int, str]]
+        self._cells = {}     # type: Dict[Tuple[int, int], Dict[Any, str]]
+
+        self._visibility = None  # type: Optional[fov.VisibilityCache]
+
+        # The terrain as a tuple of characters per row, so frames are filled
+        # by copying references instead of making a string per cell
+        self._glyphs = tuple(tuple(line) for line in self._data)
+
     @property
     def data(self):
+        """
+        The terrain, without entities
+        """
         return self._data
 
     @property
     def nrows(self):
         return self._nrows
-    
-    def update_data(self, clients):
-        tmp = [list(row) for row in self._orig]
-        
-        for client in clients.values():
-            y, x = client["pos"]
-            char = client["reprchar"]
 
-            tmp[y][x] = char
-        
-        self._data = [ "".join(row) for row in tmp ]
+    @property
+    def visibility(self) -> fov.VisibilityCache:
+        """
+        What each cell of the terrain sees, see fov.py
+        """
+        if self._visibility is None:
+            self._visibility = fov.VisibilityCache(self._data, OCCLUSION_CHARS)
+        return self._visibility
+
+    def __len__(self):
+        """
+        Number of entities on the map
+        """
+        return len(self._entities)
 
+    def glyph(self, row: int, col: int) -> str:
+        """
+        The character drawn at <row>, <col>
+        """
+        cell = self._cells.get((row, col))
+        if cell:
+            return next(reversed(cell.values()))
+        return self._data[row][col]
+
+    def passable(self, pos) -> bool:
+        """
+        Whether a player may step on <pos>: a cell inside the map where neither
+        the terrain nor an entity blocks the way
+        """
+        row, col = pos
+        if not (0 <= row < self._nrows and 0 <= col < len(self._data[row])):
+            return False
+        return self.glyph(row, col) in TRAVERSABLE_CHARS
+
+    def place(self, id, row: int, col: int, char: str):
+        """
+        Put entity <id> on the map, or move it
+        """
+        if self._entities.get(id) == (row, col, char):
+            return
+        if id in self._entities:
+            self.remove(id)
+        self._entities[id] = (row, col, char)
+        self._cells.setdefault((row, col), {})[id] = char
+
+    def remove(self, id):
+        row, col, _ = self._entities.pop(id)
+        cell = self._cells[row, col]
+        del cell[id]
+        if not cell:
+            del self._cells[row, col]
+
+    def update_data(self, clients):
+        """
+        Show the json entity table <clients>, { id: state }
+        """
+        self.update_entities(
+            (id, client["pos"][0], client["pos"][1], client["reprchar"])
+            for id, client in clients.items()
+        )
+
+    def update_entities(self, entities: Iterable[Tuple[Any, int, int, str]]):
+        """
+        Show exactly the (id, row, col, char) <entities>. Only entities that
+        moved, appeared or left touch the layer
+        """
+        seen = set()
+        for id, row, col, char in entities:
+            seen.add(id)
+            self.place(id, row, col, char)
+        for id in [ id for id in self._entities if id not in seen ]:
+            self.remove(id)
+
+    def window(self, row: int, col: int, nrows: int, ncols: int) -> List[List[str]]:
+        """
+        The <nrows> x <ncols> characters from <row>, <col> with the entities
+        drawn over the terrain
+        """
+        view = [ list(line[col:col + ncols]) for line in self._data[row:row + nrows] ]
+        for (r, c), cell in self._cells.items():
+            if row <= r < row + nrows and col <= c < col + ncols:
+                line = view[r - row]
+                if c - col < len(line):
+                    line[c - col] = next(reversed(cell.values()))
+        return view
+
+    def draw(self, frame: List[List[str]], top: int, left: int):
+        """
+        Draw the map from <top>, <left> into the rows of <frame> in place.
+        Cells off the map are blank
+        """
+        ncols = len(frame[0]) if frame else 0
+        for r, line in enumerate(frame, top):
+            glyphs = self._glyphs[r][max(0, left):left + ncols] if 0 <= r < self._nrows else ()
+            line[:len(glyphs)] = glyphs
+            if len(glyphs) < ncols:
+                line[len(glyphs):] = " " * (ncols - len(glyphs))
+
+        bottom, right = top + len(frame), left + ncols
+        for (r, c), cell in self._cells.items():
+            if top <= r < bottom and left <= c < right:
+                frame[r - top][c - left] = next(reversed(cell.values()))
 
     @property
     def ncols(self):
@@ -74,10 +180,7 @@ class Map:
         else:
             col_start, col_end = (self._ncols - NCOLS, self._ncols)
     
-        return [
-            list(self.data[i][col_start:col_end])
-            for i in range(row_start, row_end)
-        ]
+        return self.window(row_start, col_start, row_end - row_start, col_end - col_start)
 
 
 class View:
@@ -117,45 +220,52 @@ class View:
 
         self.free_move_offset = (free_move_row_offset, free_move_col_offset)
         self.free_move_size = (free_move_row_size, free_move_col_size)
-        self.data = [
-            [mapdata.data[i][j] for j in range(col, col + NCOLS)]
-            for i in range(row, row + NROWS)
-        ]
+        self.data = mapdata.window(row, col, NROWS, NCOLS)
 
 
-def apply_occlusion_layer(chunk: List[List[str]], pos: Tuple[int, int]):
+def apply_occlusion_layer(chunk: List[List[str]], pos: Tuple[int, int], radius: int = VIEW_RADIUS,
+                          cache: "fov.VisibilityCache" = None, origin: Tuple[int, int] = (0, 0)):
     """
     Implement visual occlusion from the given position. Objects can only be seen
-    if they are not blocked and within VIEW_RADIUS
+    if they are not blocked and within <radius>. With a <cache> of the map the
+    chunk was cut from at <origin>, what the position sees is looked up
+    instead of computed. See fov.py
     """
-    
-    def validate_pos(pos):
-        row, col = pos
-        max_row, max_col = len(chunk), len(chunk[0])
-        return 0 <= row < max_row and 0 <= col < max_col   
-    
-    row, col = pos
-    render_set = set()
-    for s in range(ARC_FULL_REV):
-        theta = s * ARC_RADIANS
-        i_row, i_col = row, col
-        for i in range(VIEW_RADIUS):            
-            i_row += math.sin(theta)
-            i_col += math.cos(theta)
-            
-            (r, c) = textpos = math.floor(i_row), math.floor(i_col)
-
-            if not validate_pos(textpos):
-                break
+    row, col = int(pos[0]), int(pos[1])
+    if cache is not None:
+        top, left = origin
+        visible = cache.window(top, left, len(chunk), len(chunk[0]), (top + row, left + col), radius)
+    else:
+        visible = fov.shadowcast(chunk, (row, col), radius, OCCLUSION_CHARS)
+    fov.occlude(chunk, visible, OCCLUDED_CHAR)
 
-            render_set.add(textpos)
-            if chunk[r][c] in OCCLUSION_CHARS:
-                break
-    
-    for i in range(len(chunk)):
-        for j in range(len(chunk[0])):
-            if (i, j) not in render_set:
-                chunk[i][j] = OCCLUDED_CHAR
+
+class FrameBuffer:
+    """
+    The characters of a frame, <nrows> rows of <ncols> lists, redrawn in place
+    on every frame and only reallocated when the terminal is resized
+    """
+
+    def __init__(self, nrows: int = 0, ncols: int = 0):
+        self.nrows = self.ncols = 0
+        self.rows = []  # type: List[List[str]]
+        self.resize(nrows, ncols)
+
+    def resize(self, nrows: int, ncols: int) -> bool:
+        """
+        Return whether the buffer had to be reallocated
+        """
+        if (nrows, ncols) == (self.nrows, self.ncols):
+            return False
+        self.nrows, self.ncols = nrows, ncols
+        self.rows = [ [" "] * ncols for _ in range(nrows) ]
+        return True
+
+    def lines(self) -> List[str]:
+        """
+        The rows as strings, ready to be written to the terminal
+        """
+        return [ "".join(row) for row in self.rows ]
 
 
 class Camera:
@@ -181,24 +291,26 @@ class Camera:
         # view port without the map panning underneath. This is a generated
         # value
         self._free_move_offset = [0, 0]
+
+        # Every view is drawn into this buffer
+        self.frame = FrameBuffer()
         
     
     def _view(self):
         """
-        Internal method that generates a "chunk" based on the camera position
-        relative to the global map
+        Internal method that draws a "chunk" based on the camera position
+        relative to the global map into the frame buffer
         """
         
-        NROWS, NCOLS = Map.lines, Map.columns
         row, col = self.position
-        return [
-                [self.bound_map.data[i][j] for j in range(col, col + NCOLS)]
-                for i in range(row, row + NROWS)
-        ]
+        self.frame.resize(Map.lines, Map.columns)
+        self.bound_map.draw(self.frame.rows, row, col)
+        return self.frame.rows
 
     def __iter__(self):
         """
-        Return a generator that generates a new view on each iteration
+        Return a generator that draws a new view on each iteration. Every view
+        is the same frame buffer
         """
         while True:
             self.current_view = self._view()
@@ -220,49 +332,44 @@ class Camera:
         return int(r_row), int(r_col)
     
 
-    async def update_box(self):
+    def fit(self):
         """
-        Continuously update camera parameters based on terminal size and entity
-        position.
+        Update camera parameters based on terminal size and entity position.
         """
 
-        while True:
-            NROWS, NCOLS =  Map.lines, Map.columns
-            row, col = self.position
-
-            if row + NROWS > self.bound_map.nrows:
-                row = self.bound_map.nrows - NROWS
-            if col + NCOLS > self.bound_map.ncols:
-                col = self.bound_map.ncols - NCOLS
-
-            assert BUFFER_RADIUS * 2 <= NROWS, "Bigger terminal needed" 
-            assert BUFFER_RADIUS * 2 <= NCOLS, "Bigger terminal needed"
-
-            if not row:
-                free_move_row_offset = 0
-                free_move_row_size = NROWS - BUFFER_RADIUS
-            elif row + NROWS == self.bound_map.nrows:
-                free_move_row_offset = BUFFER_RADIUS
-                free_move_row_size = NROWS - BUFFER_RADIUS
-            else:
-                free_move_row_offset = BUFFER_RADIUS
-                free_move_row_size = NROWS - BUFFER_RADIUS * 2
-            
-            if not col:
-                free_move_col_offset = 0
-                free_move_col_size = NCOLS - BUFFER_RADIUS
-            elif col + NCOLS == self.bound_map.ncols:
-                free_move_col_offset = BUFFER_RADIUS
-                free_move_col_size = NCOLS - BUFFER_RADIUS
-            else:
-                free_move_col_offset = BUFFER_RADIUS
-                free_move_col_size = NCOLS - BUFFER_RADIUS * 2
-
-            self._free_move_offset = (free_move_row_offset, free_move_col_offset)
-            self.free_move_size = (free_move_row_size, free_move_col_size)
-            await asyncio.sleep(1/60)
-    
+        NROWS, NCOLS =  Map.lines, Map.columns
+        row, col = self.position
+
+        if row + NROWS > self.bound_map.nrows:
+            row = self.bound_map.nrows - NROWS
+        if col + NCOLS > self.bound_map.ncols:
+            col = self.bound_map.ncols - NCOLS
 
+        assert BUFFER_RADIUS * 2 <= NROWS, "Bigger terminal needed" 
+        assert BUFFER_RADIUS * 2 <= NCOLS, "Bigger terminal needed"
+
+        if not row:
+            free_move_row_offset = 0
+            free_move_row_size = NROWS - BUFFER_RADIUS
+        elif row + NROWS == self.bound_map.nrows:
+            free_move_row_offset = BUFFER_RADIUS
+            free_move_row_size = NROWS - BUFFER_RADIUS
+        else:
+            free_move_row_offset = BUFFER_RADIUS
+            free_move_row_size = NROWS - BUFFER_RADIUS * 2
+        
+        if not col:
+            free_move_col_offset = 0
+            free_move_col_size = NCOLS - BUFFER_RADIUS
+        elif col + NCOLS == self.bound_map.ncols:
+            free_move_col_offset = BUFFER_RADIUS
+            free_move_col_size = NCOLS - BUFFER_RADIUS
+        else:
+            free_move_col_offset = BUFFER_RADIUS
+            free_move_col_size = NCOLS - BUFFER_RADIUS * 2
+
+        self._free_move_offset = (free_move_row_offset, free_move_col_offset)
+        self.free_move_size = (free_move_row_size, free_move_col_size)
 
     @property
     def free_move_position(self):
@@ -312,12 +419,11 @@ class Camera:
         return self.bound_entity.row - self.position[0], self.bound_entity.col - self.position[1]
 
 
-    async def update_position(self):
-        while True:
-            try:
-                row_offset, col_offset = self.entity_free_move_offset()
-                self.position[0] += row_offset
-                self.position[1] += col_offset
-                await asyncio.sleep(1/30)
-            except:
-                exit()
+    def follow(self):
+        """
+        Pan the camera until the bound entity is back inside the free move box
+        """
+        row_offset, col_offset = self.entity_free_move_offset()
+        self.position[0] += row_offset
+        self.position[1] += col_offset
+
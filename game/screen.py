@@ -0,0 +1,172 @@
+"""
+Dirty region terminal output. The client hands every frame to a Screen as a
+list of row strings. The Screen compares them with the previous frame and only
+writes the spans that changed, then flushes them to the terminal in one
+batch with noutrefresh() and doupdate(). A frame with nothing new on it writes
+nothing, so output grows with what changes on screen rather than with the size
+of the terminal.
+
+Frames are only drawn when something changed. Key presses, network updates
+and terminal resizes call FrameScheduler.request(), and the client draws a
+frame each time FrameScheduler.wait() returns, at most MAX_FPS times a second.
+With nothing requested wait() blocks, so an idle client sleeps until its
+input or its socket wakes it up.
+"""
+
+from typing import *
+import asyncio
+import curses
+import math
+import time
+
+
+# Most frames drawn per second
+MAX_FPS = 60
+
+# Changed spans of a row closer together than this many cells are written as
+# one span, since moving the cursor costs about as much as a few characters
+SPAN_GAP = 4
+
+
+def changed_spans(old: str, new: str, gap: int = SPAN_GAP) -> List[Tuple[int, int]]:
+    """
+    The (start, end) spans of <new> that differ from <old>. Cells of <new>
+    past the end of <old> count as changed
+    """
+    spans = []
+
+    def add(start, end):
+        if spans and start - spans[-1][1] < gap:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+
+    for i, (a, b) in enumerate(zip(old, new)):
+        if a != b:
+            add(i, i + 1)
+    if len(new) > len(old):
+        add(len(old), len(new))
+    return spans
+
+
+class Screen:
+    """
+    Draws frames on the curses <window>, writing only what changed since the
+    previous frame
+    """
+
+    def __init__(self, window: "curses.window", update: Callable[[], None] = curses.doupdate):
+        self.window = window
+        self.update = update
+        self.lines = []  # type: List[str]
+
+        # Characters written to the window, and frames that were repainted
+        # from scratch
+        self.cells_written = 0
+        self.repaints = 0
+
+    def invalidate(self):
+        """
+        Repaint everything on the next frame
+        """
+        self.lines = []
+
+    def draw(self, lines: Sequence[str]):
+        if len(lines) != len(self.lines) or (lines and len(lines[0]) != len(self.lines[0])):
+            # The terminal was resized, or this is the first frame
+            self.window.clear()
+            self.repaints += 1
+            previous = [""] * len(lines)
+        else:
+            previous = self.lines
+
+        for y, (old, new) in enumerate(zip(previous, lines)):
+            if old == new:
+                continue
+            for start, end in changed_spans(old, new):
+                self._write(y, start, new[start:end])
+
+        self.lines = list(lines)
+        self.window.noutrefresh()
+        self.update()
+
+    def _write(self, y: int, x: int, text: str):
+        try:
+            self.window.addstr(y, x, text)
+        except curses.error:
+            # Writing the bottom right cell moves the cursor off the window
+            pass
+        self.cells_written += len(text)
+
+
+class FrameScheduler:
+    """
+    Decides when the client draws a frame: only after one was requested, and
+    no more than <max_fps> times a second
+    """
+
+    def __init__(self, max_fps: float = MAX_FPS, clock=time.monotonic):
+        self.interval = 1 / max_fps if max_fps else 0.0
+        self.clock = clock
+        self._last = -math.inf
+
+        # Whether a frame was requested since the last one was drawn, and the
+        # future a waiting wait() sleeps on. The future is made by wait() on
+        # the running loop, since the scheduler may be built before it runs
+        self._requested = False
+        self._wakeup = None  # type: Optional[asyncio.Future]
+
+        # File descriptors watched for input, and those whose reader is paused
+        # until the next wait()
+        self._loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self._paused = []  # type: List[int]
+
+        # Frames drawn, and requests for one. Requests that arrive before
+        # the next frame is drawn share it
+        self.frames = 0
+        self.requests = 0
+
+    def request(self):
+        """
+        Ask for a frame, e.g. because the state on screen changed
+        """
+        self.requests += 1
+        self._requested = True
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    def watch(self, fd: int):
+        """
+        Request a frame whenever <fd> has input to read. Call from the running
+        event loop
+        """
+        self._loop = asyncio.get_event_loop()
+        self._loop.add_reader(fd, self._readable, fd)
+
+    def _readable(self, fd: int):
+        # The input is only read once the frame is drawn. Until then the fd
+        # stays readable, and a reader left in place would be called on every
+        # pass of the event loop, so it is paused until the next wait()
+        self._loop.remove_reader(fd)
+        self._paused.append(fd)
+        self.request()
+
+    async def wait(self):
+        """
+        Return when the next frame should be drawn: once a frame was requested
+        and at least 1 / <max_fps> seconds after the last one. Watched fds
+        are read from again when this is called, since the input that woke
+        the last frame has been read by then
+        """
+        while self._paused:
+            fd = self._paused.pop()
+            self._loop.add_reader(fd, self._readable, fd)
+        if not self._requested:
+            self._wakeup = asyncio.get_event_loop().create_future()
+            await self._wakeup
+        delay = self._last + self.interval - self.clock()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._requested = False
+        self._last = self.clock()
+        self.frames += 1
@@ -3,7 +3,27 @@ import asyncio
 import json
 import random
 import math
+import re
+import itertools
+import time
+import traceback
 from typing import *
+from . import delta
+from . import connection
+from . import spatial
+from . import tick
+from . import ghostsim
+from . import protocol
+from . import ghosts
+from . import shard
+from . import pathfinding
+from . import render
+from . import stats
+from . import recording
+from . import triggers
+from . import store
+from . import lod
+from . import inputs
 
 '''
 
@@ -77,12 +97,95 @@ REPEL_RADIUS = 10
 # If this count of ghost within PETRIFIED radius is reached, player can't move
 GHOST_COUNT_FOR_PETRIFICATION = 4
 
-# Perhaps better named "Entities". Stores all entities in { id: { state } } pair
-clients = {}
+# Ghosts are kept strictly inside these bounds
+MAP_ROWS = 160
+MAP_COLS = 300
 
-clients_ws = set()
-player_ids = set()
-idcounter = 0
+# Walls on this map block players, and ghosts when FLOW_FIELD is set
+MAP_FILE = "maps/mst_campus.txt"
+
+# Move ghosts along a flow field over the traversable cells of the map instead
+# of in a straight line towards the closest player. See pathfinding.py
+FLOW_FIELD = True
+
+# Simulate all ghosts at once with numpy arrays when numpy is installed. See
+# ghostsim.py. numpy comes with the "fast" extra, pip install .[fast]. Set
+# to False to use the per-ghost systems whether or not it is installed
+VECTORIZED_GHOSTS = ghostsim.available
+
+# Simulate ghosts in this many worker processes, each owning a band of map
+# columns. See shard.py. When 0 ghosts are simulated in this process. Shards
+# only get ghost and player positions, not the map, so they move ghosts in
+# straight lines through walls and can't tell how far they walk. Setting this
+# needs FLOW_FIELD and GHOST_LOD_TIERS off, see check_config()
+SHARDS = 0
+
+# Move ghosts that are far from every player only on some ghost AI and
+# brownian steps, and freeze the ones beyond the last tier. Tiers are
+# (distance, divisor) pairs, see lod.py. Distances are walking distances when
+# FLOW_FIELD is set. None to move every ghost on every step
+GHOST_LOD_TIERS = lod.TIERS
+
+# Input commands applied per player on every tick, which caps how fast players
+# move. See inputs.py
+INPUTS_PER_TICK = 1
+
+# Run each system on every n-th tick of the scheduler, see tick.py
+GHOST_AI_DIVISOR = 12       # 5 Hz
+BROWNIAN_DIVISOR = 6        # 10 Hz
+PETRIFICATION_DIVISOR = 6
+
+# Serve server stats over http on this port, see stats.py. None to disable
+STATS_HOST = "localhost"
+STATS_PORT = 10001
+
+# Append the stats to this json lines file every STATS_LOG_INTERVAL seconds,
+# keeping STATS_LOG_BACKUPS old files of up to STATS_LOG_MAX_BYTES. None to
+# disable
+STATS_LOG = None
+STATS_LOG_INTERVAL = 10
+STATS_LOG_MAX_BYTES = 10 * 1024 * 1024
+STATS_LOG_BACKUPS = 5
+
+# Record the state of each room on every broadcast tick to this file, see
+# recording.py. "{room}" in the path is replaced by the room name. None to
+# disable
+RECORD_FILE = None
+
+# Ghosts spawned in every room
+GHOST_COUNT = 40
+
+# Clients that connect without naming a room are put in a room with fewer than
+# this many players, or in a new one when every such room is full
+ROOM_CAPACITY = 8
+
+# Refuse new rooms past this many rooms per process
+MAX_ROOMS = 64
+
+# Room names clients may ask for in the connection path, e.g. /picklehacks
+ROOM_NAME = re.compile(r"[\w-]{1,64}")
+
+# Tear a room down once it had no players for this many seconds. Idle rooms
+# are looked for every ROOM_REAP_INTERVAL seconds
+ROOM_IDLE_TIMEOUT = 30
+ROOM_REAP_INTERVAL = 5
+
+# Broadcast only the entities that changed since the previous tick. When False
+# the full entity table is sent on every tick
+DELTA_BROADCAST = True
+
+# Only send each connection the entities around its player. See interest.py
+INTEREST_MANAGEMENT = True
+
+
+# Picks the ghosts that move on each step, when GHOST_LOD_TIERS is set. Shared
+# by every room, it holds no state of its own
+ghost_lod = lod.LevelOfDetail(GHOST_LOD_TIERS) if GHOST_LOD_TIERS else None
+
+# Rows of MAP_FILE, loaded once by start(). Player moves are checked against
+# them, and every room builds its own flow field over them when FLOW_FIELD is
+# set
+map_rows = None  # type: Optional[List[str]]
 
 
 def next_pos():
@@ -101,223 +204,759 @@ def next_reprchar():
               yield character
 
 
-def next_id():
-    """
-    Generate unique entity id
-    """
-    global idcounter
-    while True:
-        yield idcounter
-        idcounter += 1
-
-
-
-def entities_within_radius(origin: Tuple[int, int], radius: float) -> List[int]:
-    """
-    Return a sorted list of entity ids within <radius> of <origin> 
-    """
-
-    return sorted(
-        (id for id in clients if distance(origin, clients[id]["pos"]) <= radius),
-        key = lambda x: distance(origin,clients[id]["pos"])
-    )
-
 def distance(p1, p2):
     y1, x1 = p1
     y2, x2 = p2
     return math.sqrt((y1 - y2)**2 + (x1 - x2)**2)
 
-def entity_distance(id1, id2):
-    return distance(clients[id1]["pos"], clients[id2]["pos"])
 
+class Room:
+    """
+    One isolated world: its own entities, ghosts, tick loop and the
+    connections its state is broadcast to. Entity ids are only unique within a
+    room
+    """
 
-def closest_player(entity_id) -> dict:
-    min_id = min(player_ids, key=lambda x: entity_distance(entity_id, x))
-    return clients[min_id]
+    def __init__(self, name: str, public=False):
+        self.name = name
 
-# Next id
-id_gen = next_id()
+        # Whether clients that did not name a room may be put in this one
+        self.public = public
 
-# Initialize the generator that produces the next spawn position
-pos_gen = next_pos()
+        # Perhaps better named "Entities". Stores every entity as a
+        # { id: Record } table with an id index per entity type. See store.py
+        self.clients = store.EntityStore()
 
-# Initialize the generator that produces the next 
-char_gen = next_reprchar()
+        # Every client connection, keyed by websocket. See connection.py
+        self.clients_ws = {}  # type: Dict[Any, connection.Connection]
+        self.player_ids = self.clients.ids[store.PLAYER]
 
-item_id = next(id_gen)
+        # Character each player spawned with, shown again once it is no
+        # longer petrified
+        self.player_chars = {}  # type: Dict[int, str]
 
-clients[ item_id ] = {
-    "reprchar": "3",
-    "pos":[4, 4],
-    "type": "item",
-    "id": item_id,
-}
+        # Cells players may step on. Without the map only its bounds are
+        # checked
+        if map_rows is not None:
+            self.passable = inputs.terrain(map_rows, render.TRAVERSABLE_CHARS)
+        else:
+            self.passable = lambda pos: 0 <= pos[0] < MAP_ROWS and 0 <= pos[1] < MAP_COLS
+
+        # Spatial indexes over ghost and player positions. Must be kept in
+        # sync with clients whenever a position changes, see set_position
+        self.ghost_grid = spatial.SpatialHash()
+        self.player_grid = spatial.SpatialHash()
+
+        # Items and anything else that reacts to a player stepping on its
+        # cell. Fired by the handler when a player moves, see triggers.py
+        self.cell_triggers = triggers.TriggerIndex()
+
+        # Ghost positions as numpy arrays, when VECTORIZED_GHOSTS is set. The
+        # arrays are authoritative and moved ghosts are copied back into
+        # clients every step
+        self.ghost_arrays = ghostsim.GhostArrays(MAP_ROWS, MAP_COLS) if VECTORIZED_GHOSTS else None
+
+        # Distances to the closest player over the map, when FLOW_FIELD is set
+        self.flow_field = None  # type: Optional[pathfinding.FlowField]
+
+        # Handle on the ghost simulation processes when SHARDS is set
+        self.shard_pool = None  # type: Optional[shard.ShardPool]
+
+        # Writes the session to RECORD_FILE when it is set
+        self.recorder = None  # type: Optional[recording.Recorder]
+
+        # Snapshot of the entity table as of the last broadcast
+        self.previous_snapshot = delta.Snapshot(0, {}, key=store.Record.frozen)
+
+        # Changed and removed ids since the last tick each update rate was
+        # sent on, keyed by the rate's tick divisor. A connection that only
+        # gets every n-th tick is sent everything that changed over those n
+        # ticks
+        self.pending_changes = { tick.TICK_RATE // rate: (set(), set()) for rate in connection.RATES }
+
+        self.scheduler = None  # type: Optional[tick.Scheduler]
+
+        # The task running the scheduler, see open()
+        self.task = None  # type: Optional[asyncio.Task]
+
+        # Loop time the last player left at, None while anyone is connected
+        self.idle_since = None  # type: Optional[float]
+
+        # Next id, spawn position and repr char
+        self.id_gen = itertools.count()
+        self.pos_gen = next_pos()
+        self.char_gen = next_reprchar()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} : {self.name}>({len(self.clients_ws)} connections)"
+
+    def open(self, offset: float = 0.0):
+        """
+        Populate the room and start its tick loop on the running event loop,
+        <offset> seconds out of phase with the other rooms
+        """
+        if FLOW_FIELD and map_rows is not None:
+            self.flow_field = pathfinding.FlowField(map_rows, render.TRAVERSABLE_CHARS, MAP_ROWS, MAP_COLS)
+        if SHARDS:
+            self.shard_pool = shard.ShardPool(SHARDS, MAP_ROWS, MAP_COLS, PETRIFIED_RADIUS, REPEL_RADIUS)
+        if RECORD_FILE is not None:
+            self.recorder = recording.Recorder(RECORD_FILE.format(room=self.name))
+
+        item_id = next(self.id_gen)
+        self.clients.add(item_id, store.ITEM, (4, 4), "3")
+        self.cell_triggers.add(item_id, self.clients[item_id].pos, self.pick_up_item)
+
+        self.generate_ghosts()
+        self.scheduler = self.build_scheduler()
+        self.idle_since = asyncio.get_event_loop().time()
+        self.task = asyncio.ensure_future(self.scheduler.run(offset))
+
+    def close(self):
+        """
+        Stop the tick loop and release the shards and the recording
+        """
+        if self.task is not None:
+            self.task.cancel()
+        try:
+            if self.shard_pool is not None:
+                self.shard_pool.close()
+        finally:
+            if self.recorder is not None:
+                self.recorder.close()
+
+
+    def join(self, ws) -> Tuple[store.Record, connection.Connection]:
+        """
+        Spawn a player for the client on <ws>
+        """
+        id = next(self.id_gen)
+        player = self.clients.add(id, store.PLAYER, next(self.pos_gen), next(self.char_gen))
+        self.player_grid.insert(id, player.pos)
+        self.cell_triggers.fire(id, player.pos)
+        self.player_chars[id] = player.reprchar
+
+        conn = self.clients_ws[ws] = connection.Connection(ws, id)
+        self.idle_since = None
+        return player, conn
+
+    def leave(self, ws):
+        conn = self.clients_ws.pop(ws)
+        self.clients.remove(conn.player_id)
+        self.player_grid.remove(conn.player_id)
+        del self.player_chars[conn.player_id]
+        if not self.clients_ws:
+            self.idle_since = asyncio.get_event_loop().time()
+
+    def move_player(self, id, position):
+        self.set_position(id, position)
+        self.cell_triggers.fire(id, position)
+
+
+    def entities_within_radius(self, origin: Tuple[int, int], radius: float) -> List[int]:
+        """
+        Return a sorted list of ghost and player ids within <radius> of <origin>
+        """
+
+        return sorted(
+            self.ghost_grid.within_radius(origin, radius) + self.player_grid.within_radius(origin, radius),
+            key = lambda x: distance(origin, self.clients[x].pos)
+        )
+
+    def entity_distance(self, id1, id2):
+        return distance(self.clients[id1].pos, self.clients[id2].pos)
+
+    def closest_player(self, entity_id) -> store.Record:
+        min_id = self.player_grid.nearest(self.clients[entity_id].pos)
+        return self.clients[min_id]
+
+    def set_position(self, entity_id, pos):
+        """
+        Move an entity and keep the spatial indexes up to date
+        """
+        self.clients[entity_id].pos = pos
+        if entity_id in self.ghost_grid:
+            self.ghost_grid.move(entity_id, pos)
+        elif entity_id in self.player_grid:
+            self.player_grid.move(entity_id, pos)
+
+    def pick_up_item(self, item_id, player_id):
+        """Give an item to the player that stepped on it"""
+        if player_id in self.player_ids:
+            self.clients[player_id].items.append(self.clients.remove(item_id))
+            self.cell_triggers.remove(item_id)
+
+    def count_ghosts_near_id(self, entity_id):
+        return self.ghost_grid.count_within(
+            self.clients[entity_id].pos, PETRIFIED_RADIUS, exclude=entity_id, inclusive=False
+        )
+
+    def count_players_near_id(self, entity_id:int):
+        return self.player_grid.count_within(
+            self.clients[entity_id].pos, REPEL_RADIUS, exclude=entity_id, inclusive=False
+        )
+
+    def player_positions(self):
+        """
+        Return the ids of every player and their positions as an (n, 2) array
+        """
+        ids = list(self.player_ids)
+        return ids, ghostsim.np.array([ self.clients[id].pos for id in ids ]).reshape(-1, 2)
+
+
+    def can_step(self, pos) -> bool:
+        """
+        Whether a player may step on <pos>: a traversable cell with no ghost or
+        other player on it. The client predicts moves with the same rule, see
+        render.Map.passable
+        """
+        return (
+            self.passable(pos) and
+            not self.ghost_grid.count_within(pos, 0) and
+            not self.player_grid.count_within(pos, 0)
+        )
+
+    def input_system(self, tick: int):
+        """
+        Apply the movement commands players sent, checking every step against
+        the map, and tell each client how far its commands got
+        """
+        clients = self.clients
+        for conn in self.clients_ws.values():
+            queue = conn.inputs
+            if not queue.pending:
+                continue
+            player = clients[conn.player_id]
+            player.reprchar = "X" if player.petrified else self.player_chars[player.id]
+            for key in queue.take(INPUTS_PER_TICK):
+                if player.petrified:
+                    continue
+                pos = inputs.step(player.pos, key, self.can_step)
+                if pos != tuple(player.pos):
+                    self.move_player(player.id, pos)
+            conn.confirm_input(queue.processed, player.pos)
+
+    def petrification_system(self, tick: int):
+        """Petrify players that have too many ghosts around them"""
+        clients = self.clients
+        if self.ghost_arrays is not None:
+            ids, positions = self.player_positions()
+            counts = self.ghost_arrays.petrification_counts(positions, PETRIFIED_RADIUS)
+            for entity_id, count in zip(ids, counts.tolist()):
+                clients[entity_id].petrified = count >= GHOST_COUNT_FOR_PETRIFICATION
+            return
+
+        for entity_id in self.player_ids:
+            if self.count_ghosts_near_id(entity_id) >= GHOST_COUNT_FOR_PETRIFICATION:
+                clients[entity_id].petrified = True
+            else:
+                clients[entity_id].petrified = False
+
+    def ghost_distance(self, id) -> float:
+        """
+        Distance from ghost <id> to the closest player, walking over the flow
+        field if there is one. Infinite when there are no players, since the
+        flow field still holds the distances to the last ones
+        """
+        if not self.player_ids:
+            return math.inf
+        pos = self.clients[id].pos
+        if self.flow_field is not None:
+            d = self.flow_field.distance(pos)
+            return math.inf if d is None else d
+        nearest = self.player_grid.nearest(pos)
+        return math.inf if nearest is None else distance(pos, self.clients[nearest].pos)
+
+    def ghost_due(self, id, step: int) -> bool:
+        """
+        Whether ghost <id> moves on the <step>th step of a ghost system
+        """
+        return ghost_lod is None or ghost_lod.due(id, self.ghost_distance(id), step)
+
+    def active_ghosts(self, step: int):
+        """
+        ghost_due for every row of ghost_arrays, None if every ghost moves
+        """
+        if ghost_lod is None:
+            return None
+        if not self.player_ids:
+            # Frozen, see ghost_distance
+            return ghostsim.np.zeros(len(self.ghost_arrays.ids), dtype=bool)
+        _, positions = self.player_positions()
+        distances = self.ghost_arrays.distances(positions, self.flow_field)
+        return ghost_lod.due_mask(self.ghost_arrays.ids, distances, step)
+
+    def ghost_ai_system(self, tick: int):
+        """Move every ghost one step towards its closest player"""
+        if not self.player_ids:
+            return
+        clients = self.clients
+        flow_field = self.flow_field
+        ai_step = tick // GHOST_AI_DIVISOR
+
+        if flow_field is not None:
+            flow_field.update({ id: clients[id].pos for id in self.player_ids })
+
+            # Whether each player has another player close enough to repel ghosts
+            grouped = [ self.count_players_near_id(id) > 0 for id in flow_field.source_ids ]
+
+            if self.ghost_arrays is not None:
+                grouped = ghostsim.np.array(grouped, dtype=bool)
+                self.sync_ghosts(self.ghost_arrays.step_flow(flow_field, grouped, self.active_ghosts(ai_step)))
+                return
+
+            for id in list(clients.ids[store.GHOST]):
+                if not self.ghost_due(id, ai_step):
+                    continue
+                pos = clients[id].pos
+                source = flow_field.source_of(pos)
+                if source is None:
+                    # No player can be reached from here
+                    continue
+                step = flow_field.next_step(pos, grouped[source])
+                self.set_position(id, (pos[0] + step[0], pos[1] + step[1]))
+            return
+
+        if self.ghost_arrays is not None:
+            _, positions = self.player_positions()
+            self.sync_ghosts(self.ghost_arrays.step_ai(positions, REPEL_RADIUS, self.active_ghosts(ai_step)))
+            return
+
+        for id in list(clients.ids[store.GHOST]):
+            if not self.ghost_due(id, ai_step):
+                continue
+            pos = clients[id].pos
+
+            # Move ghost towards closest player. If the players are grouped, flip
+            # direction of ghost movement (repel)
+            closest = self.closest_player(id)
+            step = ghosts.chase_step(pos, closest.pos, self.count_players_near_id(closest.id) > 0)
+            self.set_position(id, ghosts.bounded_move(pos, step, MAP_ROWS, MAP_COLS))
+
+    def brownian_system(self, tick: int):
+        """Apply brownian motion to ghosts so they don't stack on each other"""
+        brownian_step = tick // BROWNIAN_DIVISOR
+        if self.ghost_arrays is not None:
+            self.sync_ghosts(self.ghost_arrays.step_jitter(self.flow_field, self.active_ghosts(brownian_step)))
+            return
+
+        for id in list(self.clients.ids[store.GHOST]):
+            if not self.ghost_due(id, brownian_step):
+                continue
+            pos = self.clients[id].pos
+            new = ghosts.bounded_move(pos, ghosts.jitter_step(), MAP_ROWS, MAP_COLS)
+            if self.flow_field is None or self.flow_field.is_passable(new):
+                self.set_position(id, new)
+
+    async def shard_system(self, tick: int):
+        """
+        Step the ghost shards and copy what they simulated into the entity
+        table. Stands in for the ghost AI, brownian and petrification systems
+        """
+        clients = self.clients
+        moved, counts = await self.shard_pool.step(
+            [ (id, *clients[id].pos) for id in self.player_ids ],
+            ai = tick % GHOST_AI_DIVISOR == 0,
+            jitter = tick % BROWNIAN_DIVISOR == 0,
+            petrify = tick % PETRIFICATION_DIVISOR == 0,
+        )
+        for id, y, x in moved:
+            self.set_position(id, (y, x))
+        for id, count in counts.items():
+            # The player may have left while the shards were stepping
+            if id in clients:
+                clients[id].petrified = count >= GHOST_COUNT_FOR_PETRIFICATION
+
+    def sync_ghosts(self, rows):
+        """
+        Copy the ghosts at <rows> of ghost_arrays back into the entity table
+        """
+        for id, pos in self.ghost_arrays.positions(rows):
+            self.set_position(id, pos)
+
+    def generate_ghosts(self, count: int = None):
+
+        # Spawn ghosts randomnly around map
+        for _ in range(GHOST_COUNT if count is None else count):
+            pos = [random.randint(1, MAP_ROWS - 1), random.randint(1, MAP_COLS - 1)]
+            while self.flow_field is not None and not self.flow_field.is_passable(pos):
+                # Don't spawn ghosts inside walls
+                pos = [random.randint(1, MAP_ROWS - 1), random.randint(1, MAP_COLS - 1)]
+
+            id = next(self.id_gen)
+            self.clients.add(id, store.GHOST, pos, "\u01EA")
+            self.ghost_grid.insert(id, pos)
+            if self.shard_pool is not None:
+                self.shard_pool.spawn(id, pos)
+            elif self.ghost_arrays is not None:
+                self.ghost_arrays.add(id, pos)
+
+
+    def encode(self, conn: connection.Connection, kind: str, tick: int, changed: Iterable[int],
+               removed: Iterable[int] = (), enter: Iterable[int] = (), leave: Iterable[int] = ()) -> Union[str, bytes]:
+        """
+        Encode a keyframe of the <changed> entities, or a delta, in the wire
+        protocol of <conn>
+        """
+        clients = self.clients
+        if conn.protocol == protocol.BINARY:
+            if kind == delta.KEYFRAME:
+                return protocol.encode_columns(protocol.KEYFRAME, tick, *clients.columns(changed))
+            return protocol.encode_columns(
+                protocol.DELTA, tick, *clients.columns((*changed, *enter)), (*removed, *leave)
+            )
+
+        if kind == delta.KEYFRAME:
+            return json.dumps(delta.keyframe(tick, clients.to_dict(changed)))
+        states = clients.to_dict((*changed, *enter))
+        return json.dumps(delta.delta(tick, states, changed, removed, enter, leave))
+
+    def interest_broadcast(self, conn: connection.Connection, tick: int, changed: Set[int],
+                           positions: Dict[int, Tuple[int, int]]):
+        """
+        Queue the frame for a single connection, restricted to the entities in
+        its area of interest. Entities removed from the game leave the area too
+        """
+        area = conn.interest
+        known = area.ids
+        enter, leave = area.update(positions)
+        if conn.needs_keyframe:
+            conn.push(self.encode(conn, delta.KEYFRAME, tick, area.ids), tick, keyframe=True)
+            return
+
+        changed = [ id for id in changed if id in known and id in area.ids ]
+        if changed or enter or leave:
+            conn.push(self.encode(conn, delta.DELTA, tick, changed, (), enter, leave), tick)
+
+    def broadcast_system(self, tick: int):
+        """
+        Queue the state of the room on each of its connections. Nothing here
+        waits on a socket, see connection.py
+        """
+        clients = self.clients
+        clients_ws = self.clients_ws
+
+        if DELTA_BROADCAST or self.recorder is not None:
+            snapshot = delta.Snapshot(tick, clients, key=store.Record.frozen)
+            changed, removed = snapshot.diff(self.previous_snapshot)
+            self.previous_snapshot = snapshot
+            if self.recorder is not None:
+                self.recorder.record(tick, clients, changed, removed)
+
+        if not DELTA_BROADCAST:
+            # Broadcast state of all clients
+            messages = {}
+            for conn in list(clients_ws.values()):
+                if conn.protocol not in messages:
+                    if conn.protocol == protocol.BINARY:
+                        messages[conn.protocol] = self.encode(conn, delta.KEYFRAME, tick, clients)
+                    else:
+                        messages[conn.protocol] = json.dumps(clients.to_dict())
+                conn.push(messages[conn.protocol], tick, keyframe=True)
+            return
+
+        for pending_changed, pending_removed in self.pending_changes.values():
+            pending_changed.update(changed)
+            pending_changed.difference_update(removed)
+            pending_removed.update(removed)
+
+        if tick % delta.KEYFRAME_INTERVAL == 0:
+            for conn in clients_ws.values():
+                conn.needs_keyframe = True
+
+        # Connections that are sent a frame on this tick, at their own rate
+        due = []
+        for conn in list(clients_ws.values()):
+            if conn.due(tick):
+                conn.adapt()
+                if conn.due(tick):
+                    due.append(conn)
+
+        if INTEREST_MANAGEMENT:
+            # Every area of interest is computed from the same positions
+            positions = clients.positions() if due else {}
+            for conn in due:
+                self.interest_broadcast(conn, tick, self.pending_changes[conn.divisor][0], positions)
+        else:
+            # Every connection with the same protocol and rate gets the same
+            # message, so each one is encoded once and the same buffer is queued
+            # on every connection
+            messages = {}
+            for conn in due:
+                changed, removed = self.pending_changes[conn.divisor]
+                if conn.needs_keyframe:
+                    kind = delta.KEYFRAME
+                elif changed or removed:
+                    kind = delta.DELTA
+                else:
+                    continue
+
+                key = (conn.protocol, kind, conn.divisor)
+                if key not in messages:
+                    if kind == delta.KEYFRAME:
+                        messages[key] = self.encode(conn, kind, tick, clients)
+                    else:
+                        messages[key] = self.encode(conn, kind, tick, changed, removed)
+                conn.push(messages[key], tick, keyframe=kind == delta.KEYFRAME)
+
+        for divisor, (pending_changed, pending_removed) in self.pending_changes.items():
+            if tick % divisor == 0:
+                pending_changed.clear()
+                pending_removed.clear()
+
+    def build_scheduler(self) -> tick.Scheduler:
+        """
+        Every system runs on a single fixed timestep loop, in this order
+        """
+        scheduler = tick.Scheduler()
+        scheduler.add_system("input", self.input_system)
+        if self.shard_pool is not None:
+            scheduler.add_system("shards", self.shard_system, divisor=math.gcd(
+                math.gcd(GHOST_AI_DIVISOR, BROWNIAN_DIVISOR), PETRIFICATION_DIVISOR
+            ))
+        else:
+            scheduler.add_system("ghost_ai", self.ghost_ai_system, divisor=GHOST_AI_DIVISOR)
+            scheduler.add_system("brownian", self.brownian_system, divisor=BROWNIAN_DIVISOR)
+            scheduler.add_system("petrification", self.petrification_system, divisor=PETRIFICATION_DIVISOR)
+        scheduler.add_system("broadcast", self.broadcast_system, catch_up=False)
+        return scheduler
+
+
+    def stats_report(self) -> dict:
+        """
+        Snapshot of the room's instrumentation, see stats.py
+        """
+        scheduler = self.scheduler
+        entities = { type + "s": len(ids) for type, ids in self.clients.ids.items() }
+
+        return {
+            "ticks": {
+                "tick": scheduler.tick,
+                "rate": scheduler.rate,
+                "overruns": scheduler.overruns,
+                "dropped": scheduler.dropped_ticks,
+                "drift": scheduler.drift,
+                "duration": scheduler.durations.to_dict(),
+            },
+            "systems": { system.name: system.durations.to_dict() for system in scheduler.systems },
+            "entities": entities,
+            "connections": [
+                {
+                    "player": conn.player_id,
+                    "protocol": conn.protocol,
+                    "rate": conn.rate,
+                    "frames_sent": conn.frames_sent,
+                    "frames_dropped": conn.frames_dropped,
+                    "bytes_sent": conn.bytes_sent,
+                    "latency": conn.latency,
+                    "stale_frames": conn.stale_frames,
+                }
+                for conn in self.clients_ws.values()
+            ],
+        }
 
 
-def count_ghosts_near_id(entity_id):
-    count = 0
-    for ghost_id in clients:
-        if ghost_id not in player_ids and ghost_id != entity_id:
-            if entity_distance(entity_id, ghost_id) < PETRIFIED_RADIUS:
-                count += 1
-    return count
+# Every open room, keyed by name
+rooms = {}  # type: Dict[str, Room]
 
-def count_players_near_id(entity_id:int):
-    count = 0
-    for player_id in player_ids:
-        if player_id != entity_id:
-            if entity_distance(entity_id, player_id) < REPEL_RADIUS:
-                count += 1
-    return count
+# Numbers the rooms in the order they are opened
+room_numbers = itertools.count(1)
 
+def open_room(name: str = None) -> Optional[Room]:
+    """
+    Open the room <name>, or a new public room when <name> is None. Return
+    None when MAX_ROOMS are open
+    """
+    if len(rooms) >= MAX_ROOMS:
+        return None
+    number = next(room_numbers)
+    if name is None:
+        name = f"room-{number}"
+        while name in rooms:
+            name = f"room-{next(room_numbers)}"
+        room = Room(name, public=True)
+    else:
+        room = Room(name)
+
+    # Spread the ticks of the rooms over the tick period, so they don't all
+    # fall due at the same moment and starve each other of the loop
+    phase = (number * (math.sqrt(5) - 1) / 2) % 1
+    room.open(phase / tick.TICK_RATE)
+    rooms[name] = room
+    print(f"room {name} opened")
+    return room
+
+
+def assign_room(path: str) -> Optional[Room]:
+    """
+    The room a client connecting on <path> plays in. /<name> joins the room
+    <name>, opening it if needed, and any other path joins the fullest public
+    room that has space left. None if the room can't be opened
+    """
+    name = path.strip("/")
+    if ROOM_NAME.fullmatch(name):
+        return rooms.get(name) or open_room(name)
 
-async def update_player_petrification_state(entity_id):
-    """Count the number of ghosts near entity and """
-    while True:
-        if entity_id in player_ids and entity_id in clients:
-            if count_ghosts_near_id(entity_id) >= GHOST_COUNT_FOR_PETRIFICATION:
-                clients[entity_id]["petrified"] = True
-            else:
-                clients[entity_id]["petrified"] = False
-            await asyncio.sleep(1/10)
-        else:
-            break
+    open_rooms = [
+        room for room in rooms.values()
+        if room.public and len(room.clients_ws) < ROOM_CAPACITY
+    ]
+    if open_rooms:
+        return max(open_rooms, key=lambda room: len(room.clients_ws))
+    return open_room()
 
 
+def close_room(room: Room):
+    """
+    Close <room> and forget it. A room that doesn't close cleanly, e.g.
+    because its shards died, is forgotten all the same and the error printed,
+    so it can't take the other rooms down with it
+    """
+    del rooms[room.name]
+    try:
+        room.close()
+    except Exception:
+        print(f"room {room.name} did not close cleanly")
+        traceback.print_exc()
+    else:
+        print(f"room {room.name} closed")
 
-async def handler(ws, path):
-    print("client connected")
 
-    id = next(id_gen)
-    player_ids.add(id)
+def reap_rooms(now: float):
+    """
+    Close every room that has had no players for ROOM_IDLE_TIMEOUT seconds,
+    and every room whose tick loop stopped, e.g. because a shard died. The
+    players of a failed room are disconnected, the other rooms play on
+    """
+    for room in list(rooms.values()):
+        if room.task.done() and not room.task.cancelled():
+            error = room.task.exception()
+            print(f"room {room.name} failed")
+            if error is not None:
+                traceback.print_exception(type(error), error, error.__traceback__)
+            for ws in list(room.clients_ws):
+                asyncio.ensure_future(ws.close(1011, "room failed"))
+            close_room(room)
+            continue
+        if room.idle_since is not None and now - room.idle_since >= ROOM_IDLE_TIMEOUT:
+            close_room(room)
+
+
+def is_int(value) -> bool:
+    # json true and false are bools, which python counts as ints
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def client_message(conn: connection.Connection, message: Union[str, bytes]):
+    """
+    Apply a control message from the client of <conn>. The client reports its
+    terminal size, picks one of the wire protocols offered in the init
+    message, caps its update rate, acknowledges received frames or sends an
+    input command. Anything malformed is ignored, so a client can't drop its
+    own connection or break the room with it
+    """
+    try:
+        message = json.loads(message)
+    except ValueError:
+        return
+    if not isinstance(message, dict):
+        # Clients used to send the position they moved to. Players only move
+        # by input commands now, see Room.input_system
+        return
+
+    view = message.get("view")
+    if isinstance(view, list) and len(view) == 2 and all(is_int(n) and n > 0 for n in view):
+        conn.interest.resize(*view)
+    if isinstance(message.get("protocol"), str):
+        conn.protocol = protocol.negotiate([message["protocol"]])
+        conn.needs_keyframe = True
+    if is_int(message.get("rate")) and message["rate"] > 0:
+        conn.request_rate(message["rate"])
+    if is_int(message.get("ack")):
+        conn.acknowledge(message["ack"])
+    if is_int(message.get("stale")) and message["stale"] >= 0:
+        conn.stale_frames = message["stale"]
+
+    # [seq, key]
+    command = message.get("input")
+    if isinstance(command, list) and len(command) == 2:
+        conn.inputs.push(*command)
 
-    # store player attributes keyed to id. this is the global state of the
-    # multiplayer session
 
-    reprchar = next(char_gen)
+async def handler(ws, path):
+    room = assign_room(path)
+    if room is None:
+        await ws.close(1013, "no room available")
+        return
+    print(f"client connected to room {room.name}")
 
-    init = clients[id] = {
-        "pos": next(pos_gen),
-        "reprchar": reprchar,
-        "id": id,
-        "petrified": False,
-        "items": []
-    }
+    # store player attributes keyed to id. this is the state of the room's
+    # multiplayer session
+    player, conn = room.join(ws)
 
-    clients_ws.add(ws)
-    
-    loop.create_task(update_player_petrification_state(id))
-    await ws.send(json.dumps(init))
+    await ws.send(json.dumps(dict(player.to_dict(), protocols=protocol.PROTOCOLS, room=room.name)))
+    writer = asyncio.ensure_future(conn.writer())
 
     try:
         async for message in ws:
-            position = json.loads(message)
-            # Copy in position data
-            if clients[id]["petrified"]:
-                clients[id]["reprchar"] = "X"
-            else:
-                clients[id]["reprchar"] =  reprchar
-            
-            clients[id]["pos"][:] = position
-            #print(f"{id} - {clients[id]['reprchar']} - {position}")
+            client_message(conn, message)
     finally:
-        del clients[id]
-        player_ids.remove(id)
-        clients_ws.remove(ws)
-        print("client disconnected")
-    
+        room.leave(ws)
+        writer.cancel()
+        print(f"client disconnected from room {room.name}")
 
 
-async def generate_ghosts():
+loop_lag = stats.LoopLag()
 
-    async def update_ghost_position(id):
-        while True:
-            if id in clients:
-                ghost = clients[id]
-                y, x = ghost["pos"]
-                # Initialize as no movement
-                dy, dx = 0, 0 
-                if player_ids:
-
-                    # Move ghost towards closest player
-                    closest = closest_player(id)
-                    player_y, player_x = closest["pos"]
-
-                    if player_y - y < 0:
-                        dy = -1
-                    elif player_y - y > 0:
-                        dy = +1
-                    
-                    if player_x - x < 0:
-                        dx = -1
-                    elif player_x - x > 0:
-                        dx = +1
-
-                    if count_players_near_id(closest["id"]) > 0:  # if the players are grouped, flip direction of ghost movement (repel)                    
-                        dx = dx * -1
-                        dy = dy * -1
-
-                # dy, dx = random.randint(-1, 1), random.randint(-1, 1)
-                if 0 < y + dy < 160:
-                    ghost["pos"][0] = y + dy
-                if 0 < x + dx < 300:
-                    ghost["pos"][1] = x + dx    
-            else:
-                break
-            await asyncio.sleep(1/5)
 
-    async def randomized_movement(id):
-        """Apply brownian motion to ghosts so they don't stack on each other"""
+def stats_report() -> dict:
+    """
+    Snapshot of the server's instrumentation, see stats.py
+    """
+    return {
+        "loop_lag": loop_lag.histogram.to_dict(),
+        "rooms": { name: room.stats_report() for name, room in rooms.items() },
+    }
 
-        while True:
-            if id in clients:
-                ghost = clients[id]
-                y, x = ghost["pos"]
-
-                dy, dx = random.randint(-1, 1), random.randint(-1, 1)
-                if 0 < y + dy < 160:
-                    ghost["pos"][0] = y + dy
-                if 0 < x + dx < 300:
-                    ghost["pos"][1] = x + dx    
-            else:
-                break
-            await asyncio.sleep(1/10)
-
-    # Spawn 40 ghosts randomnly around map
-    for _ in range(40):
-        id = next(id_gen)
-        clients[id] = {
-            "pos": [random.randint(1, 159), random.randint(1, 299)],
-            "reprchar": "\u01EA",
-            "id": id
-        }
-        loop.create_task(update_ghost_position(id))
-        loop.create_task(randomized_movement(id))
 
-async def assign_item_to_player():
-    while True:
-        await asyncio.sleep(1/10)
+async def main():
+    tasks = [asyncio.ensure_future(loop_lag.run())]
+    if STATS_PORT is not None:
+        await stats.serve(STATS_HOST, STATS_PORT, stats_report)
+    if STATS_LOG is not None:
+        logger = stats.rotating_log(STATS_LOG, STATS_LOG_MAX_BYTES, STATS_LOG_BACKUPS)
+        tasks.append(asyncio.ensure_future(stats.dump(logger, STATS_LOG_INTERVAL, stats_report)))
+
+    loop = asyncio.get_event_loop()
+    try:
+        async with websockets.serve(handler, "localhost", 10000) as server:
+            while True:
+                await asyncio.sleep(ROOM_REAP_INTERVAL)
+                reap_rooms(loop.time())
+    finally:
+        for task in tasks:
+            task.cancel()
+        for room in list(rooms.values()):
+            close_room(room)
 
-        for item in list(clients):
-            if clients[item].get("type", False) == "item":
-                for player in player_ids:
-                    if clients[player]["pos"] == clients[item]["pos"]:
-                        clients[player]["items"].append(clients.pop(item))
-                        break
 
-async def main():
-    async with websockets.serve(handler, "localhost", 10000) as server:
-        while True:
-            # Broadcast state of all clients
-            message = json.dumps(clients)
-            for client in clients_ws:
-                await client.send(message)
-            await asyncio.sleep(1/60)
+def check_config():
+    """
+    Raise ValueError for settings that can't be used together
+    """
+    if SHARDS and FLOW_FIELD:
+        raise ValueError("SHARDS can't be used with FLOW_FIELD, shards don't have the map")
+    if SHARDS and GHOST_LOD_TIERS:
+        raise ValueError("SHARDS can't be used with GHOST_LOD_TIERS, shards don't have the map")
+
+
+def start():
+    global map_rows
 
+    check_config()
+    with open(MAP_FILE, "r") as fp:
+        map_rows = render.Map(fp).data
+    asyncio.get_event_loop().run_until_complete(main())
 
 
-loop = asyncio.get_event_loop()
-loop.create_task(main())
-loop.create_task(generate_ghosts())
-loop.create_task(assign_item_to_player())
-loop.run_forever()
\ No newline at end of file
+if __name__ == "__main__":
+    start()
@@ -0,0 +1,222 @@
+"""
+Region sharded ghost simulation. The map is split into bands of columns and
+the ghosts in each band are simulated by their own worker process, so the
+ghost systems can use every core of the machine.
+
+The front process (server.py) keeps the websocket connections, the players
+and the entity table that is broadcast. On every simulation tick it sends each
+shard the position of every player and gets back the ghosts that moved. Players
+are few, so every shard has all of them and ghosts chase and repel exactly as
+in a single process. A player is routed to the shard covering its position,
+which decides whether it is petrified.
+
+Ghosts that walk out of a band are handed off to the shard that covers their
+new position. Each shard also reports the ghosts close to its edges, which
+are replicated to the neighbouring shards for one tick so that petrification
+counts near a border see the ghosts on the other side.
+
+Shards don't have the map. Ghosts move in a straight line towards the closest
+player, as they did before the flow field, and every ghost moves on every
+step. The server refuses to start with shards and FLOW_FIELD or
+GHOST_LOD_TIERS set, rather than quietly ignoring them.
+"""
+
+from typing import *
+import asyncio
+import multiprocessing
+
+from . import ghosts
+from . import spatial
+
+
+# Seconds to wait for a shard process to exit when the pool is closed, before
+# it is terminated
+CLOSE_TIMEOUT = 1.0
+
+
+class Region:
+    """
+    Ghost state of a single shard. Owns the ghosts whose column is in
+    [col_start, col_end)
+    """
+
+    def __init__(self, col_start: int, col_end: int, nrows: int, ncols: int,
+                 petrified_radius: float, repel_radius: float):
+        self.col_start = col_start
+        self.col_end = col_end
+        self.nrows = nrows
+        self.ncols = ncols
+        self.petrified_radius = petrified_radius
+        self.repel_radius = repel_radius
+        self.ghosts = spatial.SpatialHash()
+
+    def owns(self, pos) -> bool:
+        return self.col_start <= pos[1] < self.col_end
+
+    def step(self, message: dict) -> dict:
+        """
+        Run one simulation tick. <message> holds the tick flags "ai", "jitter"
+        and "petrify", and lists of (id, row, col) for "players", for ghosts
+        handed to this shard ("arrivals") and for ghosts near the border of
+        the neighbouring shards ("replicas")
+        """
+        for id, y, x in message["arrivals"]:
+            self.ghosts.insert(id, (y, x))
+
+        players = spatial.SpatialHash()
+        for id, y, x in message["players"]:
+            players.insert(id, (y, x))
+
+        moved = {}
+        if players and message["ai"]:
+            for id in list(self.ghosts):
+                pos = self.ghosts.positions[id]
+                closest = players.nearest(pos)
+                target = players.positions[closest]
+                repel = players.count_within(target, self.repel_radius, exclude=closest, inclusive=False) > 0
+                self._move(id, ghosts.chase_step(pos, target, repel), moved)
+
+        if message["jitter"]:
+            for id in list(self.ghosts):
+                self._move(id, ghosts.jitter_step(), moved)
+
+        handoffs = []
+        for id in list(moved):
+            pos = self.ghosts.positions[id]
+            if not self.owns(pos):
+                self.ghosts.remove(id)
+                handoffs.append((id, *pos))
+
+        border = [
+            (id, y, x) for id, (y, x) in self.ghosts.positions.items()
+            if x < self.col_start + self.petrified_radius or x >= self.col_end - self.petrified_radius
+        ]
+
+        counts = {}
+        if message["petrify"]:
+            replicas = spatial.SpatialHash()
+            for id, y, x in message["replicas"]:
+                replicas.insert(id, (y, x))
+            for id, pos in players.positions.items():
+                if self.owns(pos):
+                    counts[id] = (
+                        self.ghosts.count_within(pos, self.petrified_radius, inclusive=False) +
+                        replicas.count_within(pos, self.petrified_radius, inclusive=False)
+                    )
+
+        return {
+            "moved": [ (id, *pos) for id, pos in moved.items() ],
+            "handoffs": handoffs,
+            "border": border,
+            "counts": counts,
+        }
+
+    def _move(self, id, step, moved: dict):
+        pos = self.ghosts.positions[id]
+        new = ghosts.bounded_move(pos, step, self.nrows, self.ncols)
+        if new != pos:
+            self.ghosts.move(id, new)
+            moved[id] = new
+
+
+def worker(conn, region: Region):
+    """
+    Entry point of a shard process. Answers every step message until it
+    receives None
+    """
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        conn.send(region.step(message))
+
+
+class ShardPool:
+    """
+    The front process' handle on the shard processes
+    """
+
+    def __init__(self, count: int, nrows: int, ncols: int, petrified_radius: float, repel_radius: float):
+        band = -(-ncols // count)
+        self.band = band
+        self.pipes = []
+        self.processes = []
+        for index in range(count):
+            region = Region(
+                index * band, min((index + 1) * band, ncols), nrows, ncols,
+                petrified_radius, repel_radius
+            )
+            front, back = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=worker, args=(back, region), daemon=True)
+            process.start()
+            self.pipes.append(front)
+            self.processes.append(process)
+
+        # Ghosts waiting to be handed to each shard, and ghosts replicated to
+        # each shard from its neighbours
+        self.arrivals = [ [] for _ in range(count) ]
+        self.replicas = [ [] for _ in range(count) ]
+
+    def __len__(self):
+        return len(self.pipes)
+
+    def shard_of(self, pos) -> int:
+        return min(max(int(pos[1]) // self.band, 0), len(self) - 1)
+
+    def spawn(self, id: int, pos):
+        """
+        Hand a new ghost to the shard covering <pos> on the next step
+        """
+        self.arrivals[self.shard_of(pos)].append((id, pos[0], pos[1]))
+
+    async def step(self, players: List[Tuple[int, int, int]], ai: bool, jitter: bool, petrify: bool):
+        """
+        Step every shard concurrently. Return the (id, row, col) of every
+        ghost that moved and the number of ghosts near each player, if
+        <petrify> is set
+        """
+        for index, pipe in enumerate(self.pipes):
+            pipe.send({
+                "ai": ai,
+                "jitter": jitter,
+                "petrify": petrify,
+                "players": players,
+                "arrivals": self.arrivals[index],
+                "replicas": self.replicas[index],
+            })
+            self.arrivals[index] = []
+
+        loop = asyncio.get_event_loop()
+        replies = await asyncio.gather(*(
+            loop.run_in_executor(None, pipe.recv) for pipe in self.pipes
+        ))
+
+        moved, counts = [], {}
+        self.replicas = [ [] for _ in self.pipes ]
+        for index, reply in enumerate(replies):
+            moved.extend(reply["moved"])
+            counts.update(reply["counts"])
+            for id, y, x in reply["handoffs"]:
+                self.arrivals[self.shard_of((y, x))].append((id, y, x))
+            for neighbour in (index - 1, index + 1):
+                if 0 <= neighbour < len(self):
+                    self.replicas[neighbour].extend(reply["border"])
+        return moved, counts
+
+    def close(self):
+        """
+        Stop the shard processes. Shards that died, or that don't exit within
+        CLOSE_TIMEOUT seconds, are terminated
+        """
+        for pipe in self.pipes:
+            try:
+                pipe.send(None)
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+        for process in self.processes:
+            process.join(CLOSE_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join(CLOSE_TIMEOUT)
+        for pipe in self.pipes:
+            pipe.close()
@@ -0,0 +1,148 @@
+"""
+Uniform grid spatial index. Entities are bucketed into square cells of
+CELL_SIZE so that radius and nearest neighbour queries only look at the cells
+around the query point instead of every entity.
+"""
+
+from typing import *
+
+
+CELL_SIZE = 8
+
+
+class SpatialHash:
+
+    def __init__(self, cell_size: int = CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}       # { (cell_row, cell_col): { id } }
+        self.positions = {}   # { id: (row, col) }
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, id):
+        return id in self.positions
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def _cell(self, pos) -> Tuple[int, int]:
+        return int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)
+
+    def insert(self, id, pos):
+        """
+        Add <id> at <pos>, or move it there if it is already indexed
+        """
+        if id in self.positions:
+            self.move(id, pos)
+            return
+        pos = (pos[0], pos[1])
+        self.positions[id] = pos
+        self.cells.setdefault(self._cell(pos), set()).add(id)
+
+    def move(self, id, pos):
+        old = self.positions[id]
+        pos = (pos[0], pos[1])
+        self.positions[id] = pos
+
+        old_cell, new_cell = self._cell(old), self._cell(pos)
+        if old_cell != new_cell:
+            self._discard(old_cell, id)
+            self.cells.setdefault(new_cell, set()).add(id)
+
+    def remove(self, id):
+        self._discard(self._cell(self.positions.pop(id)), id)
+
+    def discard(self, id):
+        if id in self.positions:
+            self.remove(id)
+
+    def _discard(self, cell, id):
+        bucket = self.cells[cell]
+        bucket.discard(id)
+        if not bucket:
+            del self.cells[cell]
+
+    def query(self, origin, radius: float, inclusive=True) -> Iterator[Tuple[Any, float]]:
+        """
+        Generate (id, squared distance) pairs for every entity within <radius>
+        of <origin>. The boundary is included unless <inclusive> is False
+        """
+        oy, ox = origin
+        r2 = radius * radius
+        (min_row, min_col) = self._cell((oy - radius, ox - radius))
+        (max_row, max_col) = self._cell((oy + radius, ox + radius))
+        cells, positions = self.cells, self.positions
+
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                for id in cells.get((row, col), ()):
+                    y, x = positions[id]
+                    d2 = (y - oy) * (y - oy) + (x - ox) * (x - ox)
+                    if d2 < r2 or (inclusive and d2 == r2):
+                        yield id, d2
+
+    def within_radius(self, origin, radius: float, inclusive=True) -> List:
+        """
+        Return the ids within <radius> of <origin> sorted by distance
+        """
+        return [ id for id, _ in sorted(self.query(origin, radius, inclusive), key=lambda x: x[1]) ]
+
+    def count_within(self, origin, radius: float, exclude=None, inclusive=True) -> int:
+        return sum(1 for id, _ in self.query(origin, radius, inclusive) if id != exclude)
+
+    def nearest(self, origin, exclude=None):
+        """
+        Return the id closest to <origin>, or None if the index is empty. Cells
+        are searched in growing rings around <origin> until no unsearched cell
+        can hold anything closer than the best match so far
+        """
+        oy, ox = origin
+        cy, cx = self._cell(origin)
+        best, best_d2 = None, None
+        size = self.cell_size
+        cells, positions = self.cells, self.positions
+
+        ring = 0
+        while cells:
+            if best is not None:
+                # Everything in this ring is at least this far away
+                bound = max(ring - 1, 0) * size
+                if bound * bound >= best_d2:
+                    break
+            if ring and 8 * ring >= len(cells):
+                # Cheaper to check every occupied cell than to keep walking
+                # mostly empty rings
+                candidates = cells.values()
+                ring = -1
+            else:
+                candidates = (cells.get(cell, ()) for cell in _ring_cells(cy, cx, ring))
+
+            for bucket in candidates:
+                for id in bucket:
+                    if id == exclude:
+                        continue
+                    y, x = positions[id]
+                    d2 = (y - oy) * (y - oy) + (x - ox) * (x - ox)
+                    if best is None or d2 < best_d2:
+                        best, best_d2 = id, d2
+            if ring < 0:
+                break
+            ring += 1
+        return best
+
+
+def _ring_cells(row, col, ring) -> Iterator[Tuple[int, int]]:
+    """
+    Generate the cells at exactly <ring> cells (chebyshev distance) from
+    (row, col)
+    """
+    if not ring:
+        yield row, col
+        return
+    for c in range(col - ring, col + ring + 1):
+        yield row - ring, c
+        yield row + ring, c
+    for r in range(row - ring + 1, row + ring):
+        yield r, col - ring
+        yield r, col + ring
@@ -0,0 +1,195 @@
+"""
+Server instrumentation. Systems and ticks record their run time in
+histograms (see tick.py), a background task measures how late the event loop
+wakes up, and a report of those together with the connection traffic and
+entity counts of each room is served as plain text or json over http, and can
+be appended to a rotating json lines file.
+
+    curl localhost:10001/          plain text report
+    curl localhost:10001/json      json report
+"""
+
+from typing import *
+import asyncio
+import bisect
+import json
+import logging
+import logging.handlers
+import time
+
+
+# Upper bounds of the histogram buckets in seconds, from 50us doubling up to
+# about 1.6s. Slower samples go into a last, unbounded bucket
+DURATION_BUCKETS = tuple(0.00005 * 2**i for i in range(16))
+
+# How often the event loop lag is sampled, in seconds
+LOOP_LAG_INTERVAL = 0.1
+
+
+class Histogram:
+    """
+    Counts of samples per bucket, with bucket upper bounds <bounds>
+    """
+
+    def __init__(self, bounds: Sequence[float] = DURATION_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p: float) -> float:
+        """
+        Return an upper bound on the <p>th percentile: the bound of the bucket
+        it falls in, or the largest sample if that is smaller
+        """
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "buckets": [
+                [bound, count] for bound, count in zip(self.bounds + (None,), self.counts) if count
+            ],
+        }
+
+
+class LoopLag:
+    """
+    Measures how much later than asked for the event loop resumes a sleeping
+    task, which is how long other work kept the loop busy
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, clock=time.perf_counter):
+        self.interval = interval
+        self.clock = clock
+        self.histogram = Histogram()
+        self.last = 0.0
+
+    async def run(self):
+        while True:
+            start = self.clock()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, self.clock() - start - self.interval)
+            self.histogram.observe(self.last)
+
+
+def format_text(report: dict) -> str:
+    """
+    Render a <report> as aligned plain text, one section per room. Durations
+    are shown in ms
+    """
+    ms = lambda seconds: f"{seconds * 1000:9.3f}"
+    timings_header = f"{'timings (ms)':<16}{'count':>9}{'mean':>10}{'p50':>10}{'p99':>10}{'max':>10}"
+
+    def timing(name, histogram):
+        return (
+            f"{name:<16}{histogram['count']:>9}{ms(histogram['mean']):>10}"
+            f"{ms(histogram['p50']):>10}{ms(histogram['p99']):>10}{ms(histogram['max']):>10}"
+        )
+
+    lines = [f"rooms {len(report['rooms'])}", timings_header, timing("loop lag", report["loop_lag"])]
+
+    for name, room in report["rooms"].items():
+        lines.append("")
+        ticks = room["ticks"]
+        lines.append(
+            f"room {name}  tick {ticks['tick']}  rate {ticks['rate']} Hz  overruns {ticks['overruns']}  "
+            f"dropped {ticks['dropped']}  drift {ms(ticks['drift']).strip()} ms"
+        )
+        lines.append("entities " + "  ".join(f"{kind} {count}" for kind, count in room["entities"].items()))
+        lines.append("")
+
+        lines.append(timings_header)
+        timings = [("tick", ticks["duration"])] + list(room["systems"].items())
+        for system, histogram in timings:
+            lines.append(timing(system, histogram))
+        lines.append("")
+
+        lines.append(f"{'connection':<12}{'protocol':>9}{'rate':>6}{'frames':>9}{'dropped':>9}{'bytes':>12}{'latency':>10}{'stale':>9}")
+        for conn in room["connections"]:
+            latency = "-" if conn["latency"] is None else ms(conn["latency"])
+            lines.append(
+                f"{conn['player']:<12}{conn['protocol']:>9}{conn['rate']:>6}{conn['frames_sent']:>9}"
+                f"{conn['frames_dropped']:>9}{conn['bytes_sent']:>12}{latency:>10}{conn['stale_frames']:>9}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+async def serve(host: str, port: int, report: Callable[[], dict]) -> asyncio.AbstractServer:
+    """
+    Serve <report>() over http on <host>:<port>. /json returns json, any
+    other path plain text
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            # Skip the headers
+            while (await reader.readline()).strip():
+                pass
+            parts = request.decode("latin-1").split()
+            path = parts[1] if len(parts) > 1 else "/"
+
+            if path.rstrip("/").endswith("json"):
+                body, content_type = json.dumps(report()), "application/json"
+            else:
+                body, content_type = format_text(report()), "text/plain; charset=utf-8"
+            body = body.encode()
+            writer.write(
+                f"HTTP/1.0 200 OK\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+def rotating_log(path: str, max_bytes: int, backups: int) -> logging.Logger:
+    """
+    Return a logger that writes each record as one line of <path>, rolling
+    over to <path>.1 ... <path>.<backups> once it grows past <max_bytes>
+    """
+    logger = logging.getLogger(f"{__name__}.{path}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    return logger
+
+
+async def dump(logger: logging.Logger, interval: float, report: Callable[[], dict]):
+    """
+    Write <report>() as a json line to <logger> every <interval> seconds
+    """
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(json.dumps(dict(report(), time=time.time())))
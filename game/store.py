@@ -0,0 +1,143 @@
+"""
+Server side entity store. Every ghost, player and item is a slotted Record
+instead of a dict with string keys, and the store keeps an id index per
+entity type so systems walk only the entities they act on.
+
+Records are turned into the json wire format with to_dict() and into binary
+frame columns with EntityStore.columns(), see protocol.py.
+"""
+
+from typing import *
+from . import protocol
+
+
+# Entity types
+GHOST = "ghost"
+PLAYER = "player"
+ITEM = "item"
+
+TYPES = (GHOST, PLAYER, ITEM)
+
+
+class Record:
+
+    __slots__ = ("id", "type", "row", "col", "reprchar", "petrified", "items")
+
+    def __init__(self, id: int, type: str, pos, reprchar: str):
+        self.id = id
+        self.type = type
+        self.row, self.col = pos
+        self.reprchar = reprchar
+        self.petrified = False
+        # Items a player carries
+        self.items = [] if type == PLAYER else ()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} : {self.id}>({self.type}, {self.pos}, '{self.reprchar}')"
+
+    @property
+    def pos(self) -> Tuple[int, int]:
+        return self.row, self.col
+
+    @pos.setter
+    def pos(self, pos):
+        self.row, self.col = pos
+
+    @property
+    def flags(self) -> int:
+        """
+        Entity flags of the binary protocol
+        """
+        flags = protocol.PETRIFIED if self.petrified else 0
+        if self.type == PLAYER:
+            flags |= protocol.PLAYER
+        elif self.type == ITEM:
+            flags |= protocol.ITEM
+        return flags
+
+    def frozen(self) -> tuple:
+        """
+        Immutable copy of everything that is sent to clients, to compare the
+        record across ticks. See delta.Snapshot
+        """
+        return self.row, self.col, self.reprchar, self.petrified, tuple(item.id for item in self.items)
+
+    def to_dict(self) -> dict:
+        """
+        The record in the json wire format
+        """
+        state = { "pos": [self.row, self.col], "reprchar": self.reprchar, "id": self.id }
+        if self.type == PLAYER:
+            state["petrified"] = self.petrified
+            state["items"] = [ item.to_dict() for item in self.items ]
+        elif self.type == ITEM:
+            state["type"] = ITEM
+        return state
+
+
+class EntityStore:
+    """
+    The entity table, { id: Record }, with the ids of each type in <ids>
+    """
+
+    def __init__(self):
+        self.records = {}  # type: Dict[int, Record]
+        self.ids = { type: set() for type in TYPES }  # type: Dict[str, Set[int]]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, id):
+        return id in self.records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, id) -> Record:
+        return self.records[id]
+
+    def get(self, id) -> Optional[Record]:
+        return self.records.get(id)
+
+    def values(self):
+        return self.records.values()
+
+    def items(self):
+        return self.records.items()
+
+    def add(self, id: int, type: str, pos, reprchar: str) -> Record:
+        record = self.records[id] = Record(id, type, pos, reprchar)
+        self.ids[type].add(id)
+        return record
+
+    def remove(self, id) -> Record:
+        record = self.records.pop(id)
+        self.ids[record.type].discard(id)
+        return record
+
+    def positions(self) -> Dict[int, Tuple[int, int]]:
+        return { id: (record.row, record.col) for id, record in self.records.items() }
+
+    def columns(self, ids: Iterable[int]) -> Tuple[list, list, list, list, list]:
+        """
+        Return the ids, rows, cols, glyphs and flags of the records with
+        <ids>, ready for protocol.encode_columns
+        """
+        records = self.records
+        selected = [ records[id] for id in ids ]
+        return (
+            [ record.id for record in selected ],
+            [ record.row for record in selected ],
+            [ record.col for record in selected ],
+            [ ord(record.reprchar) for record in selected ],
+            [ record.flags for record in selected ],
+        )
+
+    def to_dict(self, ids: Iterable[int] = None) -> Dict[int, dict]:
+        """
+        The records with <ids>, or all of them, in the json wire format
+        """
+        records = self.records
+        if ids is None:
+            ids = records
+        return { id: records[id].to_dict() for id in ids }
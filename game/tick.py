@@ -0,0 +1,126 @@
+"""
+Fixed timestep scheduler. Instead of one never ending task per entity, the
+server registers "systems" that are run in a fixed order on every tick. Each
+system has a divisor so it only runs on every n-th tick, e.g. a divisor of 6
+at 60 ticks per second runs the system at 10 Hz.
+"""
+
+from typing import *
+import asyncio
+import time
+
+from . import stats
+
+
+TICK_RATE = 60
+
+# If the scheduler falls further behind than this many ticks, the extra ticks
+# are dropped instead of being simulated back to back
+MAX_CATCHUP_TICKS = 5
+
+
+class System:
+
+    def __init__(self, name: str, fn: Callable[[int], Any], divisor: int, catch_up: bool):
+        self.name = name
+        self.fn = fn
+        self.divisor = divisor
+        self.catch_up = catch_up
+
+        # Wall time spent in the last and in all runs, in seconds
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+        self.runs = 0
+        self.durations = stats.Histogram()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} : {self.name}>(1/{self.divisor})"
+
+
+class Scheduler:
+
+    def __init__(self, rate: int = TICK_RATE, max_catchup: int = MAX_CATCHUP_TICKS, clock=time.perf_counter):
+        self.rate = rate
+        self.period = 1 / rate
+        self.max_catchup = max_catchup
+        self.clock = clock
+        self.systems = []  # type: List[System]
+
+        self.tick = 0
+
+        # How late the last tick started compared to its deadline, in seconds
+        self.drift = 0.0
+
+        # Ticks that were skipped because the scheduler fell too far behind
+        self.dropped_ticks = 0
+
+        # Wall time of the last tick, in seconds, and of every tick
+        self.last_duration = 0.0
+        self.durations = stats.Histogram()
+
+        # Ticks that took longer than a tick period to run
+        self.overruns = 0
+
+    def add_system(self, name: str, fn: Callable[[int], Any], divisor: int = 1, catch_up=True) -> System:
+        """
+        Register <fn> to be called with the tick number on every <divisor>-th
+        tick. Systems run in the order they are added. Systems that are not
+        <catch_up> (e.g. a network broadcast) only run on the last of several
+        ticks that are simulated back to back. <fn> may be a coroutine function
+        """
+        system = System(name, fn, divisor, catch_up)
+        self.systems.append(system)
+        return system
+
+    async def step(self, catching_up=False):
+        """
+        Run a single tick
+        """
+        self.tick += 1
+        start = self.clock()
+        for system in self.systems:
+            if self.tick % system.divisor:
+                continue
+            if catching_up and not system.catch_up:
+                continue
+
+            system_start = self.clock()
+            result = system.fn(self.tick)
+            if asyncio.iscoroutine(result):
+                await result
+            system.last_duration = self.clock() - system_start
+            system.total_duration += system.last_duration
+            system.runs += 1
+            system.durations.observe(system.last_duration)
+        self.last_duration = self.clock() - start
+        self.durations.observe(self.last_duration)
+        if self.last_duration > self.period:
+            self.overruns += 1
+
+    async def run(self, offset: float = 0.0):
+        """
+        Run ticks forever at <rate> ticks per second, the first one <offset>
+        seconds from now. Ticks are scheduled against absolute deadlines so
+        that sleep inaccuracy does not add up. When a tick runs late, the
+        missed ticks are run immediately, yielding to the other tasks on the
+        loop between them
+        """
+        deadline = self.clock() + offset
+        while True:
+            now = self.clock()
+            self.drift = now - deadline
+
+            behind = int(self.drift / self.period)
+            if behind > self.max_catchup:
+                skipped = behind - self.max_catchup
+                self.dropped_ticks += skipped
+                deadline += skipped * self.period
+
+            while deadline <= now:
+                deadline += self.period
+                catching_up = deadline <= now
+                await self.step(catching_up)
+                if catching_up:
+                    await asyncio.sleep(0)
+
+            await asyncio.sleep(max(0.0, deadline - self.clock()))
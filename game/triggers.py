@@ -0,0 +1,67 @@
+"""
+Cell keyed triggers. Items, and anything else that reacts to an entity
+stepping on it, register a callback at their map cell. When an entity moves
+the only lookup is the cell it moved into, so nothing is polled and an idle
+server does no work for its triggers.
+"""
+
+from typing import *
+
+
+# Called with the trigger's id and the id of the entity that entered its cell
+Callback = Callable[[Any, Any], None]
+
+
+class TriggerIndex:
+
+    def __init__(self):
+        self.cells = {}       # { (row, col): { id: callback } }
+        self.positions = {}   # { id: (row, col) }
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, id):
+        return id in self.positions
+
+    def add(self, id, pos, callback: Callback):
+        """
+        Call <callback> whenever an entity enters the cell at <pos>. Triggers
+        in the same cell fire in the order they were added
+        """
+        if id in self.positions:
+            self.remove(id)
+        pos = (pos[0], pos[1])
+        self.positions[id] = pos
+        self.cells.setdefault(pos, {})[id] = callback
+
+    def move(self, id, pos):
+        self.add(id, pos, self.cells[self.positions[id]][id])
+
+    def remove(self, id):
+        pos = self.positions.pop(id)
+        cell = self.cells[pos]
+        del cell[id]
+        if not cell:
+            del self.cells[pos]
+
+    def discard(self, id):
+        if id in self.positions:
+            self.remove(id)
+
+    def fire(self, entity_id, pos) -> int:
+        """
+        Fire the triggers in the cell at <pos> for <entity_id>, which just
+        moved there. Callbacks may add or remove triggers. Return the number
+        of triggers fired
+        """
+        cell = self.cells.get((pos[0], pos[1]))
+        if not cell:
+            return 0
+        fired = 0
+        for id, callback in list(cell.items()):
+            # An earlier callback may have removed this trigger
+            if id in cell:
+                callback(id, entity_id)
+                fired += 1
+        return fired
@@ -0,0 +1,109 @@
+import unittest
+import sys, os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import connection
+
+class FakeSocket:
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+class Test_Connection(unittest.TestCase):
+
+    def setUp(self):
+        self.ws = FakeSocket()
+        self.conn = connection.Connection(self.ws, 1)
+
+    def drain(self):
+        async def run():
+            writer = asyncio.ensure_future(self.conn.writer())
+            await asyncio.sleep(0)
+            writer.cancel()
+        asyncio.run(run())
+
+    def test_send_in_order(self):
+        self.conn.push("k", 0, keyframe=True)
+        self.conn.push("d1", 1)
+        self.conn.push("d2", 2)
+        self.drain()
+        self.assertEqual(self.ws.sent, ["k", "d1", "d2"])
+        self.assertEqual(self.conn.bytes_sent, 5)
+
+    def test_keyframe_replaces_queue(self):
+        self.conn.push("d1", 1)
+        self.conn.push("d2", 2)
+        self.conn.push("k", 0, keyframe=True)
+        self.drain()
+        self.assertEqual(self.ws.sent, ["k"])
+        self.assertFalse(self.conn.needs_keyframe)
+
+    def test_full_outbox(self):
+        self.conn.push("k", 0, keyframe=True)
+        for i in range(connection.OUTBOX_SIZE - 1):
+            self.assertTrue(self.conn.push(f"d{i}", i + 1))
+        self.assertFalse(self.conn.push("late", connection.OUTBOX_SIZE))
+        self.assertTrue(self.conn.needs_keyframe)
+        self.assertEqual(len(self.conn.outbox), 0)
+        self.assertEqual(self.conn.frames_dropped, connection.OUTBOX_SIZE + 1)
+
+    def test_input_answer_replaces_unsent(self):
+        self.conn.push("k", 0, keyframe=True)
+        self.conn.confirm_input(3, (1, 1))
+        self.conn.confirm_input(4, (1, 2))
+        self.drain()
+        self.assertEqual(self.ws.sent, ['{"input": 4, "pos": [1, 2]}', "k"])
+        self.assertEqual(self.conn.frames_sent, 1)
+
+    def test_rate_steps_down_and_up(self):
+        self.assertEqual(self.conn.rate, connection.RATES[0])
+        self.conn.push("k", 0, keyframe=True)
+        self.conn.push("d1", 1)
+        self.conn.needs_keyframe = False
+
+        now = self.conn._last_rate_change + connection.STEP_DOWN_AFTER
+        self.conn.adapt(now)
+        self.assertEqual(self.conn.rate, connection.RATES[1])
+        self.assertTrue(self.conn.needs_keyframe)
+
+        # Not again before STEP_DOWN_AFTER
+        self.conn.adapt(now + 0.01)
+        self.assertEqual(self.conn.rate, connection.RATES[1])
+
+        self.conn.outbox.clear()
+        queued = self.conn._unacked[-1][1]
+        self.conn.acknowledge(1, queued + 0.02)
+        self.assertAlmostEqual(self.conn.latency, 0.02)
+        self.assertEqual(len(self.conn._unacked), 0)
+        self.conn.adapt(now + 1)
+        self.assertEqual(self.conn.rate, connection.RATES[1])
+        self.conn.adapt(now + 1 + connection.STEP_UP_AFTER)
+        self.assertEqual(self.conn.rate, connection.RATES[0])
+
+    def test_high_latency(self):
+        self.conn.push("k", 0, keyframe=True)
+        self.conn.outbox.clear()
+        queued = self.conn._unacked[0][1]
+        self.conn.acknowledge(0, queued + 2 * connection.HIGH_LATENCY)
+        self.conn.adapt(queued + connection.STEP_DOWN_AFTER)
+        self.assertEqual(self.conn.rate, connection.RATES[1])
+
+    def test_requested_rate(self):
+        self.conn.request_rate(25)
+        self.assertEqual(self.conn.rate, 20)
+        self.assertEqual(self.conn.divisor, 3)
+        self.assertTrue(self.conn.due(6))
+        self.assertFalse(self.conn.due(7))
+
+        # Never stepped back up past the requested rate
+        self.conn.adapt(self.conn._last_rate_change + 100)
+        self.assertEqual(self.conn.rate, 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
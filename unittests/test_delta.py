@@ -0,0 +1,61 @@
+import unittest
+import sys, os
+import json
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import delta
+
+class Test_Delta(unittest.TestCase):
+
+    def setUp(self):
+        self.entities = {
+            0: { "pos": [4, 4], "reprchar": "3", "id": 0 },
+            1: { "pos": [2, 2], "reprchar": "@", "id": 1, "petrified": False, "items": [] },
+        }
+
+    def roundtrip(self, message):
+        return json.loads(json.dumps(message))
+
+    def test_no_change(self):
+        old = delta.Snapshot(0, self.entities)
+        new = delta.Snapshot(1, self.entities)
+        self.assertEqual(new.diff(old), ([], []))
+
+    def test_in_place_change(self):
+        old = delta.Snapshot(0, self.entities)
+        self.entities[1]["pos"][0] = 3
+        new = delta.Snapshot(1, self.entities)
+        self.assertEqual(new.diff(old), ([1], []))
+
+    def test_nested_change(self):
+        old = delta.Snapshot(0, self.entities)
+        self.entities[1]["items"].append(self.entities.pop(0))
+        new = delta.Snapshot(1, self.entities)
+        self.assertEqual(new.diff(old), ([1], [0]))
+
+    def test_added(self):
+        old = delta.Snapshot(0, {})
+        new = delta.Snapshot(1, self.entities)
+        self.assertEqual(sorted(new.diff(old)[0]), [0, 1])
+
+    def test_apply_delta(self):
+        local = {}
+        delta.apply_message(local, self.roundtrip(delta.keyframe(0, self.entities)))
+        self.assertEqual(set(local), {"0", "1"})
+
+        old = delta.Snapshot(0, self.entities)
+        self.entities[1]["pos"][:] = [5, 5]
+        del self.entities[0]
+        changed, removed = delta.Snapshot(1, self.entities).diff(old)
+
+        delta.apply_message(local, self.roundtrip(delta.delta(1, self.entities, changed, removed)))
+        self.assertEqual(local, self.roundtrip(self.entities))
+
+    def test_apply_full_table(self):
+        local = { "7": {} }
+        delta.apply_message(local, self.roundtrip(self.entities))
+        self.assertEqual(local, self.roundtrip(self.entities))
+
+
+if __name__ == "__main__":
+    unittest.main()
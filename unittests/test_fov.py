@@ -0,0 +1,173 @@
+import unittest
+import sys, os
+import random
+import tempfile
+import io
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import fov
+from game import render
+
+WALL = "█"
+
+def lit(visible):
+    return { (r, c) for r, row in enumerate(visible) for c, v in enumerate(row) if v }
+
+def field(nrows, ncols, walls=()):
+    chunk = [ [" "] * ncols for _ in range(nrows) ]
+    for r, c in walls:
+        chunk[r][c] = WALL
+    return chunk
+
+class Test_Shadowcast(unittest.TestCase):
+
+    def test_open_field_is_a_full_disc(self):
+        # No gaps anywhere inside the radius, nothing outside it
+        radius = 8
+        visible = lit(fov.shadowcast(field(21, 21), (10, 10), radius, {WALL}))
+        disc = {
+            (r, c) for r in range(21) for c in range(21)
+            if (r - 10) ** 2 + (c - 10) ** 2 <= radius * radius + radius
+        }
+        self.assertEqual(visible, disc)
+        self.assertIn((10, 18), visible)
+        self.assertNotIn((17, 17), visible)
+
+    def test_walls_cast_shadows(self):
+        chunk = field(9, 9, walls=[ (r, 6) for r in range(9) ])
+        visible = lit(fov.shadowcast(chunk, (4, 2), 10, {WALL}))
+        # The wall itself is seen, nothing behind it is
+        self.assertTrue({ (r, 6) for r in range(1, 8) } <= visible)
+        self.assertFalse({ (r, c) for r in range(9) for c in (7, 8) } & visible)
+
+        # A pillar hides the cells right behind it
+        chunk = field(9, 9, walls=[(4, 4)])
+        visible = lit(fov.shadowcast(chunk, (4, 1), 10, {WALL}))
+        self.assertIn((4, 4), visible)
+        self.assertNotIn((4, 5), visible)
+        self.assertIn((3, 5), visible)
+
+    def test_symmetric(self):
+        rng = random.Random(5)
+        walls = [ (rng.randrange(15), rng.randrange(15)) for _ in range(40) ]
+        chunk = field(15, 15, walls)
+        floors = [ (r, c) for r in range(15) for c in range(15) if chunk[r][c] != WALL ]
+        seen = { pos: lit(fov.shadowcast(chunk, pos, 20, {WALL})) for pos in floors }
+        for a in floors:
+            for b in seen[a]:
+                if b in seen:
+                    self.assertIn(a, seen[b], (a, b))
+
+    def test_viewer_outside_chunk(self):
+        self.assertEqual(lit(fov.shadowcast(field(3, 3), (5, 5), 4, {WALL})), set())
+
+
+class Test_Occlusion(unittest.TestCase):
+
+    def test_apply_occlusion_layer(self):
+        chunk = field(5, 12, walls=[ (r, 5) for r in range(5) ])
+        chunk[2][9] = "@"
+        render.apply_occlusion_layer(chunk, (2, 1), radius=4)
+        self.assertEqual("".join(chunk[2]), "     █......")
+        self.assertEqual(chunk[0][0], " ")
+
+    def test_bench(self):
+        rows = [ "".join(row) for row in field(30, 40, walls=[ (r, 20) for r in range(5, 25) ]) ]
+        results = fov.bench(rows, 8, (17, 17), 5, {WALL})
+        self.assertEqual(set(results), {"rays", "shadowcast", "cached"})
+        self.assertEqual(results["cached"]["visible_per_frame"], results["shadowcast"]["visible_per_frame"])
+        for result in results.values():
+            self.assertGreater(result["visible_per_frame"], 0)
+
+
+def terrain(nrows, ncols, seed, walls=60):
+    rng = random.Random(seed)
+    chunk = field(nrows, ncols, [ (rng.randrange(nrows), rng.randrange(ncols)) for _ in range(walls) ])
+    return [ "".join(row) for row in chunk ]
+
+class Test_VisibilityCache(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = terrain(20, 30, seed=2)
+        self.cache = fov.VisibilityCache(self.rows, {WALL})
+
+    def test_window_matches_shadowcast(self):
+        rng = random.Random(4)
+        for _ in range(50):
+            top, left = rng.randrange(10), rng.randrange(15)
+            nrows, ncols = rng.randrange(3, 21 - top), rng.randrange(3, 31 - left)
+            row, col = top + rng.randrange(nrows), left + rng.randrange(ncols)
+            chunk = [ list(line[left:left + ncols]) for line in self.rows[top:top + nrows] ]
+            expected = fov.shadowcast(chunk, (row - top, col - left), 6, {WALL})
+            self.assertEqual(self.cache.window(top, left, nrows, ncols, (row, col), 6), expected)
+
+    def test_hits_and_lru(self):
+        mask = self.cache.lookup(5, 5, 4)
+        self.assertIs(self.cache.lookup(5, 5, 4), mask)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        # Room for two masks of radius 4, 9 rows of 2 bytes each
+        self.cache.max_bytes = 2 * 9 * 2
+        self.cache.lookup(6, 6, 4)
+        self.cache.lookup(5, 5, 4)
+        self.cache.lookup(7, 7, 4)
+        self.assertEqual(set(self.cache.masks), {(5, 5, 4), (7, 7, 4)})
+        self.assertEqual(self.cache.nbytes, 36)
+
+    def test_idle_viewer_reuses_window(self):
+        first = self.cache.window(0, 0, 10, 10, (4, 4), 5)
+        self.assertIs(self.cache.window(0, 0, 10, 10, (4, 4), 5), first)
+        self.assertIsNot(self.cache.window(0, 0, 10, 10, (4, 5), 5), first)
+
+    def test_update_invalidates_near_walls(self):
+        rows = [ "".join(row) for row in field(20, 30) ]
+        cache = fov.VisibilityCache(rows, {WALL})
+        self.assertEqual(cache.window(0, 0, 20, 30, (10, 5), 6)[10][8], 1)
+        cache.lookup(10, 25, 3)
+
+        # Glyphs that don't block the view keep every mask
+        cache.update([ rows[0].replace(" ", "-", 1) ] + rows[1:])
+        self.assertEqual(len(cache), 2)
+
+        walled = list(rows)
+        walled[10] = walled[10][:7] + WALL + walled[10][8:]
+        cache.update(walled)
+        self.assertEqual(set(cache.masks), {(10, 25, 3)})
+        self.assertEqual(cache.window(0, 0, 20, 30, (10, 5), 6)[10][8], 0)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "map.fov")
+            self.cache.save(path, 5)
+
+            loaded = fov.VisibilityCache(self.rows, {WALL})
+            loaded.load(path)
+            for row in range(20):
+                for col in range(30):
+                    if self.rows[row][col] != WALL:
+                        self.assertEqual(loaded.lookup(row, col, 5), self.cache.compute(row, col, 5))
+            self.assertEqual(loaded.misses, 0)
+
+            with self.assertRaises(ValueError):
+                fov.VisibilityCache(terrain(20, 30, seed=3), {WALL}).load(path)
+
+            with open(path, "rb") as fp:
+                data = fp.read()
+            with open(path, "wb") as fp:
+                fp.write(data[:len(fov.MAGIC) + 4])
+            with self.assertRaises(ValueError):
+                loaded.load(path)
+
+    def test_apply_occlusion_layer_with_cache(self):
+        # Map strips the rows, so they are framed by walls
+        framed = [ WALL + line[1:-1] + WALL for line in self.rows ]
+        mapdata = render.Map(io.StringIO("\n".join(framed)))
+        expected = mapdata.window(2, 3, 12, 20)
+        cached = mapdata.window(2, 3, 12, 20)
+        render.apply_occlusion_layer(expected, (5, 6), radius=7)
+        render.apply_occlusion_layer(cached, (5, 6), radius=7, cache=mapdata.visibility, origin=(2, 3))
+        self.assertEqual(cached, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
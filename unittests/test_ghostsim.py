@@ -0,0 +1,113 @@
+import unittest
+import sys, os
+import random
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import ghostsim
+from game.pathfinding import FlowField
+
+@unittest.skipUnless(ghostsim.available, "numpy is not installed")
+class Test_GhostArrays(unittest.TestCase):
+
+    ROWS, COLS = 160, 300
+
+    def setUp(self):
+        self.random = random.Random(5)
+        self.sim = ghostsim.GhostArrays(self.ROWS, self.COLS, seed=5)
+        self.ghosts = {}
+        for id in range(200):
+            self.ghosts[id] = [self.random.randint(1, self.ROWS - 1), self.random.randint(1, self.COLS - 1)]
+            self.sim.add(id, self.ghosts[id])
+        self.players = [[10, 10], [15, 14], [100, 250], [1, 299]]
+
+    def reference_step(self, pos, repel_radius):
+        # Same rules as the per-ghost server system
+        d2 = lambda a, b: (a[0] - b[0])**2 + (a[1] - b[1])**2
+        y, x = pos
+        closest = min(self.players, key=lambda p: d2(pos, p))
+        dy = (closest[0] > y) - (closest[0] < y)
+        dx = (closest[1] > x) - (closest[1] < x)
+        if sum(1 for p in self.players if p is not closest and d2(p, closest) < repel_radius**2):
+            dy, dx = -dy, -dx
+        if not 0 < y + dy < self.ROWS:
+            dy = 0
+        if not 0 < x + dx < self.COLS:
+            dx = 0
+        return [y + dy, x + dx]
+
+    def current(self):
+        return dict(self.sim.positions(range(len(self.sim))))
+
+    def test_step_ai(self):
+        expected = { id: self.reference_step(pos, 10) for id, pos in self.ghosts.items() }
+        moved = self.sim.step_ai(ghostsim.np.array(self.players), 10)
+        self.assertEqual(self.current(), expected)
+        self.assertEqual(
+            { id for id, _ in self.sim.positions(moved) },
+            { id for id in expected if expected[id] != self.ghosts[id] }
+        )
+
+    def test_step_jitter(self):
+        self.sim.step_jitter()
+        for id, (y, x) in self.current().items():
+            self.assertLessEqual(abs(y - self.ghosts[id][0]), 1)
+            self.assertLessEqual(abs(x - self.ghosts[id][1]), 1)
+            self.assertTrue(0 < y < self.ROWS and 0 < x < self.COLS)
+
+    def test_petrification_counts(self):
+        counts = self.sim.petrification_counts(ghostsim.np.array(self.players), 20)
+        for player, count in zip(self.players, counts.tolist()):
+            expected = sum(
+                1 for y, x in self.ghosts.values()
+                if (y - player[0])**2 + (x - player[1])**2 < 400
+            )
+            self.assertEqual(count, expected)
+
+    def test_step_flow(self):
+        rows = [ "".join(self.random.choice("  W") for _ in range(self.COLS)) for _ in range(self.ROWS) ]
+        field = FlowField(rows, {" "}, self.ROWS, self.COLS)
+        field.update({ 1: (10, 10), 2: (15, 14), 3: (100, 250) })
+        grouped = [ id in (1, 2) for id in field.source_ids ]
+
+        expected = {}
+        for id, pos in self.ghosts.items():
+            source = field.source_of(pos)
+            step = (0, 0) if source is None else field.next_step(pos, grouped[source])
+            expected[id] = [pos[0] + step[0], pos[1] + step[1]]
+
+        self.sim.step_flow(field, ghostsim.np.array(grouped))
+        self.assertEqual(self.current(), expected)
+
+    def test_active(self):
+        active = ghostsim.np.zeros(len(self.sim), dtype=bool)
+        active[::2] = True
+        moved = self.sim.step_ai(ghostsim.np.array(self.players), 10, active)
+        self.assertTrue(active[moved].all())
+        current = self.current()
+        for row, id in enumerate(self.sim.ids.tolist()):
+            if not active[row]:
+                self.assertEqual(current[id], self.ghosts[id])
+
+    def test_distances(self):
+        distances = self.sim.distances(ghostsim.np.array(self.players))
+        for id, d in zip(self.sim.ids.tolist(), distances.tolist()):
+            expected = min(
+                ((self.ghosts[id][0] - y)**2 + (self.ghosts[id][1] - x)**2) ** 0.5 for y, x in self.players
+            )
+            self.assertAlmostEqual(d, expected)
+
+        field = FlowField([" " * self.COLS] * self.ROWS, {" "}, self.ROWS, self.COLS)
+        field.update({ 1: (10, 10) })
+        distances = self.sim.distances(ghostsim.np.array(self.players), field)
+        for id, d in zip(self.sim.ids.tolist(), distances.tolist()):
+            self.assertEqual(d, field.distance(self.ghosts[id]))
+
+    def test_remove(self):
+        for id in range(0, 200, 7):
+            self.sim.remove(id)
+            del self.ghosts[id]
+        self.assertEqual(self.current(), self.ghosts)
+
+
+if __name__ == "__main__":
+    unittest.main()
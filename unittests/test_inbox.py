@@ -0,0 +1,50 @@
+import unittest
+import sys, os
+import json
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import inbox, delta, protocol
+
+def state(id, pos, char="@", petrified=False):
+    return { "id": id, "pos": pos, "reprchar": char, "petrified": petrified }
+
+class Test_Inbox(unittest.TestCase):
+
+    def setUp(self):
+        self.inbox = inbox.Inbox(7)
+
+    def test_coalesce_json(self):
+        entities = { "7": state(7, [1, 1]), "8": state(8, [2, 2], "#") }
+        self.assertEqual(self.inbox.receive(json.dumps(delta.keyframe(1, entities))), 1)
+        for tick in range(2, 5):
+            moved = { "8": state(8, [2, tick], "#") }
+            self.inbox.receive(json.dumps(delta.delta(tick, moved, moved, [])))
+
+        # Every delta is applied, but only the newest state is drawn
+        self.assertTrue(self.inbox.take())
+        self.assertEqual(list(self.inbox.map_entities()), [("8", 2, 4, "#")])
+        self.assertEqual((self.inbox.received, self.inbox.stale), (4, 3))
+        self.assertFalse(self.inbox.take())
+        self.assertEqual(self.inbox.stale, 3)
+
+    def test_binary(self):
+        frame = protocol.encode_keyframe(5, [ state(7, [1, 1], petrified=True), state(8, [3, 4], "#") ])
+        self.assertEqual(self.inbox.receive(frame), 5)
+        self.assertTrue(self.inbox.take())
+        self.assertEqual(list(self.inbox.map_entities()), [(8, 3, 4, "#")])
+        self.assertTrue(self.inbox.petrified())
+        self.assertEqual(self.inbox.stale, 0)
+
+    def test_petrified_unknown(self):
+        self.assertIsNone(self.inbox.petrified())
+
+    def test_newest_input_answer(self):
+        self.assertIsNone(self.inbox.receive(json.dumps({ "input": 1, "pos": [1, 2] })))
+        self.inbox.receive(json.dumps({ "input": 2, "pos": [1, 3] }))
+        self.assertFalse(self.inbox.take())
+        self.assertEqual(self.inbox.take_input_answer(), (2, [1, 3]))
+        self.assertIsNone(self.inbox.take_input_answer())
+
+
+if __name__ == "__main__":
+    unittest.main()
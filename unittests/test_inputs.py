@@ -0,0 +1,97 @@
+import unittest
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import inputs
+
+MAP = [
+    "WWWWWW",
+    "W    W",
+    "W  W W",
+    "WWWWWW",
+]
+
+passable = inputs.terrain(MAP, {" "})
+
+class Test_Step(unittest.TestCase):
+
+    def test_step(self):
+        self.assertEqual(inputs.step((1, 1), "d", passable), (1, 2))
+        self.assertEqual(inputs.step([1, 1], "s", passable), (2, 1))
+        self.assertEqual(inputs.step((1, 1), "w", passable), (1, 1))
+        self.assertEqual(inputs.step((2, 2), "d", passable), (2, 2))
+
+    def test_terrain_bounds(self):
+        self.assertFalse(passable((-1, 1)))
+        self.assertFalse(passable((1, 6)))
+        self.assertFalse(passable((4, 1)))
+        self.assertTrue(passable((2, 4)))
+
+
+class Test_InputQueue(unittest.TestCase):
+
+    def test_in_order(self):
+        queue = inputs.InputQueue()
+        self.assertTrue(queue.push(1, "d"))
+        self.assertTrue(queue.push(2, "s"))
+        self.assertFalse(queue.push(2, "a"))
+        self.assertFalse(queue.push(1, "a"))
+        self.assertTrue(queue.pending)
+
+        self.assertEqual(queue.take(1), ["d"])
+        self.assertEqual(queue.processed, 1)
+        self.assertEqual(queue.take(1), ["s"])
+        self.assertEqual(queue.processed, 2)
+        self.assertFalse(queue.pending)
+        self.assertEqual(queue.take(1), [])
+
+    def test_dropped(self):
+        queue = inputs.InputQueue(size=2)
+        self.assertTrue(queue.push(1, "d"))
+        self.assertFalse(queue.push(2, "x"))
+        self.assertTrue(queue.push(3, "d"))
+        self.assertFalse(queue.push(4, "d"))
+        self.assertFalse(queue.push("5", "d"))
+        self.assertEqual(queue.dropped, 2)
+
+        # Dropped commands are processed once everything before them is
+        self.assertEqual(queue.take(1), ["d"])
+        self.assertEqual(queue.processed, 1)
+        self.assertEqual(queue.take(1), ["d"])
+        self.assertEqual(queue.processed, 4)
+        self.assertFalse(queue.pending)
+
+
+class Test_Predictor(unittest.TestCase):
+
+    def setUp(self):
+        self.predictor = inputs.Predictor([1, 1], passable)
+
+    def test_press(self):
+        self.assertEqual(self.predictor.press("d"), [1, "d"])
+        self.assertEqual(self.predictor.press("w"), None)
+        self.assertEqual(self.predictor.press("q"), None)
+        self.assertEqual(self.predictor.press("s"), [2, "s"])
+        self.assertEqual(self.predictor.position, (2, 2))
+        self.assertEqual(len(self.predictor.pending), 2)
+
+    def test_reconcile_agrees(self):
+        for key in "ddd":
+            self.predictor.press(key)
+        self.assertFalse(self.predictor.reconcile(1, (1, 2)))
+        self.assertEqual(self.predictor.position, (1, 4))
+        self.assertEqual([ seq for seq, _ in self.predictor.pending ], [2, 3])
+        self.assertFalse(self.predictor.reconcile(3, (1, 4)))
+        self.assertEqual(len(self.predictor.pending), 0)
+
+    def test_reconcile_refused(self):
+        # The server refused the first move, the second is still in flight
+        self.predictor.press("d")
+        self.predictor.press("s")
+        self.assertTrue(self.predictor.reconcile(1, (1, 1)))
+        self.assertEqual(self.predictor.position, (2, 1))
+        self.assertEqual(self.predictor.corrections, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
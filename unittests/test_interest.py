@@ -0,0 +1,36 @@
+import unittest
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import interest
+from game.render import VIEW_RADIUS
+
+class Test_Interest(unittest.TestCase):
+
+    def setUp(self):
+        self.positions = {
+            0: [50, 50],
+            1: [52, 48],
+            2: [50, 150],
+        }
+        self.area = interest.Interest(0, 20, 40)
+
+    def test_window(self):
+        self.assertTrue(self.area.contains((0, 0), (20 + interest.INTEREST_MARGIN, 0)))
+        self.assertFalse(self.area.contains((0, 0), (21 + interest.INTEREST_MARGIN, 0)))
+        self.assertTrue(self.area.contains((0, 0), (0, -VIEW_RADIUS - interest.INTEREST_MARGIN)))
+        self.assertFalse(self.area.contains((0, 0), (0, -VIEW_RADIUS - interest.INTEREST_MARGIN - 1)))
+
+    def test_enter_leave(self):
+        self.assertEqual(self.area.update(self.positions), ({0, 1}, set()))
+        self.assertEqual(self.area.update(self.positions), (set(), set()))
+
+        self.positions[0][1] = 140
+        self.assertEqual(self.area.update(self.positions), ({2}, {1}))
+
+        del self.positions[2]
+        self.assertEqual(self.area.update(self.positions), (set(), {2}))
+
+
+if __name__ == "__main__":
+    unittest.main()
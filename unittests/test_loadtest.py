@@ -0,0 +1,131 @@
+import unittest
+import sys, os
+import json
+import random
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import loadtest, delta, inputs, protocol
+from game.tick import TICK_RATE
+
+MAP = [
+    "WWWWWWWWWW",
+    "W        W",
+    "W  WW    W",
+    "W        W",
+    "WWWWWWWWWW",
+]
+
+class Test_Percentile(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile(values, 100), 100)
+        self.assertEqual(loadtest.percentile([3], 0), 3)
+        self.assertIsNone(loadtest.percentile([], 50))
+
+
+class Test_Walker(unittest.TestCase):
+
+    def walk(self, pattern, steps=200):
+        walker = loadtest.Walker(MAP, pattern, random.Random(1), target=(1, 1))
+        pos, visited = [1, 1], []
+        for _ in range(steps):
+            pos = walker.next(pos) or pos
+            visited.append(pos)
+        return visited
+
+    def test_patterns_stay_on_traversable_cells(self):
+        for pattern in ("random", "patrol", "swarm"):
+            for row, col in self.walk(pattern):
+                self.assertEqual(MAP[row][col], " ")
+
+    def test_swarm_stays_near_target(self):
+        for row, col in self.walk("swarm"):
+            self.assertLessEqual(max(row - 1, col - 1), loadtest.SWARM_RADIUS)
+
+    def test_idle(self):
+        self.assertEqual(set(map(tuple, self.walk("idle", 5))), {(1, 1)})
+
+    def test_unknown_pattern(self):
+        with self.assertRaises(ValueError):
+            loadtest.Walker(MAP, "teleport", random.Random())
+
+
+class Test_Bot(unittest.TestCase):
+
+    def bot(self, wire):
+        bot = loadtest.Bot(loadtest.Walker(MAP, "patrol", random.Random(2)), wire)
+        replies = bot.handshake({ "id": 7, "pos": [1, 1], "protocols": protocol.PROTOCOLS })
+        self.assertEqual(replies[0].get("protocol"), wire)
+        return bot
+
+    def test_json_latency_and_jitter(self):
+        bot = self.bot(protocol.JSON)
+        command = bot.move(now=10.0)
+        seq, key = command["input"]
+        pos = bot.pos
+        self.assertEqual(seq, 1)
+        self.assertEqual((pos[0] - 1, pos[1] - 1), inputs.MOVES[key])
+
+        state = { "7": { "id": 7, "pos": [1, 1], "petrified": False } }
+        ack = bot.receive(json.dumps(delta.keyframe(60, state)), now=10.02)
+        self.assertEqual(ack, { "ack": 60 })
+        self.assertEqual(bot.latencies, [])
+
+        moved = { "7": { "id": 7, "pos": pos, "petrified": False } }
+        message = json.dumps(delta.delta(61, moved, moved, []))
+        self.assertIsNone(bot.receive(message, now=10.05))
+        self.assertEqual(len(bot.latencies), 1)
+        self.assertAlmostEqual(bot.latencies[0], 0.05)
+        self.assertEqual(len(bot.pending), 0)
+
+        # Answers to input commands are not broadcasts
+        self.assertIsNone(bot.receive(json.dumps({ "input": 1, "pos": pos }), now=10.06))
+        self.assertEqual(len(bot.offsets), 2)
+
+        # One tick later than the first frame, arriving 30ms later
+        self.assertAlmostEqual(bot.offsets[1], 0.03 - 1 / TICK_RATE)
+        self.assertEqual(bot.messages, 2)
+
+    def test_refused_move(self):
+        bot = self.bot(protocol.JSON)
+        first = bot.move(now=1.0)["input"]
+        second = bot.move(now=1.1)["input"]
+        self.assertEqual(list(bot.pending), [first[0], second[0]])
+
+        # The server refused the first move and hasn't seen the second yet
+        bot.receive(json.dumps({ "input": first[0], "pos": [1, 1] }), now=1.2)
+        self.assertEqual(list(bot.pending), [second[0]])
+        self.assertEqual(bot.pos, list(inputs.step((1, 1), second[1], bot.walker.passable)))
+
+        # Moves never seen in a broadcast expire
+        state = { "7": { "id": 7, "pos": [1, 1], "petrified": False } }
+        bot.receive(json.dumps(delta.keyframe(1, state)), now=1.1 + loadtest.PENDING_TIMEOUT + 0.1)
+        self.assertEqual(len(bot.pending), 0)
+
+    def test_binary_petrified(self):
+        bot = self.bot(protocol.BINARY)
+        state = { 7: { "id": 7, "pos": [1, 1], "reprchar": "@", "petrified": True } }
+        bot.receive(protocol.encode_keyframe(1, state.values()), now=0.0)
+        self.assertTrue(bot.petrified)
+        self.assertIsNone(bot.move(now=0.0))
+
+    def test_summarize(self):
+        bots = [ self.bot(protocol.JSON) for _ in range(2) ]
+        for bot in bots:
+            bot.bytes, bot.messages = 1000, 10
+            bot.latencies = [0.01, 0.02]
+        row = loadtest.summarize(bots, elapsed=2.0, cpu=0.5)
+        self.assertEqual(row["clients"], 2)
+        self.assertEqual(row["bytes_per_s"], 1000)
+        self.assertEqual(row["msgs_per_s"], 10)
+        self.assertEqual(row["latency_p50_ms"], 10.0)
+        self.assertEqual(row["server_cpu_pct"], 25.0)
+        self.assertIsNone(row["jitter_ms"])
+        self.assertEqual(len(loadtest.format_row(row).split()), len(loadtest.COLUMNS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import sys, os
+import math
+import random
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import lod
+
+class Test_LevelOfDetail(unittest.TestCase):
+
+    def setUp(self):
+        self.lod = lod.LevelOfDetail([(100, 4), (40, 1)])
+
+    def test_tiers(self):
+        self.assertEqual(self.lod.tier(0), 0)
+        self.assertEqual(self.lod.tier(40), 0)
+        self.assertEqual(self.lod.tier(40.5), 1)
+        self.assertEqual(self.lod.tier(100), 1)
+        self.assertEqual(self.lod.tier(101), self.lod.frozen)
+        self.assertEqual(self.lod.tier(math.inf), self.lod.frozen)
+
+    def test_due(self):
+        # Near ghosts move every step, far ones every 4th step spread by id
+        for step in range(8):
+            self.assertTrue(self.lod.due(7, 10, step))
+            self.assertFalse(self.lod.due(7, 500, step))
+        self.assertEqual([ step for step in range(8) if self.lod.due(7, 60, step) ], [1, 5])
+        self.assertEqual(sum(self.lod.due(id, 60, 0) for id in range(100)), 25)
+
+    def test_bad_divisor(self):
+        with self.assertRaises(ValueError):
+            lod.LevelOfDetail([(10, 0)])
+
+    @unittest.skipUnless(lod.np is not None, "numpy is not installed")
+    def test_due_mask(self):
+        rng = random.Random(1)
+        ids = list(range(200))
+        distances = [ rng.choice([rng.uniform(0, 150), math.inf]) for _ in ids ]
+        for step in range(4):
+            mask = self.lod.due_mask(lod.np.array(ids), lod.np.array(distances), step)
+            self.assertEqual(mask.tolist(), [ self.lod.due(id, d, step) for id, d in zip(ids, distances) ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game.pathfinding import FlowField, UNREACHABLE
+
+# A wall between the two halves with a single gap at the bottom, and a closed
+# room on the right
+MAP = [
+    "WWWWWWWWWWWW",
+    "W    W  W  W",
+    "W    W  WWWW",
+    "W    W     W",
+    "W          W",
+    "WWWWWWWWWWWW",
+]
+
+class Test_FlowField(unittest.TestCase):
+
+    def setUp(self):
+        self.field = FlowField(MAP, {" "}, len(MAP), len(MAP[0]))
+
+    def dist(self, pos):
+        return self.field.dist[self.field.index(pos)]
+
+    def test_distances_go_around_walls(self):
+        self.field.update({ 1: (1, 1) })
+        self.assertEqual(self.dist((1, 1)), 0)
+        self.assertEqual(self.dist((2, 2)), 1)
+        # 5 steps in a straight line, but the wall has to be walked around
+        # without cutting its corners
+        self.assertEqual(self.dist((1, 6)), 8)
+        self.assertEqual(self.dist((1, 9)), UNREACHABLE)
+        self.assertEqual(self.dist((0, 0)), UNREACHABLE)
+
+    def test_steps_follow_the_field(self):
+        self.field.update({ 1: (1, 1) })
+        pos = (1, 7)
+        for _ in range(20):
+            step = self.field.next_step(pos)
+            if step == (0, 0):
+                break
+            pos = (pos[0] + step[0], pos[1] + step[1])
+            self.assertTrue(self.field.is_passable(pos))
+        self.assertEqual(pos, (1, 1))
+
+        # Walls can't be passed even diagonally at their corners
+        self.assertEqual(self.field.next_step((1, 9)), (0, 0))
+
+    def test_repel(self):
+        self.field.update({ 1: (1, 1) })
+        step = self.field.next_step((2, 2), repel=True)
+        self.assertGreater(self.dist((2 + step[0], 2 + step[1])), 1)
+
+    def test_closest_player(self):
+        self.field.update({ 1: (1, 1), 2: (1, 7) })
+        self.assertEqual(self.field.closest((3, 2)), 1)
+        self.assertEqual(self.field.closest((3, 8)), 2)
+        self.assertIsNone(self.field.closest((1, 10)))
+
+    def test_rebuild_only_on_cell_change(self):
+        self.assertTrue(self.field.update({ 1: (1, 1) }))
+        self.assertFalse(self.field.update({ 1: [1, 1] }))
+        self.assertTrue(self.field.update({ 1: (1, 2) }))
+        self.assertEqual(self.field.rebuilds, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
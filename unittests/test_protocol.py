@@ -0,0 +1,62 @@
+import unittest
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import protocol
+
+class Test_Protocol(unittest.TestCase):
+
+    def setUp(self):
+        self.states = [
+            { "reprchar": "3", "pos": [4, 4], "type": "item", "id": 0 },
+            { "pos": [7, 12], "reprchar": "Ǫ", "id": 1 },
+            { "pos": [8, 10], "reprchar": "@", "id": 8, "petrified": True, "items": [] },
+        ]
+
+    def rows(self, table):
+        return sorted(zip(table.ids, table.rows, table.cols, map(chr, table.glyphs), table.flags))
+
+    def test_negotiate(self):
+        self.assertEqual(protocol.negotiate([protocol.JSON, protocol.BINARY]), protocol.BINARY)
+        self.assertEqual(protocol.negotiate(["bin9"]), protocol.JSON)
+
+    def test_roundtrip(self):
+        payload = protocol.encode_delta(42, self.states, [3, 5])
+        frame = protocol.decode(payload)
+        self.assertEqual((frame.kind, frame.tick), (protocol.DELTA, 42))
+        self.assertEqual(list(frame.ids), [0, 1, 8])
+        self.assertEqual(list(frame.rows), [4, 7, 8])
+        self.assertEqual(list(frame.cols), [4, 12, 10])
+        self.assertEqual("".join(map(chr, frame.glyphs)), "3Ǫ@")
+        self.assertEqual(list(frame.flags), [protocol.ITEM, 0, protocol.PETRIFIED | protocol.PLAYER])
+        self.assertEqual(list(frame.removed), [3, 5])
+
+        # 11 bytes per entity and 4 per removed id
+        self.assertEqual(len(payload), protocol.HEADER.size + 3 * 11 + 2 * 4)
+
+    def test_bad_version(self):
+        payload = bytearray(protocol.encode_keyframe(0, self.states))
+        payload[0] = 99
+        with self.assertRaises(ValueError):
+            protocol.decode(bytes(payload))
+
+    def test_entity_table(self):
+        table = protocol.EntityTable()
+        table.apply(protocol.decode(protocol.encode_keyframe(1, self.states)))
+        self.assertEqual(len(table), 3)
+
+        self.states[1]["pos"] = [8, 12]
+        moved = { "pos": [1, 1], "reprchar": "@", "id": 9, "petrified": False, "items": [] }
+        table.apply(protocol.decode(protocol.encode_delta(2, [self.states[1], moved], [0])))
+        self.assertEqual(self.rows(table), [
+            (1, 8, 12, "Ǫ", 0),
+            (8, 8, 10, "@", protocol.PETRIFIED | protocol.PLAYER),
+            (9, 1, 1, "@", protocol.PLAYER),
+        ])
+        self.assertEqual(table.flags_of(8), protocol.PETRIFIED | protocol.PLAYER)
+        self.assertIsNone(table.flags_of(0))
+        self.assertEqual({ id: table.ids[slot] for id, slot in table.index.items() }, { 1: 1, 8: 8, 9: 9 })
+
+
+if __name__ == "__main__":
+    unittest.main()
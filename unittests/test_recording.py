@@ -0,0 +1,107 @@
+import unittest
+import sys, os
+import asyncio
+import random
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import recording, protocol, store
+
+TICKS = 25
+
+def contents(table):
+    return {
+        id: (table.rows[slot], table.cols[slot], table.glyphs[slot])
+        for id, slot in table.index.items()
+    }
+
+class Test_Recording(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "session.rec")
+
+        # Record a world of moving ghosts where an entity is removed on tick
+        # 12 and another joins on tick 17, keeping the expected state of
+        # every tick
+        rng = random.Random(3)
+        entities = store.EntityStore()
+        for id in range(10):
+            entities.add(id, store.GHOST, (id, id), "g")
+        self.expected = {}
+        recorder = recording.Recorder(self.path, chunk_ticks=10)
+        for tick in range(1, TICKS + 1):
+            changed, removed = [], []
+            for id in rng.sample(sorted(entities), 3):
+                entities[id].col += 1
+                changed.append(id)
+            if tick == 12:
+                entities.remove(4)
+                if 4 in changed:
+                    changed.remove(4)
+                removed.append(4)
+            if tick == 17:
+                entities.add(50, store.PLAYER, (5, 5), "@")
+                changed.append(50)
+            recorder.record(tick, entities, changed, removed)
+            self.expected[tick] = {
+                id: (record.row, record.col, ord(record.reprchar))
+                for id, record in entities.items()
+            }
+        recorder.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_index(self):
+        with recording.Recording(self.path) as rec:
+            self.assertEqual([ (c.first_tick, c.last_tick) for c in rec.chunks ], [(1, 10), (11, 20), (21, 25)])
+            self.assertEqual(rec.chunks[0].frames, 10)
+            self.assertEqual(rec.chunk_at(15), 1)
+            self.assertIsNone(rec.chunk_at(0))
+            self.assertIsNone(rec.chunk_at(26))
+
+    def test_state_at_every_tick(self):
+        with recording.Recording(self.path) as rec:
+            for tick in reversed(range(1, TICKS + 1)):
+                self.assertEqual(contents(rec.state_at(tick)), self.expected[tick], tick)
+            with self.assertRaises(KeyError):
+                rec.state_at(TICKS + 1)
+
+    def test_frames_from_any_tick(self):
+        with recording.Recording(self.path) as rec:
+            for start in (1, 11, 14):
+                table = protocol.EntityTable()
+                frames = [ protocol.decode(payload) for payload in rec.frames(start, end=22) ]
+                self.assertEqual(frames[0].kind, protocol.KEYFRAME)
+                self.assertEqual(frames[0].tick, start)
+                ticks = [ frame.tick for frame in frames ]
+                self.assertEqual(ticks, sorted(set(ticks)))
+                for frame in frames:
+                    table.apply(frame)
+                    self.assertEqual(contents(table), self.expected[frame.tick])
+                self.assertEqual(ticks[-1], 22)
+
+    def test_play(self):
+        async def collect():
+            with recording.Recording(self.path) as rec:
+                return [ payload async for payload in recording.play(rec.frames(), speed=0) ]
+        self.assertEqual(len(asyncio.run(collect())), TICKS)
+
+    def test_truncated_chunk_is_ignored(self):
+        size = os.path.getsize(self.path)
+        with open(self.path, "r+b") as fp:
+            fp.truncate(size - 5)
+        with recording.Recording(self.path) as rec:
+            self.assertEqual(len(rec.chunks), 2)
+            self.assertEqual(rec.last_tick, 20)
+
+    def test_not_a_recording(self):
+        with open(self.path, "wb") as fp:
+            fp.write(b"{}")
+        with self.assertRaises(ValueError):
+            recording.Recording(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+import sys, os
+import io
+import random
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game.render import Map, FrameBuffer
+
+TERRAIN = """\
+██████████
+█        █
+█  ▐▐    █
+█        █
+██████████
+"""
+
+class Test_Map(unittest.TestCase):
+
+    def setUp(self):
+        self.map = Map(io.StringIO(TERRAIN))
+
+    def rebuilt(self, entities):
+        # What the map used to do on every message: copy the terrain and
+        # stamp every entity in
+        rows = [ list(row) for row in TERRAIN.splitlines() ]
+        for _, row, col, char in entities:
+            rows[row][col] = char
+        return rows
+
+    def test_place_move_remove(self):
+        self.map.place(1, 1, 1, "@")
+        self.map.place(2, 1, 1, "Ǫ")
+        self.assertEqual(self.map.glyph(1, 1), "Ǫ")
+        self.map.place(2, 3, 4, "Ǫ")
+        self.assertEqual(self.map.glyph(1, 1), "@")
+        self.assertEqual(self.map.glyph(3, 4), "Ǫ")
+        self.map.remove(1)
+        self.assertEqual(self.map.glyph(1, 1), " ")
+        self.assertEqual(len(self.map), 1)
+        # The terrain never changes
+        self.assertEqual(self.map.data, tuple(TERRAIN.splitlines()))
+
+    def test_passable(self):
+        self.assertTrue(self.map.passable((1, 1)))
+        self.assertFalse(self.map.passable((2, 3)))
+        self.assertFalse(self.map.passable((-1, 1)))
+        self.assertFalse(self.map.passable((1, 10)))
+        self.map.place(1, 1, 1, "Ǫ")
+        self.assertFalse(self.map.passable((1, 1)))
+        self.map.place(2, 1, 2, "3")
+        self.assertTrue(self.map.passable((1, 2)))
+
+    def test_update_entities(self):
+        self.map.update_entities([(1, 1, 1, "@"), (2, 2, 5, "Ǫ")])
+        self.map.update_entities([(2, 3, 5, "Ǫ"), (3, 1, 8, "3")])
+        self.assertEqual(self.map.glyph(1, 1), " ")
+        self.assertEqual(self.map.glyph(2, 5), " ")
+        self.assertEqual(self.map.glyph(3, 5), "Ǫ")
+        self.assertEqual(len(self.map), 2)
+
+        self.map.update_data({ "4": { "pos": [2, 2], "reprchar": "#" } })
+        self.assertEqual(self.map.window(0, 0, 5, 10), self.rebuilt([(4, 2, 2, "#")]))
+
+    def test_window_matches_rebuild(self):
+        rng = random.Random(3)
+        for _ in range(20):
+            entities = [ (id, rng.randrange(1, 4), rng.randrange(1, 9), rng.choice("@#Ǫ")) for id in range(6) ]
+            self.map.update_entities(entities)
+            full = self.rebuilt(entities)
+            self.assertEqual(self.map.window(0, 0, 5, 10), full)
+            self.assertEqual(self.map.window(1, 2, 3, 4), [ row[2:6] for row in full[1:4] ])
+
+
+class Test_FrameBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.map = Map(io.StringIO(TERRAIN))
+        self.map.update_entities([(1, 1, 1, "@"), (2, 3, 8, "Ǫ")])
+
+    def test_draw_matches_window(self):
+        frame = FrameBuffer(3, 6)
+        rows = frame.rows
+        for top, left in [(0, 0), (1, 3), (2, 4), (0, 1)]:
+            self.map.draw(frame.rows, top, left)
+            self.assertEqual(frame.rows, self.map.window(top, left, 3, 6))
+        # Drawn in place
+        self.assertIs(frame.rows, rows)
+        self.assertEqual(frame.lines()[0], "██████")
+
+    def test_off_the_map_is_blank(self):
+        frame = FrameBuffer(7, 12)
+        self.map.draw(frame.rows, 0, 0)
+        self.assertEqual(frame.lines()[0], "██████████  ")
+        self.assertEqual(frame.lines()[6], " " * 12)
+
+    def test_resize(self):
+        frame = FrameBuffer(3, 4)
+        rows = frame.rows
+        self.assertFalse(frame.resize(3, 4))
+        self.assertIs(frame.rows, rows)
+        self.assertTrue(frame.resize(5, 4))
+        self.assertEqual((len(frame.rows), len(frame.rows[0])), (5, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
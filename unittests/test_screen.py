@@ -0,0 +1,129 @@
+import unittest
+import sys, os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game.screen import Screen, FrameScheduler, changed_spans
+
+class Window:
+
+    def __init__(self):
+        self.writes = []
+        self.clears = 0
+        self.refreshes = 0
+
+    def addstr(self, y, x, text):
+        self.writes.append((y, x, text))
+
+    def clear(self):
+        self.clears += 1
+
+    def noutrefresh(self):
+        self.refreshes += 1
+
+class Test_ChangedSpans(unittest.TestCase):
+
+    def test_spans(self):
+        self.assertEqual(changed_spans("abcdef", "abcdef"), [])
+        self.assertEqual(changed_spans("abcdefghij", "aXcdefghiY"), [(1, 2), (9, 10)])
+        # Changes a few cells apart are written together
+        self.assertEqual(changed_spans("abcdef", "aXcYef"), [(1, 4)])
+        self.assertEqual(changed_spans("abc", "abcde"), [(3, 5)])
+        self.assertEqual(changed_spans("", "abc"), [(0, 3)])
+
+class Test_Screen(unittest.TestCase):
+
+    def setUp(self):
+        self.window = Window()
+        self.updates = []
+        self.screen = Screen(self.window, update=lambda: self.updates.append(1))
+
+    def test_only_changes_are_written(self):
+        frame = ["....", ".@..", "...."]
+        self.screen.draw(frame)
+        self.assertEqual(self.window.clears, 1)
+        self.assertEqual(len(self.window.writes), 3)
+
+        self.window.writes.clear()
+        self.screen.draw(list(frame))
+        self.assertEqual(self.window.writes, [])
+
+        self.screen.draw(["....", "..@.", "...."])
+        self.assertEqual(self.window.writes, [(1, 1, ".@")])
+        self.assertEqual(self.screen.cells_written, 14)
+        self.assertEqual((self.window.refreshes, len(self.updates)), (3, 3))
+
+    def test_resize_repaints(self):
+        self.screen.draw(["..", ".."])
+        self.window.writes.clear()
+        self.screen.draw(["...", "...", "..."])
+        self.assertEqual(self.window.clears, 2)
+        self.assertEqual(self.window.writes, [(0, 0, "..."), (1, 0, "..."), (2, 0, "...")])
+
+        self.screen.invalidate()
+        self.screen.draw(["...", "...", "..."])
+        self.assertEqual(self.screen.repaints, 3)
+
+
+class Test_FrameScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.now = 0.0
+        self.frames = FrameScheduler(max_fps=10, clock=lambda: self.now)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_wait(self, timeout=0.05):
+        return self.loop.run_until_complete(asyncio.wait_for(self.frames.wait(), timeout))
+
+    def test_idle_blocks(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_wait()
+        self.assertEqual(self.frames.frames, 0)
+
+    def test_requests_share_a_frame(self):
+        for _ in range(5):
+            self.frames.request()
+        self.run_wait()
+        self.assertEqual((self.frames.frames, self.frames.requests), (1, 5))
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_wait()
+
+    def test_max_fps(self):
+        self.frames.request()
+        self.run_wait()
+
+        # The next frame waits out the rest of the 0.1 s interval
+        self.now = 0.09
+        self.frames.request()
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_wait(timeout=0.001)
+        self.now = 0.1
+        self.run_wait()
+        self.assertEqual(self.frames.frames, 2)
+
+    def test_pending_input_does_not_spin(self):
+        read, write = os.pipe()
+        self.addCleanup(os.close, read)
+        self.addCleanup(os.close, write)
+        frames = FrameScheduler(max_fps=20)
+
+        async def run():
+            frames.watch(read)
+            os.write(write, b"w")
+            await frames.wait()
+
+            # The key is never read. It requests the next frame once instead
+            # of on every pass of the loop while the frame waits out the cap
+            await frames.wait()
+            await asyncio.sleep(0.02)
+            return frames.requests
+
+        self.assertEqual(self.loop.run_until_complete(run()), 2)
+        self.assertEqual(frames.frames, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
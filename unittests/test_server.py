@@ -0,0 +1,275 @@
+import unittest
+import sys, os
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import weakref
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import server
+from game import store
+from game import connection
+from game import protocol
+
+class Test_Rooms(unittest.TestCase):
+
+    def setUp(self):
+        self.assertEqual(server.rooms, {})
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        for room in list(server.rooms.values()):
+            server.close_room(room)
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def clear_ghosts(self, room):
+        # Out of the way of the players
+        for id in room.clients.ids[store.GHOST]:
+            room.set_position(id, (100, 100))
+
+    def test_rooms_are_isolated(self):
+        first = server.assign_room("/first")
+        second = server.assign_room("/second")
+        self.assertIs(server.assign_room("/first/"), first)
+
+        player, conn = first.join("ws")
+        self.assertEqual(len(first.clients.ids[store.GHOST]), server.GHOST_COUNT)
+        self.assertEqual(len(second.clients.ids[store.GHOST]), server.GHOST_COUNT)
+        self.assertEqual(first.player_ids, {player.id})
+        self.assertEqual(second.player_ids, set())
+
+        # Only the room's own connections are sent its state
+        self.loop.run_until_complete(first.scheduler.step())
+        self.loop.run_until_complete(second.scheduler.step())
+        self.assertEqual(len(conn.outbox), 1)
+
+        # Picking up an item only takes it out of that room
+        first.move_player(player.id, (4, 4))
+        self.assertEqual(len(player.items), 1)
+        self.assertEqual(len(first.clients.ids[store.ITEM]), 0)
+        self.assertEqual(len(second.clients.ids[store.ITEM]), 1)
+
+    def test_assign_public_rooms(self):
+        first = server.assign_room("/")
+        for i in range(server.ROOM_CAPACITY):
+            self.assertIs(server.assign_room("/"), first)
+            first.join(i)
+        second = server.assign_room("")
+        self.assertIsNot(second, first)
+        self.assertTrue(second.public)
+
+        # Named rooms are never assigned to clients that didn't ask for them
+        named = server.assign_room("/co-op")
+        self.assertFalse(named.public)
+        first.leave(0)
+        self.assertIs(server.assign_room("/"), first)
+        self.assertIs(server.assign_room("/not a room name"), first)
+
+    def test_input_commands(self):
+        room = server.assign_room("/inputs")
+        room.passable = lambda pos: pos != (2, 4)
+        self.clear_ghosts(room)
+        player, conn = room.join("ws")
+        self.assertEqual(list(player.pos), [2, 2])
+
+        # One command is applied per tick, and never through a wall
+        for seq, key in enumerate("ddds", 1):
+            conn.inputs.push(seq, key)
+        for tick in range(2):
+            room.input_system(tick)
+        self.assertEqual(tuple(player.pos), (2, 3))
+        self.assertEqual(conn.inputs.processed, 2)
+        room.input_system(2)
+        self.assertEqual(tuple(player.pos), (2, 3))
+        room.input_system(3)
+        self.assertEqual(tuple(player.pos), (3, 3))
+        self.assertFalse(conn.inputs.pending)
+
+        # Petrified players don't move, but their commands are processed
+        player.petrified = True
+        conn.inputs.push(5, "w")
+        room.input_system(4)
+        self.assertEqual(tuple(player.pos), (3, 3))
+        self.assertEqual(player.reprchar, "X")
+        self.assertEqual(conn.inputs.processed, 5)
+
+    def test_blocked_moves(self):
+        room = server.assign_room("/blocked")
+        self.clear_ghosts(room)
+        player, conn = room.join("ws")
+        other, _ = room.join("other")
+        room.move_player(other.id, (3, 2))
+        ghost = next(iter(room.clients.ids[store.GHOST]))
+        room.set_position(ghost, (2, 3))
+
+        # Ghosts and other players block the way like walls
+        conn.inputs.push(1, "d")
+        room.input_system(0)
+        conn.inputs.push(2, "s")
+        room.input_system(1)
+        self.assertEqual(tuple(player.pos), (2, 2))
+        conn.inputs.push(3, "a")
+        room.input_system(2)
+        self.assertEqual(tuple(player.pos), (2, 1))
+
+        # Malformed commands are dropped
+        self.assertFalse(conn.inputs.push(4, ["d"]))
+        self.assertFalse(conn.inputs.push(None, "d"))
+
+    def test_ghosts_freeze_without_players(self):
+        map_rows, vectorized = server.map_rows, server.VECTORIZED_GHOSTS
+        server.map_rows = [" " * server.MAP_COLS] * server.MAP_ROWS
+        try:
+            for server.VECTORIZED_GHOSTS in {False, vectorized}:
+                room = server.assign_room("/empty")
+                player, _ = room.join("ws")
+                ghost = next(iter(room.clients.ids[store.GHOST]))
+                room.set_position(ghost, tuple(player.pos))
+                room.ghost_ai_system(0)
+                room.leave("ws")
+
+                # The flow field still holds the distances to the player
+                # that left, but no ghost moves any more
+                self.assertEqual(room.ghost_distance(ghost), float("inf"))
+                positions = { id: tuple(room.clients[id].pos) for id in room.clients.ids[store.GHOST] }
+                for tick in range(0, 8 * server.BROWNIAN_DIVISOR, server.BROWNIAN_DIVISOR):
+                    room.brownian_system(tick)
+                    room.ghost_ai_system(tick)
+                self.assertEqual({ id: tuple(room.clients[id].pos) for id in positions }, positions)
+                server.close_room(room)
+        finally:
+            server.map_rows, server.VECTORIZED_GHOSTS = map_rows, vectorized
+
+    def test_reap_failed_room(self):
+        class Socket:
+            closed = None
+            async def close(self, code, reason):
+                self.closed = code
+
+        failed = server.assign_room("/failed")
+        other = server.assign_room("/other")
+        ws = Socket()
+        failed.join(ws)
+
+        async def fail():
+            raise EOFError("shard died")
+        failed.task.cancel()
+        failed.task = asyncio.ensure_future(fail())
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+        # Only the failed room is closed, and its players disconnected
+        with contextlib.redirect_stderr(io.StringIO()), contextlib.redirect_stdout(io.StringIO()):
+            server.reap_rooms(self.loop.time())
+        self.assertEqual(set(server.rooms), {"other"})
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(ws.closed, 1011)
+        self.assertFalse(other.task.done())
+
+    def test_dead_shard_closes_only_its_room(self):
+        shards = server.SHARDS
+        server.SHARDS = 1
+        try:
+            broken = server.assign_room("/broken")
+            other = server.assign_room("/other")
+        finally:
+            server.SHARDS = shards
+        process = broken.shard_pool.processes[0]
+        process.kill()
+        process.join()
+
+        # The room's tick loop fails on the dead shard, and closing the room
+        # doesn't fail on it again
+        with contextlib.redirect_stderr(io.StringIO()), contextlib.redirect_stdout(io.StringIO()):
+            self.loop.run_until_complete(asyncio.wait([broken.task], timeout=2))
+            self.assertTrue(broken.task.done())
+            server.reap_rooms(self.loop.time())
+        self.assertEqual(set(server.rooms), {"other"})
+        self.assertFalse(other.task.done())
+
+    def test_shards_need_plain_ghosts(self):
+        settings = (server.SHARDS, server.FLOW_FIELD, server.GHOST_LOD_TIERS)
+        try:
+            server.SHARDS = 2
+            self.assertRaises(ValueError, server.check_config)
+            server.FLOW_FIELD = False
+            self.assertRaises(ValueError, server.check_config)
+            server.GHOST_LOD_TIERS = None
+            server.check_config()
+            server.SHARDS, server.FLOW_FIELD, server.GHOST_LOD_TIERS = settings
+            server.check_config()
+        finally:
+            server.SHARDS, server.FLOW_FIELD, server.GHOST_LOD_TIERS = settings
+
+    def test_max_rooms(self):
+        for i in range(server.MAX_ROOMS):
+            self.assertIsNotNone(server.assign_room(f"/room{i}"))
+        self.assertIsNone(server.assign_room("/one-too-many"))
+        self.assertIsNotNone(server.assign_room("/room0"))
+
+    def test_reap_idle_rooms(self):
+        idle = server.assign_room("/idle")
+        busy = server.assign_room("/busy")
+        busy.join("ws")
+        task = idle.task
+        now = self.loop.time()
+
+        server.reap_rooms(now)
+        self.assertEqual(set(server.rooms), {"idle", "busy"})
+        server.reap_rooms(now + server.ROOM_IDLE_TIMEOUT + 1)
+        self.assertEqual(set(server.rooms), {"busy"})
+
+        # Nothing keeps the closed room alive once its task has stopped
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertTrue(task.cancelled())
+        ref = weakref.ref(idle)
+        del idle, task
+        gc.collect()
+        self.assertIsNone(ref())
+
+        # The last player leaving starts the idle timeout
+        busy.leave("ws")
+        server.reap_rooms(self.loop.time() + server.ROOM_IDLE_TIMEOUT + 1)
+        self.assertEqual(server.rooms, {})
+
+
+class Test_ClientMessage(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = connection.Connection("ws", 1)
+
+    def test_control_messages(self):
+        server.client_message(self.conn, json.dumps({
+            "view": [24, 80], "protocol": protocol.BINARY, "rate": 20, "input": [1, "d"], "stale": 3,
+        }))
+        self.assertEqual(self.conn.stale_frames, 3)
+        self.assertEqual(self.conn.protocol, protocol.BINARY)
+        self.assertEqual(self.conn.rate, 20)
+        self.assertEqual(len(self.conn.inputs), 1)
+
+    def test_malformed_messages_are_ignored(self):
+        before = (self.conn.interest.half_rows, self.conn.interest.half_cols)
+        for message in [
+            "not json", b"\xff", "[1, 2]", "null",
+            { "view": "ab" }, { "view": [24] }, { "view": ["24", 80] }, { "view": [-1, 80] },
+            { "protocol": ["bin1"] }, { "rate": "fast" }, { "rate": None }, { "rate": 0 },
+            { "ack": "x" }, { "ack": [1] }, { "input": "d" }, { "input": [1, ["d"]] },
+            { "stale": None }, { "stale": [1] }, { "stale": -1 }, { "stale": 1.5 },
+        ]:
+            if isinstance(message, dict):
+                message = json.dumps(message)
+            server.client_message(self.conn, message)
+
+        self.assertEqual((self.conn.interest.half_rows, self.conn.interest.half_cols), before)
+        self.assertEqual(self.conn.protocol, protocol.JSON)
+        self.assertEqual(self.conn.rate, connection.RATES[0])
+        self.assertEqual(len(self.conn.inputs), 0)
+        self.assertEqual(self.conn.stale_frames, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
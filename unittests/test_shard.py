@@ -0,0 +1,76 @@
+import unittest
+import sys, os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import shard
+
+class Test_Region(unittest.TestCase):
+
+    def setUp(self):
+        self.region = shard.Region(100, 200, 160, 300, petrified_radius=4, repel_radius=10)
+
+    def step(self, players=(), arrivals=(), replicas=(), ai=False, jitter=False, petrify=False):
+        return self.region.step({
+            "ai": ai, "jitter": jitter, "petrify": petrify,
+            "players": list(players), "arrivals": list(arrivals), "replicas": list(replicas),
+        })
+
+    def test_chase_and_handoff(self):
+        reply = self.step(players=[(1, 50, 50)], arrivals=[(7, 50, 100), (8, 60, 150)], ai=True)
+        self.assertEqual(sorted(reply["moved"]), [(7, 50, 99), (8, 59, 149)])
+        self.assertEqual(reply["handoffs"], [(7, 50, 99)])
+        self.assertNotIn(7, self.region.ghosts)
+        self.assertIn(8, self.region.ghosts)
+
+    def test_repel(self):
+        reply = self.step(players=[(1, 50, 150), (2, 52, 150)], arrivals=[(7, 60, 150)], ai=True)
+        self.assertEqual(reply["moved"], [(7, 61, 150)])
+
+    def test_border_replicas(self):
+        reply = self.step(arrivals=[(7, 50, 101), (8, 50, 150), (9, 50, 198)])
+        self.assertEqual(sorted(reply["border"]), [(7, 50, 101), (9, 50, 198)])
+
+        # A player at the left edge sees ghosts on both sides of the border
+        reply = self.step(players=[(1, 50, 100)], replicas=[(20, 50, 98), (21, 50, 90)], petrify=True)
+        self.assertEqual(reply["counts"], { 1: 2 })
+
+        # Players outside the band belong to another shard
+        reply = self.step(players=[(1, 50, 99)], petrify=True)
+        self.assertEqual(reply["counts"], {})
+
+
+class Test_ShardPool(unittest.TestCase):
+
+    def test_handoff_between_processes(self):
+        pool = shard.ShardPool(2, 160, 300, petrified_radius=4, repel_radius=10)
+        try:
+            pool.spawn(7, (50, 151))
+            self.assertEqual(pool.arrivals[1], [(7, 50, 151)])
+
+            async def run():
+                players = [(1, 50, 10)]
+                first = await pool.step(players, ai=True, jitter=False, petrify=True)
+                second = await pool.step(players, ai=True, jitter=False, petrify=True)
+                return first, second
+
+            (moved, counts), (moved_again, _) = asyncio.run(run())
+            self.assertEqual(moved, [(7, 50, 150)])
+            self.assertEqual(counts, { 1: 0 })
+
+            # Walked out of the right shard, handed to the left one next step
+            self.assertEqual(moved_again, [(7, 50, 149)])
+            self.assertEqual(pool.arrivals, [[(7, 50, 149)], []])
+        finally:
+            pool.close()
+
+    def test_close_with_dead_shard(self):
+        pool = shard.ShardPool(2, 160, 300, petrified_radius=4, repel_radius=10)
+        pool.processes[0].kill()
+        pool.processes[0].join()
+        pool.close()
+        self.assertFalse(any(process.is_alive() for process in pool.processes))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import sys, os
+import math
+import random
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game.spatial import SpatialHash
+
+class Test_SpatialHash(unittest.TestCase):
+
+    # Brute force versions of the server's linear scans
+
+    def brute_within(self, origin, radius, inclusive=True):
+        ids = [
+            id for id, pos in self.points.items()
+            if math.dist(origin, pos) < radius or (inclusive and math.dist(origin, pos) == radius)
+        ]
+        return sorted(ids, key=lambda x: math.dist(origin, self.points[x]))
+
+    def brute_nearest_distance(self, origin, exclude=None):
+        return min(math.dist(origin, pos) for id, pos in self.points.items() if id != exclude)
+
+    def setUp(self):
+        self.random = random.Random(2021)
+        self.grid = SpatialHash(8)
+        self.points = {}
+        for id in range(300):
+            self.points[id] = (self.random.randint(0, 159), self.random.randint(0, 299))
+            self.grid.insert(id, self.points[id])
+
+    def random_origin(self):
+        return (self.random.randint(-10, 170), self.random.randint(-10, 310))
+
+    def test_within_radius(self):
+        for _ in range(200):
+            origin = self.random_origin()
+            radius = self.random.choice([0, 1, 4, 10, 8, 33.5])
+            self.assertEqual(
+                sorted(self.grid.within_radius(origin, radius)),
+                sorted(self.brute_within(origin, radius))
+            )
+            self.assertEqual(
+                self.grid.count_within(origin, radius, inclusive=False),
+                len(self.brute_within(origin, radius, inclusive=False))
+            )
+
+    def test_sorted_by_distance(self):
+        origin = (80, 150)
+        distances = [ math.dist(origin, self.points[id]) for id in self.grid.within_radius(origin, 40) ]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_nearest(self):
+        for _ in range(200):
+            origin = self.random_origin()
+            nearest = self.grid.nearest(origin)
+            self.assertEqual(math.dist(origin, self.points[nearest]), self.brute_nearest_distance(origin))
+
+    def test_nearest_sparse(self):
+        grid = SpatialHash(8)
+        grid.insert("a", (0, 0))
+        grid.insert("b", (150, 290))
+        self.assertEqual(grid.nearest((140, 250)), "b")
+        self.assertEqual(grid.nearest((140, 250), exclude="b"), "a")
+        self.assertIsNone(SpatialHash().nearest((0, 0)))
+
+    def test_move_and_remove(self):
+        for id in range(0, 300, 3):
+            self.points[id] = self.random_origin()
+            self.grid.move(id, self.points[id])
+        for id in range(1, 300, 3):
+            del self.points[id]
+            self.grid.remove(id)
+
+        self.assertEqual(len(self.grid), len(self.points))
+        for _ in range(100):
+            origin = self.random_origin()
+            self.assertEqual(
+                sorted(self.grid.within_radius(origin, 10)),
+                sorted(self.brute_within(origin, 10))
+            )
+            exclude = self.random.choice(list(self.points))
+            nearest = self.grid.nearest(origin, exclude=exclude)
+            self.assertNotEqual(nearest, exclude)
+            self.assertEqual(
+                math.dist(origin, self.points[nearest]),
+                self.brute_nearest_distance(origin, exclude=exclude)
+            )
+
+        # Every id is in exactly one cell
+        indexed = [ id for bucket in self.grid.cells.values() for id in bucket ]
+        self.assertEqual(sorted(indexed), sorted(self.points))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import sys, os
+import asyncio
+import json
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game import stats
+
+def histogram(*values):
+    h = stats.Histogram(bounds=(1, 2, 4, 8))
+    for value in values:
+        h.observe(value)
+    return h
+
+REPORT = {
+    "loop_lag": histogram().to_dict(),
+    "rooms": {
+        "picklehacks": {
+            "ticks": { "tick": 120, "rate": 60, "overruns": 2, "dropped": 0, "drift": 0.001,
+                       "duration": histogram(0.5, 3).to_dict() },
+            "systems": { "broadcast": histogram(0.5).to_dict() },
+            "entities": { "players": 1, "ghosts": 40, "items": 1 },
+            "connections": [
+                { "player": 41, "protocol": "bin1", "rate": 30, "frames_sent": 10,
+                  "frames_dropped": 1, "bytes_sent": 2048, "latency": None,
+                  "stale_frames": 3 },
+            ],
+        },
+    },
+}
+
+class Test_Histogram(unittest.TestCase):
+
+    def test_buckets(self):
+        h = histogram(0.5, 1, 1.5, 3, 100)
+        self.assertEqual(h.counts, [2, 1, 1, 0, 1])
+        self.assertEqual(h.count, 5)
+        self.assertEqual(h.max, 100)
+        self.assertAlmostEqual(h.mean, 106 / 5)
+
+    def test_percentile(self):
+        h = histogram(*([0.5] * 98 + [3, 7]))
+        self.assertEqual(h.percentile(50), 1)
+        self.assertEqual(h.percentile(99), 4)
+        self.assertEqual(h.percentile(100), 7)
+        self.assertEqual(histogram(100).percentile(50), 100)
+        self.assertEqual(histogram().percentile(50), 0.0)
+
+    def test_to_dict(self):
+        self.assertEqual(histogram(0.5, 100).to_dict()["buckets"], [[1, 1], [None, 1]])
+
+
+class Test_Endpoint(unittest.TestCase):
+
+    def test_format_text(self):
+        text = stats.format_text(REPORT)
+        self.assertIn("rooms 1", text)
+        self.assertIn("room picklehacks", text)
+        self.assertIn("overruns 2", text)
+        self.assertIn("ghosts 40", text)
+        self.assertIn("broadcast", text)
+        self.assertIn("bin1", text)
+
+    def test_serve(self):
+        async def get(path):
+            server = await stats.serve("localhost", 0, lambda: REPORT)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                reader, writer = await asyncio.open_connection("localhost", port)
+                writer.write(f"GET {path} HTTP/1.0\r\nHost: localhost\r\n\r\n".encode())
+                response = await reader.read()
+                writer.close()
+                return response.decode().split("\r\n\r\n", 1)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        head, body = asyncio.run(get("/json"))
+        self.assertIn("200 OK", head)
+        self.assertEqual(json.loads(body), REPORT)
+
+        head, body = asyncio.run(get("/"))
+        self.assertIn("text/plain", head)
+        self.assertEqual(body, stats.format_text(REPORT))
+
+    def test_rotating_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "stats.jsonl")
+            logger = stats.rotating_log(path, max_bytes=2000, backups=2)
+            for _ in range(10):
+                logger.info(json.dumps(REPORT))
+            for handler in logger.handlers:
+                handler.close()
+
+            self.assertTrue(os.path.exists(path + ".1"))
+            self.assertFalse(os.path.exists(path + ".3"))
+            with open(path) as fp:
+                for line in fp:
+                    self.assertEqual(json.loads(line), REPORT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import sys, os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game.tick import Scheduler
+
+class Test_Scheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.scheduler = Scheduler(rate=60, clock=lambda: 0.0)
+
+    def record(self, name):
+        return lambda tick: self.calls.append((tick, name))
+
+    def run_ticks(self, count, catching_up=False):
+        for _ in range(count):
+            asyncio.run(self.scheduler.step(catching_up))
+
+    def test_order_and_divisor(self):
+        self.scheduler.add_system("ai", self.record("ai"), divisor=3)
+        self.scheduler.add_system("jitter", self.record("jitter"), divisor=2)
+        self.scheduler.add_system("broadcast", self.record("broadcast"))
+        self.run_ticks(6)
+        self.assertEqual(self.calls, [
+            (1, "broadcast"),
+            (2, "jitter"), (2, "broadcast"),
+            (3, "ai"), (3, "broadcast"),
+            (4, "jitter"), (4, "broadcast"),
+            (5, "broadcast"),
+            (6, "ai"), (6, "jitter"), (6, "broadcast"),
+        ])
+
+    def test_coroutine_system(self):
+        async def system(tick):
+            await asyncio.sleep(0)
+            self.calls.append(tick)
+        self.scheduler.add_system("async", system)
+        self.run_ticks(2)
+        self.assertEqual(self.calls, [1, 2])
+
+    def test_catch_up(self):
+        self.scheduler.add_system("ai", self.record("ai"))
+        self.scheduler.add_system("broadcast", self.record("broadcast"), catch_up=False)
+        self.run_ticks(1, catching_up=True)
+        self.run_ticks(1)
+        self.assertEqual(self.calls, [(1, "ai"), (2, "ai"), (2, "broadcast")])
+        self.assertEqual(self.scheduler.systems[1].runs, 1)
+
+    def test_timings_and_overruns(self):
+        # Each system advances the clock by its own run time
+        now = [0.0]
+        self.scheduler.clock = lambda: now[0]
+        def slow(tick):
+            now[0] += 0.01 if tick == 2 else 0.001
+        self.scheduler.add_system("slow", slow)
+        self.run_ticks(3)
+
+        system = self.scheduler.systems[0]
+        self.assertEqual(system.durations.count, 3)
+        self.assertAlmostEqual(system.durations.max, 0.01)
+        self.assertEqual(self.scheduler.durations.count, 3)
+        self.assertEqual(self.scheduler.overruns, 0)
+
+        now[0] = 0.0
+        self.scheduler.systems[0].fn = lambda tick: now.__setitem__(0, now[0] + 0.05)
+        self.run_ticks(1)
+        self.assertEqual(self.scheduler.overruns, 1)
+
+    def test_run_offset_and_catch_up_yields(self):
+        # A scheduler that falls behind lets other tasks run between the
+        # ticks it catches up on. One started with an offset has not ticked
+        now = [0.0]
+        self.scheduler.clock = lambda: now[0]
+        other = Scheduler(rate=60, clock=lambda: now[0])
+        seen = set()
+
+        async def main():
+            tasks = [
+                asyncio.ensure_future(self.scheduler.run()),
+                asyncio.ensure_future(other.run(offset=10.0)),
+            ]
+            await asyncio.sleep(0)
+            self.assertEqual(self.scheduler.tick, 1)
+
+            now[0] = 3.5 / 60
+            while self.scheduler.tick < 4:
+                seen.add(self.scheduler.tick)
+                await asyncio.sleep(0)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run(main())
+        self.assertEqual(seen, {1, 2, 3})
+        self.assertEqual(other.tick, 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../"))
+
+from game.triggers import TriggerIndex
+
+class Test_TriggerIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TriggerIndex()
+        self.fired = []
+
+    def record(self, id, entity_id):
+        self.fired.append((id, entity_id))
+
+    def pick_up(self, id, entity_id):
+        self.fired.append((id, entity_id))
+        self.index.remove(id)
+
+    def test_fires_only_in_cell(self):
+        self.index.add("item", [4, 4], self.record)
+        self.assertEqual(self.index.fire(1, [4, 5]), 0)
+        self.assertEqual(self.index.fire(1, (4, 4)), 1)
+        self.assertEqual(self.fired, [("item", 1)])
+
+    def test_zone_fires_every_time(self):
+        self.index.add("zone", (2, 2), self.record)
+        self.index.fire(1, (2, 2))
+        self.index.fire(2, (2, 2))
+        self.assertEqual(self.fired, [("zone", 1), ("zone", 2)])
+
+    def test_callback_removes_triggers(self):
+        # The first trigger removes itself and the second removes the third,
+        # which then must not fire
+        self.index.add("a", (1, 1), self.pick_up)
+        self.index.add("b", (1, 1), lambda id, entity_id: self.index.discard("c"))
+        self.index.add("c", (1, 1), self.record)
+        self.assertEqual(self.index.fire(7, (1, 1)), 2)
+        self.assertEqual(self.fired, [("a", 7)])
+        self.assertNotIn("a", self.index)
+        self.assertEqual(self.index.fire(8, (1, 1)), 1)
+
+    def test_move_and_remove(self):
+        self.index.add("item", (1, 1), self.record)
+        self.index.move("item", (3, 3))
+        self.index.fire(1, (1, 1))
+        self.index.fire(1, (3, 3))
+        self.assertEqual(self.fired, [("item", 1)])
+
+        self.index.remove("item")
+        self.index.discard("item")
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.cells, {})
+
+
+if __name__ == "__main__":
+    unittest.main()